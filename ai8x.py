@@ -11,6 +11,8 @@ Contains the limits of the MAX78000 implementations and custom PyTorch modules t
 the limits into account.
 """
 
+import math
+
 import torch
 from torch import nn
 from torch.autograd import Function
@@ -22,12 +24,17 @@ dev = None
 
 class normalize:
     """
-    Normalize input to either [-128/128, +127/128] or [-128, +127]
+    Normalize input to either [-128/128, +127/128] or [-128, +127]. The input is either in the
+    range [0, 1], or uint8 data in [0, 255] (e.g., from `transforms.PILToTensor()`), which is
+    converted with a single allocation to the same result as `transforms.ToTensor()` would give.
     """
     def __init__(self, args):
         self.args = args
 
     def __call__(self, img):
+        if img.dtype == torch.uint8:
+            img = img.float().mul_(256. / 255.).sub_(128.).round_().clamp_(min=-128, max=127)
+            return img if self.args.act_mode_8bit else img.div_(128.)
         if self.args.act_mode_8bit:
             return img.sub(0.5).mul(256.).round().clamp(min=-128, max=127)
         return img.sub(0.5).mul(256.).round().clamp(min=-128, max=127).div(128.)
@@ -348,32 +355,80 @@ class OutputShiftSqueeze(nn.Module):
     """
     Return output_shift when not using quantization-aware training.
     """
-    def forward(self, _, x):  # pylint: disable=arguments-differ, no-self-use
+    def forward(self, _, x, _bias=None):  # pylint: disable=arguments-differ, no-self-use
         """Forward prop"""
         return x.squeeze(0)
 
 
+def abs_max(x):
+    """
+    Return max(abs(`x`)) without allocating a temporary copy of `x`.
+    """
+    return torch.max(x.max(), x.min().neg())
+
+
+def shift_histogram(x, boundaries):
+    """
+    Return the number of elements of abs(`x`) that fall into each of the intervals
+    defined by `boundaries` (right-closed).
+    """
+    return torch.bincount(torch.bucketize(x.abs().flatten(), boundaries),
+                          minlength=len(boundaries) + 1)
+
+
 class OutputShift(nn.Module):
     """
     Calculate the clamped output shift when adjusting during quantization-aware training.
-    """
-    def __init__(self, shift_quantile=1.0):
+    The weight and the (optional) bias are reduced separately, without concatenating them.
+    For `shift_quantile` < 1.0, the quantile is approximated by counting the parameters that
+    fall between powers of two, which is sufficient to determine the (integer) shift. The
+    upper neighbor is used when the interpolated quantile is ambiguous, so the approximated
+    shift is never smaller than the exact one.
+    In training mode, the shift is refreshed every `shift_interval` calls only.
+    """
+    def __init__(self, shift_quantile=1.0, shift_interval=1):
         super().__init__()
         self.shift_quantile = shift_quantile
+        self.shift_interval = shift_interval
+        self.steps = 0
+        self.boundaries = None
 
-    def forward(self, x, _):  # pylint: disable=arguments-differ, no-self-use
+    def forward(self, x, output_shift, bias=None):  # pylint: disable=arguments-differ
         """Forward prop"""
-        limit = torch.quantile(x.abs(), self.shift_quantile)
-        return -(1./limit).log2().floor().clamp(min=-15., max=15.)
+        if self.training and self.shift_interval > 1:
+            refresh = self.steps % self.shift_interval == 0
+            self.steps += 1
+            if not refresh:
+                return output_shift.squeeze(0)
+
+        if self.shift_quantile >= 1.0:
+            limit = abs_max(x)
+            if bias is not None:
+                limit = torch.max(limit, abs_max(bias))
+            return -(1./limit).log2().floor().clamp(min=-15., max=15.)
+
+        if self.boundaries is None or self.boundaries.device != x.device:
+            self.boundaries = torch.pow(2., torch.arange(-15., 16., device=x.device))
+        counts = shift_histogram(x, self.boundaries)
+        num_params = x.numel()
+        if bias is not None:
+            counts += shift_histogram(bias, self.boundaries)
+            num_params += bias.numel()
+        rank = math.ceil(self.shift_quantile * (num_params - 1))
+        bucket = (counts.cumsum(0) <= rank).sum()
+        return (bucket.to(x.dtype) - 15.).clamp(min=-15., max=15.)
 
 
 class OutputShiftONNX(nn.Module):
     """
     Calculate the clamped output shift when adjusting during quantization-aware training.
     """
-    def forward(self, x, _):  # pylint: disable=arguments-differ, no-self-use
+    def forward(self, x, _, bias=None):  # pylint: disable=arguments-differ, no-self-use
         """Forward prop"""
-        return -(1./x.abs().max()).log2().floor().clamp(min=-15., max=15.)
+        limit = x.abs().max()
+        if bias is not None:
+            limit = torch.max(limit, bias.abs().max())
+        return -(1./limit).log2().floor().clamp(min=-15., max=15.)
 
 
 class One(nn.Module):
@@ -479,9 +534,11 @@ class QuantizationAwareModule(nn.Module):
         self.pooling = pooling
 
         self.output_shift = nn.Parameter(torch.Tensor([0.]), requires_grad=False)
+        self.frozen_cache = None
         self.init_module(weight_bits, bias_bits, quantize_activation, shift_quantile)
 
-    def init_module(self, weight_bits, bias_bits, quantize_activation, shift_quantile):
+    def init_module(self, weight_bits, bias_bits, quantize_activation, shift_quantile,
+                    shift_interval=1):
         """Initialize model parameters"""
         if weight_bits is None and bias_bits is None and not quantize_activation:
             self.weight_bits = nn.Parameter(torch.Tensor([0]), requires_grad=False)
@@ -500,12 +557,16 @@ class QuantizationAwareModule(nn.Module):
                           f'quantize_activation: {quantize_activation}'
 
         self.shift_quantile = nn.Parameter(torch.Tensor([shift_quantile]), requires_grad=False)
+        self.shift_interval = shift_interval
         self.set_functions()
 
     def set_functions(self):
         """Set functions to be used wrt the model parameters"""
+        self.frozen_cache = None
+
         if self.adjust_output_shift.detach():
-            self.calc_out_shift = OutputShift(self.shift_quantile.detach().item())
+            self.calc_out_shift = OutputShift(self.shift_quantile.detach().item(),
+                                              self.shift_interval)
             self.calc_weight_scale = WeightScale()
         else:
             self.calc_out_shift = OutputShiftSqueeze()
@@ -523,27 +584,66 @@ class QuantizationAwareModule(nn.Module):
         self.quantize_pool, self.clamp_pool = \
             quantize_clamp_pool(self.pooling, self.quantize_activation.detach().item())
 
+    def quantize_parameters(self):
+        """
+        Return the quantized weight and bias and the output scale for the current parameters.
+        Also updates `output_shift`.
+        """
+        bias_r = self.op.bias.detach() if self.op.bias is not None else None
+        out_shift = self.calc_out_shift(self.op.weight.detach(), self.output_shift.detach(),
+                                        bias_r)
+        weight_scale = self.calc_weight_scale(out_shift)
+        out_scale = self.calc_out_scale(out_shift)
+
+        self.output_shift = nn.Parameter(out_shift.unsqueeze(0), requires_grad=False)
+
+        weight = self.clamp_weight(self.quantize_weight(weight_scale * self.op.weight))
+        bias = self.op.bias
+        if bias is not None:
+            bias = self.clamp_bias(self.quantize_bias(weight_scale * bias))
+
+        return weight, bias, out_scale
+
+    def frozen_cache_key(self):
+        """
+        Return a key that changes whenever the result of `quantize_parameters()` may change,
+        i.e., when any of the parameters is replaced or modified in place (optimizer step,
+        `load_state_dict()`, `model.to()`), or when the device configuration changes.
+        """
+        key = [id(dev), dev.simulate]
+        for p in (self.op.weight, self.op.bias, self.output_shift):
+            if p is None:
+                key.append(None)
+            else:
+                version = p._version  # pylint: disable=protected-access
+                key.append((p.data_ptr(), p.device, version))
+        for f in (self.calc_out_shift, self.calc_weight_scale, self.calc_out_scale,
+                  self.quantize_weight, self.clamp_weight, self.quantize_bias, self.clamp_bias):
+            key.append(id(f))
+        return tuple(key)
+
+    def frozen_parameters(self):
+        """
+        Return the cached quantized weight, bias and output scale when the module is frozen
+        (evaluation mode without gradients). The cache is rebuilt when the parameters change.
+        """
+        if self.frozen_cache is not None and self.frozen_cache[0] == self.frozen_cache_key():
+            return self.frozen_cache[1]
+
+        params = self.quantize_parameters()
+        self.frozen_cache = (self.frozen_cache_key(), params)
+        return params
+
     def forward(self, x):  # pylint: disable=arguments-differ
         """Forward prop"""
         if self.pool is not None:
             x = self.clamp_pool(self.quantize_pool(self.pool(x)))
         if self.op is not None:
-            if self.op.bias is not None:
-                bias_r = torch.flatten(self.op.bias.detach())
-                weight_r = torch.flatten(self.op.weight.detach())
-                params_r = torch.cat((weight_r, bias_r))
+            if not self.training and not torch.is_grad_enabled():
+                weight, bias, out_scale = self.frozen_parameters()
             else:
-                params_r = torch.flatten(self.op.weight.detach())
-            out_shift = self.calc_out_shift(params_r, self.output_shift.detach())
-            weight_scale = self.calc_weight_scale(out_shift)
-            out_scale = self.calc_out_scale(out_shift)
-
-            self.output_shift = nn.Parameter(out_shift.unsqueeze(0), requires_grad=False)
-
-            weight = self.clamp_weight(self.quantize_weight(weight_scale * self.op.weight))
-            bias = self.op.bias
-            if bias is not None:
-                bias = self.clamp_bias(self.quantize_bias(weight_scale * bias))
+                self.frozen_cache = None
+                weight, bias, out_scale = self.quantize_parameters()
 
             x = self.func(x, weight, bias, self.op.stride, self.op.padding,
                           self.op.dilation, self.op.groups)
@@ -1473,14 +1573,32 @@ class DevAI85(Device):
 
         self.MAX_AVG_POOL = 16
 
+        # Resources used by the hardware cost model (see ai8x_cost.py)
+        self.MAX_PROCESSORS = 64
+        self.KERNEL_MEMORY_DEPTH = 768  # kernel memory entries per processor
+        self.MAX_LAYERS = 32
+        self.KERNEL_WEIGHTS = 9  # 8-bit weights per kernel memory entry
+        self.DATA_MEMORY = 8192  # bytes per processor
+        self.BIAS_MEMORY = 2048  # bytes
+        self.CNN_CLOCK = 50000000  # Hz
+
     def __str__(self):
         return self.__class__.__name__
 
 
 class DevAI87(DevAI85):
     """
-    Implementation limits for MAX78002. For now, the same as MAX78000.
+    Implementation limits for MAX78002. For now, the same as MAX78000 except for the memory
+    sizes and the number of layers.
     """
+    def __init__(self, simulate, round_avg):
+        super().__init__(simulate, round_avg)
+
+        self.KERNEL_MEMORY_DEPTH = 4096
+        self.MAX_LAYERS = 128
+        self.DATA_MEMORY = 20480
+        self.BIAS_MEMORY = 8192
+
     def __str__(self):
         return self.__class__.__name__
 
@@ -1530,25 +1648,27 @@ def initiate_qat(m, qat_policy):
     Modify model `m` to start quantization aware training.
     """
     def _initiate_qat(m):
+        shift_interval = qat_policy['shift_interval'] if 'shift_interval' in qat_policy else 1
         for attr_str in dir(m):
             target_attr = getattr(m, attr_str)
             if isinstance(target_attr, QuantizationAwareModule):
                 if 'shift_quantile' in qat_policy:
                     target_attr.init_module(qat_policy['weight_bits'],
                                             qat_policy['weight_bits'],
-                                            True, qat_policy['shift_quantile'])
+                                            True, qat_policy['shift_quantile'], shift_interval)
                 else:
                     target_attr.init_module(qat_policy['weight_bits'],
-                                            qat_policy['weight_bits'], True, 1.0)
+                                            qat_policy['weight_bits'], True, 1.0, shift_interval)
                 if 'overrides' in qat_policy:
                     if attr_str in qat_policy['overrides']:
                         weight_field = qat_policy['overrides'][attr_str]['weight_bits']
                         if 'shift_quantile' in qat_policy:
                             target_attr.init_module(weight_field, weight_field,
-                                                    True, qat_policy['shift_quantile'])
+                                                    True, qat_policy['shift_quantile'],
+                                                    shift_interval)
                         else:
                             target_attr.init_module(weight_field,
-                                                    weight_field, True, 1.0)
+                                                    weight_field, True, 1.0, shift_interval)
 
                 setattr(m, attr_str, target_attr)
 
@@ -1603,6 +1723,7 @@ def fuse_bn_layers(m):
                 target_attr.op.weight.data = w_new
                 target_attr.op.bias.data = b_new
                 target_attr.bn = None
+                target_attr.frozen_cache = None
                 setattr(m, attr_str, target_attr)
 
     m.apply(_fuse_bn_layers)
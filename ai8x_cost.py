@@ -0,0 +1,282 @@
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Analytic hardware cost model for MAX78000 (device 85) and MAX78002 (device 87).
+
+A network is described as a list of layers (see `layers_from_arch()` for Once For All
+architecture dictionaries and `layers_from_model()` for any model built from `ai8x` or
+`ai8x_nas` modules), and `estimate()` returns the per-layer and total cost:
+* kernel memory: each processor stores the kernels of the input channels it handles, and each
+  kernel memory entry holds up to `KERNEL_WEIGHTS` 8-bit weights (one 3x3 or 1D kernel, or up
+  to 9 weights of a linear layer),
+* bias memory: one byte per output channel,
+* data memory: bytes per processor for the input and output of each layer (layers with more
+  than `MAX_PROCESSORS` channels use several passes, and wide outputs use 32 bits),
+* the number of multiply-accumulate operations (MACs), and
+* an estimated cycle count, assuming every processor computes one kernel for one output pixel
+  and output channel per clock.
+
+The results are estimates. The exact memory layout is determined by the synthesis tool.
+"""
+import math
+
+import torch
+from torch import nn
+
+import ai8x
+import ai8x_nas
+
+
+def get_device(device=None):
+    """
+    Return the implementation limits of `device` (85, 87, or an `ai8x.Device`), or of the
+    configured device if `device` is None.
+    """
+    if device is None:
+        dev = ai8x.dev
+    elif isinstance(device, ai8x.Device):
+        dev = device
+    elif device == 85:
+        dev = ai8x.DevAI85(simulate=False, round_avg=False)
+    elif device == 87:
+        dev = ai8x.DevAI87(simulate=False, round_avg=False)
+    else:
+        raise ValueError(f'The hardware cost model does not support device {device}.')
+    if not hasattr(dev, 'MAX_PROCESSORS'):
+        raise ValueError(f'The hardware cost model does not support {dev}.')
+    return dev
+
+
+def layer(name, in_channels, out_channels, kernel_weights, in_shape, out_shape, groups=1,
+          bias=True, wide=False, linear=False):
+    """
+    Return the description of a layer for `estimate()`. `kernel_weights` is the number of
+    weights of each kernel (e.g., 9 for 3x3), and `in_shape` and `out_shape` are the spatial
+    dimensions of the layer input (before pooling) and output.
+    """
+    return {'name': name, 'in_channels': int(in_channels), 'out_channels': int(out_channels),
+            'kernel_weights': int(kernel_weights), 'in_shape': tuple(in_shape),
+            'out_shape': tuple(out_shape), 'groups': int(groups), 'bias': bool(bias),
+            'wide': bool(wide), 'linear': bool(linear)}
+
+
+def layers_from_arch(arch):
+    """
+    Return the layers of the sequential Once For All architecture dictionary `arch` (see
+    `get_subnet_arch()` in models/ai85nasnet-sequential.py).
+    """
+    dimensions = arch['dimensions']
+    inp_2d = not (len(dimensions) == 1 or dimensions[1] == 1)
+    dims = (dimensions[0], dimensions[1]) if inp_2d else (dimensions[0], )
+
+    layers = []
+    last_width = arch['num_channels']
+    for u_ind, depth in enumerate(arch['depth_list']):
+        for l_ind in range(depth):
+            in_dims = dims
+            if u_ind != 0 and l_ind == 0:
+                dims = tuple(d // 2 for d in dims)
+
+            kernel_size = int(arch['kernel_list'][u_ind][l_ind])
+            width = arch['width_list'][u_ind][l_ind]
+            layers.append(layer(f'units.{u_ind}.layers.{l_ind}', last_width, width,
+                                kernel_size ** len(dims), in_dims, dims, bias=arch['bias']))
+            last_width = width
+
+    layers.append(layer('classifier', math.prod(dims) * last_width, arch['num_classes'], 1,
+                        (1, ), (1, ), bias=arch['bias'], wide=True, linear=True))
+    return layers
+
+
+def layers_from_model(model, dimensions):
+    """
+    Return the layers of `model` for inputs of shape `dimensions` (channels first, without
+    the batch dimension), in execution order. The layers are found by running one sample
+    through the model. For Once For All models, the currently sampled subnet is used.
+    """
+    names = {m: name for name, m in model.named_modules()}
+    layers = []
+
+    def _hook(m, inputs, output):
+        x = inputs[0]
+        if isinstance(m, ai8x_nas.OnceForAllModule):
+            if m.op is None:
+                in_channels = out_channels = x.shape[1]
+                kernel_weights = 0
+            else:
+                in_channels, out_channels = m.in_channels, m.out_channels
+                kernel_weights = int(m.kernel_size) ** (m.op.weight.dim() - 2)
+            groups = 1
+            bias = m.op is not None and m.op.bias is not None
+            linear = False
+        elif m.op is None:
+            in_channels = out_channels = x.shape[1]
+            kernel_weights = 0
+            groups = 1
+            bias = False
+            linear = False
+        elif isinstance(m.op, nn.Linear):
+            in_channels, out_channels = m.op.in_features, m.op.out_features
+            kernel_weights = 1
+            groups = 1
+            bias = m.op.bias is not None
+            linear = True
+        else:
+            in_channels, out_channels = m.op.in_channels, m.op.out_channels
+            kernel_weights = m.op.weight[0, 0].numel()
+            groups = m.op.groups
+            bias = m.op.bias is not None
+            linear = False
+
+        in_shape = x.shape[2:] if x.dim() > 2 else (1, )
+        out_shape = output.shape[2:] if output.dim() > 2 else (1, )
+        layers.append(layer(names[m], in_channels, out_channels, kernel_weights, in_shape,
+                            out_shape, groups=groups, bias=bias, wide=m.wide, linear=linear))
+
+    handles = []
+    for m in model.modules():
+        if isinstance(m, (ai8x.QuantizationAwareModule, ai8x_nas.OnceForAllModule)):
+            handles.append(m.register_forward_hook(_hook))
+
+    training = model.training
+    model.eval()
+    try:
+        param = next(model.parameters(), None)
+        with torch.no_grad():
+            model(torch.zeros((1, ) + tuple(dimensions),
+                              device=param.device if param is not None else 'cpu'))
+    finally:
+        for h in handles:
+            h.remove()
+        model.train(training)
+
+    return layers
+
+
+def estimate(layers, device=None):
+    """
+    Return the cost of each of the `layers` (a list of dictionaries), and the total cost of the
+    network on `device` (see `get_device()`).
+    """
+    dev = get_device(device)
+
+    costs = []
+    for lyr in layers:
+        in_channels = lyr['in_channels']
+        out_channels = lyr['out_channels']
+        processors = max(min(in_channels, dev.MAX_PROCESSORS), 1)
+        passes = math.ceil(in_channels / processors)
+        in_pixels = math.prod(lyr['in_shape'])
+        out_pixels = math.prod(lyr['out_shape'])
+
+        if lyr['linear']:
+            kernels = math.ceil(in_channels * out_channels / dev.KERNEL_WEIGHTS)
+            macs = in_channels * out_channels
+        else:
+            kernels = out_channels * (in_channels // lyr['groups']) \
+                * math.ceil(lyr['kernel_weights'] / dev.KERNEL_WEIGHTS)
+            macs = out_pixels * out_channels * (in_channels // lyr['groups']) \
+                * lyr['kernel_weights']
+        kernels_per_processor = math.ceil(kernels / processors)
+        out_bytes = math.ceil(out_channels / dev.MAX_PROCESSORS) * out_pixels
+        if lyr['wide']:
+            out_bytes *= 4
+
+        costs.append({
+            'name': lyr['name'],
+            'processors': processors,
+            'passes': passes,
+            'kernels': kernels,
+            'kernels_per_processor': kernels_per_processor,
+            'kernel_memory': kernels * dev.KERNEL_WEIGHTS,
+            'bias_memory': out_channels if lyr['bias'] else 0,
+            'data_memory': passes * in_pixels + out_bytes,
+            'macs': macs,
+            'cycles': (1 if lyr['linear'] else out_pixels) * max(kernels_per_processor, passes),
+        })
+
+    cycles = sum(c['cycles'] for c in costs)
+    totals = {
+        'layers': len(costs),
+        'kernels': sum(c['kernels'] for c in costs),
+        'max_kernels_per_processor': max((c['kernels_per_processor'] for c in costs),
+                                         default=0),
+        'kernel_memory': sum(c['kernel_memory'] for c in costs),
+        'bias_memory': sum(c['bias_memory'] for c in costs),
+        'data_memory': max((c['data_memory'] for c in costs), default=0),
+        'macs': sum(c['macs'] for c in costs),
+        'cycles': cycles,
+        'latency': cycles / dev.CNN_CLOCK,
+    }
+    return costs, totals
+
+
+def check_limits(totals, device=None):
+    """
+    Return a list of the resource limits of `device` that the network with the cost `totals`
+    exceeds (an empty list if it fits).
+    """
+    dev = get_device(device)
+    errors = []
+    if totals['layers'] > dev.MAX_LAYERS:
+        errors.append(f'{totals["layers"]} layers exceed the maximum of {dev.MAX_LAYERS}')
+    if totals['kernels'] > dev.MAX_PROCESSORS * dev.KERNEL_MEMORY_DEPTH \
+       or totals['max_kernels_per_processor'] > dev.KERNEL_MEMORY_DEPTH:
+        errors.append(f'{totals["kernels"]} kernels do not fit into the kernel memory '
+                      f'({dev.MAX_PROCESSORS}x{dev.KERNEL_MEMORY_DEPTH})')
+    if totals['bias_memory'] > dev.BIAS_MEMORY:
+        errors.append(f'{totals["bias_memory"]} bytes of bias exceed the bias memory '
+                      f'({dev.BIAS_MEMORY} bytes)')
+    if totals['data_memory'] > dev.DATA_MEMORY:
+        errors.append(f'{totals["data_memory"]} bytes of data per processor exceed the data '
+                      f'memory ({dev.DATA_MEMORY} bytes)')
+    return errors
+
+
+def check_constraint(totals, constraint, device=None):
+    """
+    Return True if the network with the cost `totals` meets the hardware constraints in the
+    dictionary `constraint`: `max_layers`, `max_kernel_memory`, `max_bias_memory`,
+    `max_data_memory` (bytes per processor), `max_macs`, `max_cycles`, `max_latency`
+    (seconds), and `fit_device` (True to require that the network fits into the device).
+    """
+    for key in ['layers', 'kernel_memory', 'bias_memory', 'data_memory', 'macs', 'cycles',
+                'latency']:
+        if 'max_' + key in constraint and totals[key] > constraint['max_' + key]:
+            return False
+    if constraint.get('fit_device', False) and check_limits(totals, device):
+        return False
+    return True
+
+
+def summary(costs, totals, device=None):
+    """
+    Return the per-layer and total cost as a printable table.
+    """
+    dev = get_device(device)
+    lines = [f'Hardware cost estimate for {dev}:',
+             f'{"Layer":<32} {"Proc":>4} {"Pass":>4} {"Kernels/Proc":>12} {"Kernel B":>9} '
+             f'{"Bias B":>6} {"Data B/Proc":>11} {"MACs":>11} {"Cycles":>9}']
+    for c in costs:
+        lines.append(f'{c["name"]:<32} {c["processors"]:>4} {c["passes"]:>4} '
+                     f'{c["kernels_per_processor"]:>12} {c["kernel_memory"]:>9} '
+                     f'{c["bias_memory"]:>6} {c["data_memory"]:>11} {c["macs"]:>11} '
+                     f'{c["cycles"]:>9}')
+    lines.append(f'Layers: {totals["layers"]} (max. {dev.MAX_LAYERS})')
+    lines.append(f'Kernel memory: {totals["kernel_memory"]} bytes, {totals["kernels"]} kernels '
+                 f'(max. {dev.MAX_PROCESSORS}x{dev.KERNEL_MEMORY_DEPTH})')
+    lines.append(f'Bias memory: {totals["bias_memory"]} bytes (max. {dev.BIAS_MEMORY})')
+    lines.append(f'Data memory: {totals["data_memory"]} bytes per processor '
+                 f'(max. {dev.DATA_MEMORY})')
+    lines.append(f'MACs: {totals["macs"]}')
+    lines.append(f'Cycles: {totals["cycles"]} ({1000. * totals["latency"]:.3f} ms at '
+                 f'{dev.CNN_CLOCK / 1e6:.0f} MHz)')
+    for error in check_limits(totals, dev):
+        lines.append(f'WARNING: {error}')
+    return '\n'.join(lines)
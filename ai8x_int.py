@@ -0,0 +1,415 @@
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Integer-only inference engine for ai8x models.
+
+A trained, BN-fused and quantized model that is configured to simulate the hardware
+(`ai8x.set_device(..., simulate=True)`, i.e., `--8-bit-mode`) is converted in place so that
+every `ai8x` layer runs on weights that are packed once, using the output shift, rounding
+and clamping semantics of the device. The results are bit-exact with the floating point
+emulation in `ai8x.py`.
+
+All activations are integers. They are held in float32 tensors, which represent every
+integer below 2**24 exactly, so the fast native float32 convolution and matrix product
+kernels compute the sums of products. During packing, the largest possible sum of each
+layer is determined from its weights and the 8-bit input range:
+* When the layer output fits into the 24-bit mantissa, the output shift and the rounding of
+  the activation quantization are folded into the packed weights and bias (both are scaled
+  by powers of two, which is exact), and the ReLU is folded into the clamping. The layer
+  then runs one convolution followed by an in-place floor and clamp, instead of the chain of
+  float operators of the emulation.
+* Otherwise, and for layers with `Abs` activation, the input channels are split into groups
+  whose partial sums fit into the mantissa. The partial sums are added, shifted, rounded and
+  clamped as int64 tensors. Grouped convolutions that cannot be split use float64.
+
+The sums are exact when every partial sum is exact, which holds for direct and GEMM-based
+convolution. The engine therefore runs on the CPU: on CUDA devices, cuDNN may select
+Winograd or FFT algorithms or TF32 math, which round intermediate results.
+
+Model code outside of the `ai8x` modules (e.g., `view()`, `torch.cat()`) runs unchanged on
+the integer-valued tensors. Operators that the hardware does not support (e.g.,
+`torch.sigmoid()`) are not supported either.
+"""
+import torch
+from torch import nn
+
+import ai8x
+
+INPUT_BITS = 8
+FLOAT32_EXACT_BITS = 24
+
+
+def round_shift(x, shift):
+    """
+    Return floor(`x` / 2**`shift` + 0.5) for integer tensor `x` (`shift` may be negative).
+    """
+    if shift > 0:
+        return (x + (1 << (shift - 1))) >> shift
+    if shift < 0:
+        return x << -shift
+    return x
+
+
+def quantize_shift(quantize):
+    """
+    Return the right shift (with rounding) of the `ai8x.Quantize` (simulation mode) module
+    `quantize`, or None for `ai8x.Empty`.
+    """
+    if isinstance(quantize, ai8x.Empty):
+        return None
+    if isinstance(quantize, ai8x.Quantize):
+        if quantize.num_bits == 1:
+            return 0
+        return int(quantize.num_bits + quantize.num_extra_bit_shift - 1)
+    raise NotImplementedError(f'Integer inference does not support {type(quantize).__name__} '
+                              '(is the device configured with simulate=True?)')
+
+
+def int_quantize(x, quantize):
+    """
+    Integer version of the `ai8x.Quantize` (simulation mode) and `ai8x.Empty` modules.
+    """
+    shift = quantize_shift(quantize)
+    return x if shift is None else round_shift(x, shift)
+
+
+def int_clamp(x, clamp):
+    """
+    Integer version of the `ai8x.Clamp` and `ai8x.Empty` modules.
+    """
+    if isinstance(clamp, ai8x.Empty):
+        return x
+    if isinstance(clamp, ai8x.Clamp):
+        return x.clamp(min=None if clamp.min_val is None else int(clamp.min_val),
+                       max=None if clamp.max_val is None else int(clamp.max_val))
+    raise NotImplementedError(f'Integer inference does not support {type(clamp).__name__}')
+
+
+def int_activate(x, activate):
+    """
+    Integer version of the activation modules returned by `ai8x.get_activation()`.
+    """
+    if isinstance(activate, ai8x.Empty):
+        return x
+    if isinstance(activate, nn.ReLU):
+        return x.clamp(min=0)
+    if isinstance(activate, ai8x.Abs):
+        return x.abs()
+    raise NotImplementedError(f'Integer inference does not support {type(activate).__name__}')
+
+
+def to_activation(x):
+    """
+    Convert the integer-valued tensor `x` to the float32 data type used for activations.
+    """
+    if x.is_floating_point():
+        return x.to(torch.float32).round()
+    return x.to(torch.float32)
+
+
+def split_channels(weight_bounds, limit):
+    """
+    Split the input channels into consecutive ranges such that for every output channel,
+    the sum of `weight_bounds` (the largest possible magnitude of the products of each
+    output and input channel) over each range stays below `limit`. Return the list of
+    ranges, or None if a single channel exceeds `limit`.
+    """
+    if weight_bounds.max() >= limit:
+        return None
+    ranges = []
+    start = 0
+    total = torch.zeros_like(weight_bounds[:, 0])
+    for c in range(weight_bounds.shape[1]):
+        total += weight_bounds[:, c]
+        if total.max() >= limit:
+            ranges.append((start, c))
+            start = c
+            total = weight_bounds[:, c].clone()
+    ranges.append((start, weight_bounds.shape[1]))
+    return ranges
+
+
+class IntPool(nn.Module):
+    """
+    Integer pooling including the rounding and clamping of the ai8x pooling stage
+    """
+    def __init__(self, pool, quantize_pool, clamp_pool):
+        super().__init__()
+        self.pool = pool
+        self.quantize_pool = quantize_pool
+        self.clamp_pool = clamp_pool
+
+        self.is_avg = isinstance(pool, (nn.AvgPool1d, nn.AvgPool2d))
+        if self.is_avg and not isinstance(quantize_pool, (ai8x.AvgPoolFloor, ai8x.Round)):
+            raise NotImplementedError('Integer inference does not support '
+                                      f'{type(quantize_pool).__name__} after AvgPool')
+
+    def forward(self, x):  # pylint: disable=arguments-differ
+        """Forward prop"""
+        x = self.pool(x)
+        if self.is_avg:
+            # The sums of up to 256 8-bit inputs are exact, and the quotient is never rounded
+            # across an integer or half-integer boundary, so rounding it is exact
+            if isinstance(self.quantize_pool, ai8x.AvgPoolFloor):
+                x = x.trunc_()  # Round towards zero
+            else:
+                x = x.round_()  # Round half to even
+        return int_clamp(x, self.clamp_pool)
+
+
+class IntQuantizationAwareModule(nn.Module):
+    """
+    Integer version of an `ai8x.QuantizationAwareModule` with pre-packed weights
+    """
+    def __init__(self, m):
+        super().__init__()
+
+        if m.bn is not None:
+            raise ValueError('Integer inference requires fused batchnorm layers '
+                             '(see ai8x.fuse_bn_layers())')
+
+        self.wide = m.wide
+        self.activate = m.activate
+        self.quantize = m.quantize
+        self.clamp = m.clamp
+        self.pool = IntPool(m.pool, m.quantize_pool, m.clamp_pool) if m.pool is not None \
+            else None
+        self.func = m.func
+        self.op_args = None
+        self.output_shift = 0
+        self.fused = False
+        self.floor = False
+        self.out_scale = 1.
+        self.clamp_min = None
+        self.clamp_max = None
+        self.channel_ranges = None
+        self.is_transposed = False
+
+        if m.op is None:
+            self.register_buffer('weight', None)
+            self.register_buffer('bias', None)
+            self.weight_compute = []
+            self.register_buffer('bias_compute', None)
+            return
+
+        self.op_args = (m.op.stride, m.op.padding, m.op.dilation, m.op.groups)
+        self.is_transposed = isinstance(m.op, nn.ConvTranspose2d)
+        with torch.no_grad():
+            weight, bias, _ = m.quantize_parameters()
+            output_shift = m.output_shift.item()
+        weight, bias = weight.cpu(), bias.cpu() if bias is not None else None
+        if output_shift != int(output_shift):
+            raise ValueError(f'Output shift {output_shift} is not an integer')
+        self.output_shift = int(output_shift)
+
+        if not torch.equal(weight, weight.round()):
+            raise ValueError('Integer inference requires quantized weights')
+        if weight.min() < -128 or weight.max() > 127:
+            raise ValueError('Quantized weights exceed the 8-bit range')
+        self.register_buffer('weight', weight.to(torch.int8))
+        if bias is not None:
+            if not torch.equal(bias, bias.round()):
+                raise ValueError('Integer inference requires quantized bias values')
+            bias = bias.to(torch.int64)
+        self.register_buffer('bias', bias)
+
+        # Largest possible magnitude of the products of each output and input channel for
+        # 8-bit inputs, and of any sum of products including the bias
+        weight_bounds = self.weight.to(torch.int64).abs()
+        if weight_bounds.dim() > 2:
+            weight_bounds = weight_bounds.flatten(2).sum(dim=2)
+        if self.is_transposed:
+            weight_bounds = weight_bounds.t()
+        weight_bounds = weight_bounds << (INPUT_BITS - 1)
+        acc_bound = int(weight_bounds.sum(dim=1).max().item())
+        if bias is not None:
+            acc_bound += int(bias.abs().max().item())
+
+        if not self.pack_fused(acc_bound):
+            self.pack_split(weight_bounds)
+
+    def pack_fused(self, acc_bound):
+        """
+        Fold the output shift, rounding and ReLU into the weights and bias, if the layer
+        output is exact in float32. Return True on success.
+        """
+        if not isinstance(self.activate, (ai8x.Empty, nn.ReLU)):
+            return False
+        shift = quantize_shift(self.quantize)
+
+        # The output is floor(sum * 2**scale + offset) * 2**out_shift, see int_forward()
+        scale = 0 if self.wide else self.output_shift
+        offset = 0
+        out_shift = 0
+        if shift is not None and shift > 0:
+            scale -= shift
+            offset = 1
+        elif shift is not None:
+            out_shift = -shift
+
+        # All sums of products are multiples of the smallest step, 2**min(scale, -1) with an
+        # offset of 1/2 and 2**scale without, and must not exceed 24 bits in these units
+        if offset:
+            step = min(scale, -1)
+            bound = (acc_bound << (scale - step)) + (1 << (-1 - step))
+        else:
+            bound = acc_bound
+        if bound >= 1 << FLOAT32_EXACT_BITS:
+            return False
+
+        self.fused = True
+        self.floor = offset != 0 or scale < 0
+        self.out_scale = 2. ** out_shift
+        if isinstance(self.clamp, ai8x.Clamp):
+            self.clamp_min, self.clamp_max = self.clamp.min_val, self.clamp.max_val
+        elif not isinstance(self.clamp, ai8x.Empty):
+            raise NotImplementedError('Integer inference does not support '
+                                      f'{type(self.clamp).__name__}')
+        if isinstance(self.activate, nn.ReLU):
+            self.clamp_min = 0 if self.clamp_min is None else max(self.clamp_min, 0)
+
+        self.weight_compute = [(self.weight.to(torch.float64) * 2. ** scale).to(torch.float32)]
+        if self.bias is not None or offset:
+            bias = self.bias.to(torch.float64) if self.bias is not None \
+                else torch.zeros(self.weight.shape[1 if self.is_transposed else 0],
+                                 dtype=torch.float64)
+            self.register_buffer('bias_compute', (bias * 2. ** scale + offset / 2.)
+                                 .to(torch.float32))
+        else:
+            self.register_buffer('bias_compute', None)
+        return True
+
+    def pack_split(self, weight_bounds):
+        """
+        Split the input channels such that the partial sums are exact in float32 (see
+        `split_channels()`). Grouped convolutions are not split, and use float64 if needed.
+        """
+        self.register_buffer('bias_compute', None)
+        groups = self.op_args[3]
+        limit = 1 << FLOAT32_EXACT_BITS
+        if groups in (None, 1):
+            self.channel_ranges = split_channels(weight_bounds, limit)
+        elif weight_bounds.sum(dim=1).max() < limit:
+            self.channel_ranges = [(0, weight_bounds.shape[1])]
+
+        if self.channel_ranges is None:
+            self.weight_compute = [self.weight.to(torch.float64)]
+        elif len(self.channel_ranges) == 1:
+            self.weight_compute = [self.weight.to(torch.float32)]
+        else:
+            weight = self.weight.to(torch.float32)
+            self.weight_compute = [weight[start:stop] if self.is_transposed
+                                   else weight[:, start:stop].contiguous()
+                                   for start, stop in self.channel_ranges]
+
+    def int_forward(self, x):
+        """
+        Compute the integer sums of products of the input `x` and apply the output shift,
+        activation, quantization and clamping
+        """
+        if self.channel_ranges is None:
+            x = self.func(x.to(torch.float64), self.weight_compute[0], None, *self.op_args)
+            x = x.to(torch.int64)
+        elif len(self.channel_ranges) == 1:
+            x = self.func(x, self.weight_compute[0], None, *self.op_args).to(torch.int64)
+        else:
+            acc = 0
+            for (start, stop), weight in zip(self.channel_ranges, self.weight_compute):
+                acc = acc + self.func(x[:, start:stop], weight, None,
+                                      *self.op_args).to(torch.int64)
+            x = acc
+        if self.bias is not None:
+            x = x + self.bias.view((-1, ) + (1, ) * (x.dim() - 2))
+        if not self.wide:
+            # The device does not apply output shift in wide mode
+            if self.output_shift >= 0:
+                x = x << self.output_shift
+            else:
+                x = x >> -self.output_shift
+        x = int_clamp(int_quantize(int_activate(x, self.activate), self.quantize), self.clamp)
+        return x.to(torch.float32)
+
+    def forward(self, x):  # pylint: disable=arguments-differ
+        """Forward prop"""
+        if self.pool is not None:
+            x = self.pool(x)
+        if self.weight is None:
+            return x
+        if not self.fused:
+            return self.int_forward(x)
+
+        x = self.func(x, self.weight_compute[0], self.bias_compute, *self.op_args)
+        if self.floor:
+            x = x.floor_()
+        if self.out_scale != 1.:
+            x = x.mul_(self.out_scale)
+        if self.clamp_min is not None or self.clamp_max is not None:
+            x = x.clamp_(min=self.clamp_min, max=self.clamp_max)
+        return x
+
+
+class IntEltwise(nn.Module):
+    """
+    Integer version of the `ai8x.Add` and `ai8x.Sub` element-wise operations
+    """
+    def __init__(self, m):
+        super().__init__()
+        if isinstance(m, ai8x.Add):
+            self.f = torch.add
+        elif isinstance(m, ai8x.Sub):
+            self.f = torch.sub
+        else:
+            raise NotImplementedError(f'Integer inference does not support {type(m).__name__}')
+        self.clamp = m.clamp
+
+    def forward(self, *x):
+        """Forward prop"""
+        y = x[0]
+        for i in range(1, len(x)):
+            y = self.f(y, x[i])
+
+        return int_clamp(y, self.clamp)
+
+
+def int_input_hook(_, inputs):
+    """
+    Forward pre-hook that converts the (integer-valued) model inputs to activation tensors
+    """
+    for x in inputs:
+        if isinstance(x, torch.Tensor) and x.device.type != 'cpu':
+            raise ValueError('Integer inference runs on the CPU')
+    return tuple(to_activation(x) if isinstance(x, torch.Tensor) else x for x in inputs)
+
+
+def convert(m):
+    """
+    Convert model `m` in place for integer-only inference on the CPU and return it. The
+    device must be configured to simulate the hardware, and the model must be BN-fused and
+    quantized. The converted model accepts and returns float tensors on the CPU (like the
+    `--8-bit-mode` model); all internal computations use integer values.
+    """
+    if not ai8x.dev.simulate:
+        raise ValueError('Integer inference requires the device to be configured with '
+                         'simulate=True (--8-bit-mode)')
+
+    def _convert(m):
+        for attr_str in dir(m):
+            target_attr = getattr(m, attr_str)
+            if isinstance(target_attr, ai8x.QuantizationAwareModule):
+                setattr(m, attr_str, IntQuantizationAwareModule(target_attr))
+            elif isinstance(target_attr, ai8x.Eltwise):
+                setattr(m, attr_str, IntEltwise(target_attr))
+            elif isinstance(target_attr, ai8x.FusedSoftwareLinearReLU):
+                raise NotImplementedError('Integer inference does not support SoftwareLinear')
+
+    m.eval()
+    m.apply(_convert)
+    m.cpu()
+    m.register_forward_pre_hook(int_input_hook)
+    return m
@@ -58,8 +58,10 @@ class OnceForAllModule(nn.Module):
             self.kernel_list = []
             self.padding_list = []
             self.ktm_list = torch.nn.ParameterList()
-            self.in_ch_order = torch.arange(self.in_channels)
-            self.out_ch_order = torch.arange(self.out_channels)
+            # The weights are never permuted; subnets gather their channels in this order
+            self.register_buffer('in_ch_order', torch.arange(self.in_channels), persistent=False)
+            self.register_buffer('out_ch_order', torch.arange(self.out_channels),
+                                 persistent=False)
 
             if op.__class__.__name__.endswith('1d'):
                 kernel_size = self.max_kernel_size - 2
@@ -85,6 +87,13 @@ class OnceForAllModule(nn.Module):
             else:
                 assert False, f'Unknown operation for OFA module: {op}'
 
+            # Python copies of the kernel options, so that forward() does not read the device
+            self.max_kernel = self.max_kernel_size
+            self.kernel_options = {k: (k_idx, pad) for k_idx, (k, pad)
+                                   in enumerate(zip(self.kernel_list, self.padding_list))}
+            # Subnet weights computed without gradients, by kernel size (see `get_weight()`)
+            self.weight_cache = {}
+
             # parameters to store in the checkpoint file
             self.max_kernel_size = nn.Parameter(data=torch.Tensor(self.max_kernel_size),
                                                 requires_grad=False)
@@ -117,11 +126,9 @@ class OnceForAllModule(nn.Module):
 
     def sample_subnet_kernel(self, level):
         """OFA Elastic kernel search strategy"""
-        kernel_opts = [int(self.max_kernel_size.detach().cpu().item())]
-        kernel_list = self.kernel_list.detach().cpu().numpy()
-        k_level = level if level >= 0 else kernel_list.size
-        for i in range(k_level):
-            kernel_opts.append(int(kernel_list[i]))
+        kernel_list = list(self.kernel_options)
+        k_level = level if level >= 0 else len(kernel_list)
+        kernel_opts = [self.max_kernel] + kernel_list[:k_level]
         with torch.no_grad():
             self.kernel_size = random.choice(kernel_opts)
 
@@ -130,80 +137,114 @@ class OnceForAllModule(nn.Module):
         with torch.no_grad():
             self.set_kernel_size(self.op.weight.shape[2])
 
-    def set_out_ch_order(self, inds, reset_order=False):
-        """Set order of the output channel of the operators"""
-        if reset_order:
-            self.reset_out_ch_order()
-            self.out_ch_order = inds
-        else:
-            self.out_ch_order = self.out_ch_order[inds]
-
-        self.op.weight.data = self.op.weight.data[inds]
-        if self.op.bias is not None:
-            self.op.bias.data = self.op.bias.data[inds]
-        if self.bn is not None:
-            self.bn.weight.data = self.bn.weight.data[inds]
-            self.bn.bias.data = self.bn.bias.data[inds]
-            self.bn.running_mean.data = self.bn.running_mean.data[inds]
-            self.bn.running_var.data = self.bn.running_var.data[inds]
+    def set_out_ch_order(self, inds):
+        """
+        Set order of the output channels of the operators. A subnet with fewer output channels
+        uses the first `out_channels` channels of `inds`.
+        """
+        self.out_ch_order = inds
 
     def reset_out_ch_order(self):
-        """Reset order of the output channel of the operators"""
-        reset_ind = torch.argsort(self.out_ch_order)
-        self.set_out_ch_order(reset_ind)
-
-    def set_in_ch_order(self, inds, reset_order=False):
-        """Set order of the input channel of the operators"""
-        if reset_order:
-            self.reset_in_ch_order()
-            self.in_ch_order = inds
-        else:
-            self.in_ch_order = self.in_ch_order[inds]
+        """Reset order of the output channels of the operators"""
+        self.out_ch_order = torch.arange(self.op.weight.shape[0], device=self.op.weight.device)
 
-        self.op.weight.data = self.op.weight.data[:, inds]
+    def set_in_ch_order(self, inds):
+        """
+        Set order of the input channels of the operators, which must be the output channel
+        order of the preceding layer
+        """
+        self.in_ch_order = inds
 
     def reset_in_ch_order(self):
-        """Reset order of the input channel of the operators"""
-        reset_ind = torch.argsort(self.in_ch_order)
-        self.set_in_ch_order(reset_ind)
+        """Reset order of the input channels of the operators"""
+        self.in_ch_order = torch.arange(self.op.weight.shape[1], device=self.op.weight.device)
+
+    def compute_weight(self):
+        """
+        Returns the weight of the sampled subnet: the channels selected in the order of
+        `in_ch_order` and `out_ch_order`, transformed to the sampled kernel size
+        """
+        weight = self.op.weight
+        if self.in_channels < weight.shape[1]:
+            weight = weight.index_select(1, self.in_ch_order[:self.in_channels])
+        if self.out_channels < weight.shape[0]:
+            weight = weight.index_select(0, self.out_ch_order[:self.out_channels])
+
+        if self.kernel_size != self.max_kernel:
+            k_idx, _ = self.kernel_options[self.kernel_size]
+            if weight.dim() == 4:
+                weight = weight.reshape(weight.size(0), weight.size(1), -1,
+                                        self.max_kernel**2)
+            weight = weight @ self.ktm_list[k_idx]
+        return weight
+
+    def get_weight(self):
+        """
+        Returns the weight of the sampled subnet (see `compute_weight()`). When gradients are
+        disabled (e.g., during subnet evaluation), the weight is cached per kernel size until
+        the subnet, the channel orders or the weights change.
+        """
+        if self.kernel_size == self.max_kernel and self.in_channels == self.op.weight.shape[1] \
+           and self.out_channels == self.op.weight.shape[0]:
+            return self.op.weight
+        if torch.is_grad_enabled():
+            return self.compute_weight()
+
+        # In-place updates (optimizer steps, `load_state_dict()`) increment the version
+        # pylint: disable=protected-access
+        state = [self.in_channels, self.out_channels, self.op.weight.data_ptr(),
+                 self.op.weight._version]
+        if self.kernel_size != self.max_kernel:
+            ktm = self.ktm_list[self.kernel_options[self.kernel_size][0]]
+            state += [ktm.data_ptr(), ktm._version]
+        # pylint: enable=protected-access
+
+        cached = self.weight_cache.get(self.kernel_size)
+        if cached is None or cached[0] != state or cached[1] is not self.in_ch_order \
+           or cached[2] is not self.out_ch_order:
+            cached = (state, self.in_ch_order, self.out_ch_order, self.compute_weight())
+            self.weight_cache[self.kernel_size] = cached
+        return cached[3]
 
     def forward(self, x):  # pylint: disable=arguments-differ
         """Forward prop"""
         if self.pool is not None:
             x = self.clamp_pool(self.quantize_pool(self.pool(x)))
         if self.op is not None:
-            weight = self.op.weight[:self.out_channels, :self.in_channels]
+            # Layers of full width use the channels in storage order, subnets gather theirs
+            out_inds = self.out_ch_order[:self.out_channels] \
+                if self.out_channels < self.op.weight.shape[0] else None
+            weight = self.get_weight()
             bias = self.op.bias
-            if bias is not None:
-                bias = bias[:self.out_channels]
+            if out_inds is not None and bias is not None:
+                bias = bias.index_select(0, out_inds)
 
-            if self.kernel_size == int(self.max_kernel_size.detach().cpu().item()):
-                x = self.func(x, weight, bias, self.op.stride, self.max_pad_size, self.op.dilation,
-                              self.op.groups)
-            else:
-                for k_idx, k_size in enumerate(self.kernel_list):
-                    if k_size == self.kernel_size:
-                        break
-                if weight.dim() == 4:
-                    flattened_weight = weight.view(weight.size(0), weight.size(1), -1,
-                                                   self.max_kernel_size**2)
-                else:
-                    flattened_weight = weight
-                # pylint: disable=undefined-loop-variable
-                weight = flattened_weight @ self.ktm_list[k_idx]
-                # pylint: disable=undefined-loop-variable
-                pad = int(self.padding_list[k_idx].detach().cpu().item())
-                x = self.func(x, weight, bias, self.op.stride, pad, self.op.dilation,
-                              self.op.groups)
+            pad = self.max_pad_size if self.kernel_size == self.max_kernel \
+                else self.kernel_options[self.kernel_size][1]
+            x = self.func(x, weight, bias, self.op.stride, pad, self.op.dilation,
+                          self.op.groups)
 
             if self.bn is not None:
-                x = F.batch_norm(x, self.bn.running_mean[:self.out_channels],
-                                 self.bn.running_var[:self.out_channels],
-                                 self.bn.weight[:self.out_channels],
-                                 self.bn.bias[:self.out_channels],
+                running_mean = self.bn.running_mean
+                running_var = self.bn.running_var
+                bn_weight = self.bn.weight
+                bn_bias = self.bn.bias
+                if out_inds is not None:
+                    running_mean = running_mean.index_select(0, out_inds)
+                    running_var = running_var.index_select(0, out_inds)
+                    if bn_weight is not None:
+                        bn_weight = bn_weight.index_select(0, out_inds)
+                        bn_bias = bn_bias.index_select(0, out_inds)
+
+                x = F.batch_norm(x, running_mean, running_var, bn_weight, bn_bias,
                                  self.bn.training,
                                  self.bn.momentum,
                                  self.bn.eps)
+                if out_inds is not None and self.bn.training:
+                    # The gathered running statistics are copies, so write them back
+                    with torch.no_grad():
+                        self.bn.running_mean.index_copy_(0, out_inds, running_mean)
+                        self.bn.running_var.index_copy_(0, out_inds, running_var)
                 x /= 4.
             x = self.clamp(self.quantize(self.activate(x)))
         return x
@@ -619,3 +660,15 @@ def reset_width_sampling(ofa_model):
             m.reset_width_sampling()
 
     ofa_model.apply(_reset_width_sampling)
+
+
+def set_sort_interval(ofa_model, interval):
+    """
+    Set the number of width samples after which the OnceForAll models in the model re-sort
+    their channels by importance
+    """
+    def _set_sort_interval(m):
+        if isinstance(m, OnceForAllModel) and hasattr(m, 'sort_interval'):
+            m.sort_interval = max(int(interval), 1)
+
+    ofa_model.apply(_set_sort_interval)
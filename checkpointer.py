@@ -0,0 +1,215 @@
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Background checkpoint writer.
+
+`CheckpointWriter.save()` takes the arguments of `distiller.apputils.save_checkpoint()` and
+writes a checkpoint file with the same contents and names (`<name>_checkpoint.pth.tar` and,
+for the best epoch, `<name>_best.pth.tar`). The training loop only waits for the state
+dictionaries to be copied to the CPU. Serialization and file I/O run on a worker thread.
+Every file is written to a temporary file in the same directory and then renamed, so an
+interrupted write never replaces a complete checkpoint with a partial one.
+
+With `keep_last` or `keep_best` greater than one, every checkpoint is also kept as
+`<name>_checkpoint_<epoch>.pth.tar`, and only the files of the `keep_last` most recent epochs
+and of the `keep_best` best-ranked epochs are retained.
+"""
+import atexit
+import logging
+import os
+import queue
+import shutil
+import threading
+
+import torch
+
+msglogger = logging.getLogger()
+
+
+def _to_cpu(obj):
+    """
+    Returns a copy of `obj` in which all tensors in (nested) dictionaries, lists and tuples are
+    detached copies on the CPU, so the copy is not changed by further training
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        copied = type(obj)((key, _to_cpu(value)) for key, value in obj.items())
+        if hasattr(obj, '_metadata'):
+            # The version information of `Module.state_dict()`
+            copied._metadata = obj._metadata  # pylint: disable=protected-access
+        return copied
+    if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+        return type(obj)(*(_to_cpu(value) for value in obj))
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(value) for value in obj)
+    return obj
+
+
+def _replace(write, path):
+    """
+    Calls `write` with a temporary file name next to `path`, then atomically renames the
+    temporary file to `path`
+    """
+    tmp_path = f'{path}.tmp'
+    try:
+        write(tmp_path)
+        with open(tmp_path, 'rb') as fd:
+            os.fsync(fd.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _save(checkpoint, path):
+    """Serializes `checkpoint` to `path`"""
+    _replace(lambda tmp_path: torch.save(checkpoint, tmp_path), path)
+
+
+def _copy(src, path):
+    """Copies the file `src` to `path`"""
+    _replace(lambda tmp_path: shutil.copyfile(src, tmp_path), path)
+
+
+def _remove(path):
+    """Removes `path` if it exists"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints on a background thread and removes old checkpoints.
+
+    `keep_last` and `keep_best` are the number of most recent and best-ranked epochs whose
+    checkpoints are kept for each checkpoint name. `max_pending` is the number of checkpoints
+    that may wait for the worker thread before `save()` blocks.
+    """
+    def __init__(self, keep_last=1, keep_best=1, max_pending=1):
+        if keep_last < 1 or keep_best < 1:
+            raise ValueError('keep_last and keep_best must be at least 1')
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.error = None
+        self.history = {}
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, name='CheckpointWriter', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def save(self, epoch, arch, model, optimizer=None, scheduler=None, extras=None,
+             is_best=False, name=None, dir='.', ranking=None):  # pylint: disable=redefined-builtin
+        """
+        Saves a checkpoint like `distiller.apputils.save_checkpoint()`.
+
+        `ranking` is the list of epochs ordered from best to worst (for example, from the
+        performance scores history). It selects the `keep_best` epochs to keep. If it is `None`,
+        the epochs saved with `is_best` are kept.
+        """
+        self._raise()
+        if not os.path.isdir(dir):
+            raise IOError(f'Checkpoint directory does not exist at {os.path.abspath(dir)}')
+        if extras is None:
+            extras = {}
+        if not isinstance(extras, dict):
+            raise TypeError('extras must be either a dict or None')
+
+        filename = 'checkpoint.pth.tar' if name is None else name + '_checkpoint.pth.tar'
+        fullpath = os.path.join(dir, filename)
+        msglogger.info("Saving checkpoint to: %s", fullpath)
+
+        checkpoint = {'epoch': epoch, 'state_dict': model.state_dict(), 'arch': arch}
+        try:
+            checkpoint['is_parallel'] = model.is_parallel
+            checkpoint['dataset'] = model.dataset
+            if not arch:
+                checkpoint['arch'] = model.arch
+        except AttributeError:
+            pass
+        if optimizer is not None:
+            checkpoint['optimizer_state_dict'] = optimizer.state_dict()
+            checkpoint['optimizer_type'] = type(optimizer)
+        if scheduler is not None:
+            checkpoint['compression_sched'] = scheduler.state_dict()
+        if hasattr(model, 'thinning_recipes'):
+            checkpoint['thinning_recipes'] = model.thinning_recipes
+        if hasattr(model, 'quantizer_metadata'):
+            checkpoint['quantizer_metadata'] = model.quantizer_metadata
+        checkpoint['extras'] = extras
+
+        if ranking is not None:
+            ranking = list(ranking)
+        self.queue.put((_to_cpu(checkpoint), fullpath, is_best, ranking))
+
+    def flush(self):
+        """
+        Waits until all saved checkpoints are written, and raises the error of a failed write
+        """
+        self.queue.join()
+        self._raise()
+
+    def close(self):
+        """
+        Writes all saved checkpoints and stops the worker thread
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        atexit.unregister(self.close)
+        self._raise()
+
+    def _raise(self):
+        """Raises the error of a failed write once"""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Writing a checkpoint failed') from error
+
+    def _run(self):
+        """Worker thread"""
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as exc:  # pylint: disable=broad-except
+                msglogger.error('Writing checkpoint %s failed: %s', item[1], exc)
+                self.error = exc
+            finally:
+                self.queue.task_done()
+
+    def _write(self, checkpoint, fullpath, is_best, ranking):
+        """Writes a checkpoint and applies the retention policy"""
+        _save(checkpoint, fullpath)
+        prefix = fullpath[:-len('checkpoint.pth.tar')]
+        if is_best:
+            _copy(fullpath, prefix + 'best.pth.tar')
+
+        if self.keep_last == 1 and self.keep_best == 1:
+            return
+
+        epoch = checkpoint['epoch']
+        _copy(fullpath, f'{prefix}checkpoint_{epoch}.pth.tar')
+
+        history = self.history.setdefault(prefix, {'recent': [], 'best': []})
+        history['recent'] = [e for e in history['recent'] if e != epoch] + [epoch]
+        if ranking is not None:
+            history['best'] = ranking
+        elif is_best:
+            history['best'] = [epoch] + [e for e in history['best'] if e != epoch]
+
+        keep = set(history['recent'][-self.keep_last:]) | set(history['best'][:self.keep_best])
+        for e in history['recent']:
+            if e not in keep:
+                _remove(f'{prefix}checkpoint_{e}.pth.tar')
+        history['recent'] = [e for e in history['recent'] if e in keep]
@@ -94,6 +94,32 @@ class AFSK(Dataset):
         classification = 0 if idx < int(self.avail / 2) else 1
         return data, classification
 
+    def tensors(self):
+        """
+        Return the data of all samples as one tensor and the classifications, for loading
+        whole batches with `datasets.tensor_loader` (see `transform_batch()`).
+        """
+        data = torch.from_numpy(self.data[:self.avail * BYTES_PER_SAMPLE]
+                                .reshape(self.avail, BYTES_PER_SAMPLE))
+        return data, (torch.arange(self.avail) >= int(self.avail / 2)).long()
+
+    def transform_batch(self, sampl):
+        """
+        Convert a batch of rows of the data from `tensors()` like `__getitem__()`.
+        """
+        sampl = sampl.double()
+
+        # min-max normalization (rescaling) of each sample, the data is integer so a range
+        # of zero can be replaced by one
+        _min = sampl.min(dim=1, keepdim=True)[0]
+        _max = sampl.max(dim=1, keepdim=True)[0]
+        sampl = (sampl - _min) / (_max - _min).clamp(min=1)
+
+        data = sampl.float().unsqueeze(1)
+        if self.transform:
+            data = self.transform(data)
+        return data
+
     @property
     def raw_path(self):
         """Location of raw data."""
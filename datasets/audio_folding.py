@@ -0,0 +1,76 @@
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Batched folding and quantization of audio clips, shared by the keyword spotting and noise
+datasets.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def fold(audio, row_len=128, num_rows=128, overlap=0):
+    """
+    Fold the clips `audio` of shape (N, samples) into an array of shape (N, `row_len`,
+    `num_rows`). Column `n` of each result holds the samples starting at
+    `n` * (`row_len` - `overlap`). Clips are zero-padded or truncated to the folded length.
+    The result is a read-only view when no padding is required.
+    """
+    audio = np.asarray(audio)
+    step = row_len - overlap
+    data_len = (num_rows - 1) * step + row_len
+
+    if audio.shape[-1] < data_len:
+        audio = np.pad(audio, [(0, 0)] * (audio.ndim - 1) + [(0, data_len - audio.shape[-1])])
+    rows = sliding_window_view(audio[..., :data_len], row_len, axis=-1)[..., ::step, :]
+    return rows.swapaxes(-1, -2)
+
+
+def compand(data, mu=255):
+    """Compand the signal level to warp from Laplacian distribution to uniform distribution"""
+    data = np.sign(data) * np.log(1 + mu*np.abs(data)) / np.log(1 + mu)
+    return data
+
+
+def expand(data, mu=255):
+    """Undo the companding"""
+    data = np.sign(data) * (1 / mu) * (np.power((1 + mu), np.abs(data)) - 1)
+    return data
+
+
+def quantize(data, num_bits=8, compand_data=False, mu=255):
+    """
+    Quantize audio samples in [-1, 1] of any shape to unsigned `num_bits` integers
+    """
+    if compand_data:
+        data = compand(data, mu)
+
+    step_size = 2.0 / 2**(num_bits)
+    max_val = 2**(num_bits) - 1
+    q_data = np.round((data - (-1.0)) / step_size)
+    q_data = np.clip(q_data, 0, max_val)
+
+    if compand_data:
+        data_ex = (q_data - 2**(num_bits - 1)) / 2**(num_bits - 1)
+        data_ex = expand(data_ex)
+        q_data = np.round((data_ex - (-1.0)) / step_size)
+        q_data = np.clip(q_data, 0, max_val)
+    return np.uint8(q_data)
+
+
+def fold_and_quantize(audio, row_len=128, num_rows=128, overlap=0, quantization=None):
+    """
+    Fold the clips `audio` of shape (N, samples) (see `fold()`), and quantize them using the
+    `quantization` dictionary (keys `bits`, `compand` and `mu`) unless it is None.
+    """
+    folded = fold(audio, row_len, num_rows, overlap)
+    if quantization is None:
+        return folded
+    return quantize(folded, num_bits=quantization.get('bits', 8),
+                    compand_data=quantization.get('compand', False),
+                    mu=quantization.get('mu', 255))
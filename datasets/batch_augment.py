@@ -0,0 +1,431 @@
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Data augmentation and normalization applied to whole batches after collation.
+
+A dataset opts in by using a `BatchPipeline` as its transform. The `sample` part of the
+pipeline runs per sample and should only produce fixed-size uint8 CHW tensors (e.g., a
+`Resize()` followed by `PILToTensor()`). The `batch` part consists of the batched transforms
+of this module (and element-wise transforms such as `ai8x.normalize`). Starting with
+`ToFloat`, they draw random parameters for every sample of an (N, C, H, W) batch and apply
+them with a few tensor operations.
+
+The optional `post` part runs in the main process after the batch has left the loader
+workers. Putting `ai8x.normalize` there (it converts uint8 input in one fused operation) and
+ending the `batch` part with `ToUint8` transfers the batches between the processes as uint8,
+a quarter of the size of floating point data.
+
+`attach()` installs a collate function that applies the `batch` part in the DataLoader
+workers, and wraps the loader to apply the `post` part. A pipeline that is not attached to a
+loader applies all parts to every sample, so datasets that use it keep working with a plain
+DataLoader.
+"""
+import math
+
+import torch
+from torch.nn import functional as F
+from torch.utils.data import Subset
+from torch.utils.data.dataloader import default_collate
+
+_GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def _range(value, center=1., bound=0.):
+    """
+    Return the (min, max) range of a `torchvision` style parameter, which is either a range or
+    a number `v` for the range [`center` - `v`, `center` + `v`] (limited to `bound`)
+    """
+    if isinstance(value, (tuple, list)):
+        return float(value[0]), float(value[1])
+    return max(center - value, bound), center + value
+
+
+def _uniform(n, low, high, device):
+    """Return `n` random numbers in [`low`, `high`)"""
+    return torch.empty(n, device=device).uniform_(low, high)
+
+
+def _grayscale(batch):
+    """Return the luma of the RGB `batch` as one channel"""
+    weights = batch.new_tensor(_GRAY_WEIGHTS).view(1, 3, 1, 1)
+    return (batch * weights).sum(dim=1, keepdim=True)
+
+
+def _blend(batch, other, factor):
+    """Blend `batch` with `other` using the per-sample `factor`, clamped to [0, 1]"""
+    return (other + factor.view(-1, 1, 1, 1) * (batch - other)).clamp(0., 1.)
+
+
+def _rgb_to_hsv(batch):
+    """Convert an RGB batch in [0, 1] to HSV"""
+    r, g, b = batch.unbind(dim=1)
+    maxc, _ = batch.max(dim=1)
+    minc, _ = batch.min(dim=1)
+    delta = maxc - minc
+    safe_delta = torch.where(delta > 0, delta, torch.ones_like(delta))
+
+    hue = torch.where(maxc == r, ((g - b) / safe_delta) % 6.,
+                      torch.where(maxc == g, (b - r) / safe_delta + 2.,
+                                  (r - g) / safe_delta + 4.)) / 6.
+    hue = torch.where(delta > 0, hue, torch.zeros_like(hue))
+    sat = torch.where(maxc > 0, delta / torch.where(maxc > 0, maxc, torch.ones_like(maxc)),
+                      torch.zeros_like(maxc))
+    return torch.stack((hue, sat, maxc), dim=1)
+
+
+def _hsv_to_rgb(batch):
+    """Convert an HSV batch to RGB"""
+    hue, sat, val = batch.unbind(dim=1)
+    k = (torch.stack((torch.full_like(hue, 5.), torch.full_like(hue, 3.),
+                      torch.ones_like(hue)), dim=1) + hue.unsqueeze(1) * 6.) % 6.
+    return val.unsqueeze(1) - (val * sat).unsqueeze(1) \
+        * torch.min(k, 4. - k).clamp(0., 1.)
+
+
+class Compose:
+    """
+    Apply the batched transforms `transforms` one after the other
+    """
+    def __init__(self, transforms):
+        self.transforms = transforms
+
+    def __call__(self, batch):
+        for t in self.transforms:
+            batch = t(batch)
+        return batch
+
+
+class ToFloat:
+    """
+    Convert a uint8 batch to floating point in [0, 1] (like `transforms.ToTensor()`)
+    """
+    def __call__(self, batch):
+        return batch.float().div(255.)
+
+
+class ToUint8:
+    """
+    Convert a floating point batch in [0, 1] back to uint8, e.g., to transfer augmented
+    images from the loader workers at a quarter of the size
+    """
+    def __call__(self, batch):
+        return batch.mul(255.).round_().clamp_(0., 255.).to(torch.uint8)
+
+
+class Normalize:
+    """
+    Normalize the channels of a floating point batch with `mean` and `std`
+    """
+    def __init__(self, mean, std):
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, batch):
+        mean = batch.new_tensor(self.mean).view(1, -1, 1, 1)
+        std = batch.new_tensor(self.std).view(1, -1, 1, 1)
+        return (batch - mean) / std
+
+
+class RandomHorizontalFlip:
+    """
+    Flip each image of a batch horizontally with probability `p`
+    """
+    dim = -1
+
+    def __init__(self, p=0.5):
+        self.p = p
+
+    def __call__(self, batch):
+        flip = torch.rand(len(batch), device=batch.device) < self.p
+        return torch.where(flip.view(-1, 1, 1, 1), batch.flip(self.dim), batch)
+
+
+class RandomVerticalFlip(RandomHorizontalFlip):
+    """
+    Flip each image of a batch vertically with probability `p`
+    """
+    dim = -2
+
+
+class RandomGrayscale:
+    """
+    Convert each image of an RGB batch in [0, 1] to grayscale with probability `p`
+    """
+    def __init__(self, p=0.1):
+        self.p = p
+
+    def __call__(self, batch):
+        gray = torch.rand(len(batch), device=batch.device) < self.p
+        return torch.where(gray.view(-1, 1, 1, 1), _grayscale(batch).expand_as(batch), batch)
+
+
+class ColorJitter:
+    """
+    Randomly change the brightness, contrast, saturation and hue of each image of an RGB batch
+    in [0, 1] (see `transforms.ColorJitter()`). The order of the adjustments is drawn once per
+    batch.
+    """
+    def __init__(self, brightness=0, contrast=0, saturation=0, hue=0):
+        self.brightness = _range(brightness) if brightness else None
+        self.contrast = _range(contrast) if contrast else None
+        self.saturation = _range(saturation) if saturation else None
+        self.hue = _range(hue, 0., -0.5) if hue else None
+
+    def __call__(self, batch):
+        n = len(batch)
+        adjustments = [self.brightness, self.contrast, self.saturation, self.hue]
+        for i in torch.randperm(4).tolist():
+            if adjustments[i] is None:
+                continue
+            factor = _uniform(n, *adjustments[i], batch.device)
+            if i == 0:
+                batch = _blend(batch, torch.zeros_like(batch), factor)
+            elif i == 1:
+                mean = _grayscale(batch).mean(dim=(1, 2, 3), keepdim=True)
+                batch = _blend(batch, mean, factor)
+            elif i == 2:
+                batch = _blend(batch, _grayscale(batch), factor)
+            else:
+                hsv = _rgb_to_hsv(batch)
+                hue = (hsv[:, 0] + factor.view(-1, 1, 1)) % 1.
+                batch = _hsv_to_rgb(torch.stack((hue, hsv[:, 1], hsv[:, 2]), dim=1))
+        return batch
+
+
+class GaussianBlur:
+    """
+    Blur each image of a batch with a Gaussian kernel of size `kernel_size` and a random
+    standard deviation in the range `sigma`
+    """
+    def __init__(self, kernel_size, sigma=(0.1, 2.0)):
+        if not isinstance(kernel_size, (tuple, list)):
+            kernel_size = (kernel_size, kernel_size)
+        self.kernel_size = kernel_size
+        self.sigma = tuple(sigma) if isinstance(sigma, (tuple, list)) else (sigma, sigma)
+
+    def __call__(self, batch):
+        n, c, h, w = batch.shape
+        sigma = _uniform(n, *self.sigma, batch.device)
+        out = batch.reshape(1, n * c, h, w)
+        for dim, size in enumerate(self.kernel_size):
+            x = torch.arange(size, device=batch.device, dtype=batch.dtype) - (size - 1) / 2.
+            kernel = torch.exp(-(x.view(1, -1) / sigma.view(-1, 1)) ** 2 / 2.)
+            kernel = (kernel / kernel.sum(dim=1, keepdim=True)).repeat_interleave(c, dim=0)
+            if dim == 0:
+                out = F.pad(out, (size // 2, size // 2, 0, 0), mode='reflect')
+                out = F.conv2d(out, kernel.view(n * c, 1, 1, size), groups=n * c)
+            else:
+                out = F.pad(out, (0, 0, size // 2, size // 2), mode='reflect')
+                out = F.conv2d(out, kernel.view(n * c, 1, size, 1), groups=n * c)
+        return out.view(n, c, h, w)
+
+
+def _warp(batch, theta, size, mode):
+    """
+    Sample `batch` at the normalized coordinates given by the per-sample affine matrices
+    `theta` (N x 2 x 3), producing images of size `size`
+    """
+    grid = F.affine_grid(theta, (len(batch), batch.shape[1]) + tuple(size), align_corners=False)
+    return F.grid_sample(batch, grid, mode=mode, padding_mode='zeros', align_corners=False)
+
+
+class RandomAffine:
+    """
+    Apply a random rotation in the range `degrees`, a translation of up to `translate`
+    (fractions of the width and height), a scaling in the range `scale` and a shear in the
+    range `shear` (x only, or (x min, x max, y min, y max)) to each image of a batch (see
+    `transforms.RandomAffine()`). The area outside of the image is filled with zeros.
+    """
+    def __init__(self, degrees, translate=None, scale=None, shear=None, interpolation='nearest'):
+        self.degrees = _range(degrees, 0., -math.inf)
+        self.translate = translate
+        self.scale = scale
+        self.shear = None
+        if shear is not None:
+            if isinstance(shear, (tuple, list)) and len(shear) == 4:
+                self.shear = (tuple(shear[:2]), tuple(shear[2:]))
+            else:
+                self.shear = (_range(shear, 0., -math.inf), None)
+        self.interpolation = interpolation
+
+    def __call__(self, batch):
+        n, _, h, w = batch.shape
+        device = batch.device
+
+        angle = torch.deg2rad(_uniform(n, *self.degrees, device))
+        scale = _uniform(n, *self.scale, device) if self.scale is not None \
+            else torch.ones(n, device=device)
+        shear_x = torch.zeros(n, device=device)
+        shear_y = torch.zeros(n, device=device)
+        if self.shear is not None:
+            shear_x = torch.deg2rad(_uniform(n, *self.shear[0], device))
+            if self.shear[1] is not None:
+                shear_y = torch.deg2rad(_uniform(n, *self.shear[1], device))
+        trans = torch.zeros(n, 2, device=device)
+        if self.translate is not None:
+            trans[:, 0].uniform_(-self.translate[0] * w, self.translate[0] * w)
+            trans[:, 1].uniform_(-self.translate[1] * h, self.translate[1] * h)
+
+        # Forward transform in pixels around the center of the image
+        rot = torch.stack((torch.cos(angle), -torch.sin(angle),
+                           torch.sin(angle), torch.cos(angle)), dim=1).view(n, 2, 2)
+        shear = torch.stack((torch.ones(n, device=device), torch.tan(shear_x),
+                             torch.tan(shear_y), torch.ones(n, device=device)),
+                            dim=1).view(n, 2, 2)
+        forward = torch.eye(3, device=device).repeat(n, 1, 1)
+        forward[:, :2, :2] = rot @ shear * scale.view(-1, 1, 1)
+        forward[:, :2, 2] = trans
+
+        # `affine_grid()` maps the output to the input in coordinates normalized to [-1, 1]
+        half = torch.diag(torch.tensor([w / 2., h / 2., 1.], device=device))
+        theta = torch.inverse(half) @ torch.inverse(forward) @ half
+        return _warp(batch, theta[:, :2], (h, w), self.interpolation)
+
+
+class RandomResizedCrop:
+    """
+    Crop a random area in the range `scale` (fraction of the image) with an aspect ratio in
+    the range `ratio` from each image of a batch and resize it to `size` (see
+    `transforms.RandomResizedCrop()`). Crops that do not fit are limited to the image.
+    """
+    def __init__(self, size, scale=(0.08, 1.0), ratio=(3. / 4., 4. / 3.),
+                 interpolation='bilinear'):
+        if not isinstance(size, (tuple, list)):
+            size = (size, size)
+        self.size = size
+        self.scale = scale
+        self.ratio = ratio
+        self.interpolation = interpolation
+
+    def __call__(self, batch):
+        n, _, h, w = batch.shape
+        device = batch.device
+
+        area = _uniform(n, *self.scale, device)
+        ratio = torch.exp(_uniform(n, math.log(self.ratio[0]), math.log(self.ratio[1]), device))
+        crop_w = torch.sqrt(area * ratio * h / w).clamp(max=1.)
+        crop_h = torch.sqrt(area / ratio * w / h).clamp(max=1.)
+        center_x = (torch.rand(n, device=device) * 2. - 1.) * (1. - crop_w)
+        center_y = (torch.rand(n, device=device) * 2. - 1.) * (1. - crop_h)
+
+        theta = torch.zeros(n, 2, 3, device=device)
+        theta[:, 0, 0] = crop_w
+        theta[:, 0, 2] = center_x
+        theta[:, 1, 1] = crop_h
+        theta[:, 1, 2] = center_y
+        return _warp(batch, theta, self.size, self.interpolation)
+
+
+class BatchPipeline:
+    """
+    Dataset transform that consists of the per-sample transform `sample`, the batched
+    transform `batch` that runs in the loader workers, and the batched transform `post` that
+    runs after the batch has been transferred to the main process (see the module
+    documentation). `batch` and `post` are optional.
+    """
+    def __init__(self, sample, batch=None, post=None):
+        self.sample = sample
+        self.batch = batch
+        self.post = post
+        self.batched = False
+
+    def __call__(self, img):
+        img = self.sample(img)
+        if self.batched:
+            return img
+        img = img.unsqueeze(0)
+        for transform in [self.batch, self.post]:
+            if transform is not None:
+                img = transform(img)
+        return img.squeeze(0)
+
+
+class BatchCollate:
+    """
+    Collate function that applies `transform` to the inputs (the first element) of each batch
+    collated by `collate_fn`
+    """
+    def __init__(self, transform, collate_fn=default_collate):
+        self.transform = transform
+        self.collate_fn = collate_fn
+
+    def __call__(self, samples):
+        batch = self.collate_fn(samples)
+        batch[0] = self.transform(batch[0])
+        return batch
+
+
+class PostprocessLoader:
+    """
+    Wrapper of the DataLoader `loader` that applies `transform` to the inputs of every batch
+    in the main process. Other attributes are those of `loader`.
+    """
+    def __init__(self, loader, transform):
+        self.loader = loader
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for batch in self.loader:
+            batch[0] = self.transform(batch[0])
+            yield batch
+
+    @property
+    def collate_fn(self):
+        """Collate function for code that builds its own DataLoader over the dataset"""
+        return BatchCollate(self.transform, self.loader.collate_fn)
+
+    def __getattr__(self, name):
+        if name == 'loader':
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+
+def _pipeline(dataset):
+    """Return the `BatchPipeline` of `dataset`, or None"""
+    while isinstance(dataset, Subset):
+        dataset = dataset.dataset
+    transform = getattr(dataset, 'transform', None)
+    return transform if isinstance(transform, BatchPipeline) else None
+
+
+def get_collate_fn(dataset, collate_fn=default_collate):
+    """
+    Return the collate function for a DataLoader of `dataset`: `collate_fn`, followed by the
+    batched transforms if `dataset` uses a `BatchPipeline` that is attached to a loader.
+    """
+    pipeline = _pipeline(dataset)
+    if pipeline is None or not pipeline.batched:
+        return collate_fn
+    for transform in [pipeline.batch, pipeline.post]:
+        if transform is not None:
+            collate_fn = BatchCollate(transform, collate_fn)
+    return collate_fn
+
+
+def attach(*loaders):
+    """
+    Apply the batched transforms of the datasets of the DataLoaders `loaders` that use a
+    `BatchPipeline`: `batch` after collation in the loader workers, and `post` in the main
+    process. Return the loaders, wrapped in a `PostprocessLoader` where needed.
+    """
+    attached = []
+    for loader in loaders:
+        pipeline = _pipeline(loader.dataset) if loader is not None else None
+        if pipeline is not None and not isinstance(loader, PostprocessLoader) \
+           and not isinstance(loader.collate_fn, BatchCollate):
+            pipeline.batched = True
+            if pipeline.batch is not None:
+                loader.collate_fn = BatchCollate(pipeline.batch, loader.collate_fn)
+            if pipeline.post is not None:
+                loader = PostprocessLoader(loader, pipeline.post)
+        attached.append(loader)
+    return attached
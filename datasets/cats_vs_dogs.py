@@ -22,6 +22,8 @@ from PIL import Image
 
 import ai8x
 
+from . import batch_augment
+
 torch.manual_seed(0)
 
 
@@ -160,11 +162,13 @@ def catsdogs_get_datasets(data, load_train=True, load_test=True, aug=2):
 
     # Loading and normalizing train dataset
     if load_train:
-        train_transform = transforms.Compose([
-            transforms.Resize((128, 128)),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
+        train_transform = batch_augment.BatchPipeline(
+            sample=transforms.Compose([
+                transforms.Resize((128, 128)),
+                transforms.PILToTensor(),
+            ]),
+            post=ai8x.normalize(args=args),
+        )
 
         train_dataset = torchvision.datasets.ImageFolder(root=processed_train_path,
                                                          transform=train_transform)
@@ -173,11 +177,13 @@ def catsdogs_get_datasets(data, load_train=True, load_test=True, aug=2):
 
     # Loading and normalizing test dataset
     if load_test:
-        test_transform = transforms.Compose([
-            transforms.Resize((128, 128)),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
+        test_transform = batch_augment.BatchPipeline(
+            sample=transforms.Compose([
+                transforms.Resize((128, 128)),
+                transforms.PILToTensor(),
+            ]),
+            post=ai8x.normalize(args=args),
+        )
 
         test_dataset = torchvision.datasets.ImageFolder(root=processed_test_path,
                                                         transform=test_transform)
@@ -31,6 +31,8 @@ from torchvision import transforms
 
 import ai8x
 
+from . import batch_augment
+
 
 def cifar100_get_datasets(data, load_train=True, load_test=True):
     """
@@ -54,12 +56,14 @@ def cifar100_get_datasets(data, load_train=True, load_test=True):
     (data_dir, args) = data
 
     if load_train:
-        train_transform = transforms.Compose([
-            transforms.RandomCrop(32, padding=4),
-            transforms.RandomHorizontalFlip(),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
+        train_transform = batch_augment.BatchPipeline(
+            sample=transforms.Compose([
+                transforms.RandomCrop(32, padding=4),
+                transforms.RandomHorizontalFlip(),
+                transforms.PILToTensor(),
+            ]),
+            post=ai8x.normalize(args=args),
+        )
 
         train_dataset = torchvision.datasets.CIFAR100(root=os.path.join(data_dir, 'CIFAR100'),
                                                       train=True, download=True,
@@ -68,10 +72,10 @@ def cifar100_get_datasets(data, load_train=True, load_test=True):
         train_dataset = None
 
     if load_test:
-        test_transform = transforms.Compose([
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
+        test_transform = batch_augment.BatchPipeline(
+            sample=transforms.PILToTensor(),
+            post=ai8x.normalize(args=args),
+        )
 
         test_dataset = torchvision.datasets.CIFAR100(root=os.path.join(data_dir, 'CIFAR100'),
                                                      train=False, download=True,
@@ -36,6 +36,8 @@ from PIL import Image
 import torch
 import pandas as pd
 import os
+import json
+import multiprocessing
 from matplotlib import cm
 from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
@@ -46,10 +48,228 @@ from torch.utils.data.sampler import Sampler
 import random
 
 import ai8x
+from datasets import batch_augment
 
 # random.seed(1) 
 # torch.manual_seed(1)
 # np.random.seed(0)
+'''
+Cache of decoded and resized uint8 images, shared by the DataLoader worker processes
+Parameters:
+  num_images - Number of images that can be cached, the keys are the image indices 0..num_images-1
+  shape -      Shape (height, width, channels) of every cached image
+  max_bytes -  Memory budget, the least recently used images are evicted when it is exhausted
+
+All storage is in shared memory tensors that are created before the workers start, so every
+worker sees the images decoded by the others. A lock serializes the (short) bookkeeping.
+'''
+class SharedImageCache:
+    def __init__(self,num_images,shape,max_bytes):
+        self.shape = tuple(shape)
+        self.num_slots = min(num_images, max_bytes // int(np.prod(self.shape)))
+        self.data = torch.zeros((self.num_slots,) + self.shape, dtype=torch.uint8).share_memory_()
+        self.slot_of_key = torch.full((num_images,), -1, dtype=torch.int64).share_memory_()
+        self.key_of_slot = torch.full((self.num_slots,), -1, dtype=torch.int64).share_memory_()
+        self.last_used = torch.zeros(self.num_slots, dtype=torch.int64).share_memory_() # 0 = empty
+        self.clock = torch.zeros(1, dtype=torch.int64).share_memory_()
+        self.lock = multiprocessing.Lock()
+
+    # return a copy of the cached image for key as a numpy array, or None
+    def get(self,key):
+        with self.lock:
+            slot = self.slot_of_key[key].item()
+            if slot < 0:
+                return None
+            self.clock += 1
+            self.last_used[slot] = self.clock[0]
+            return self.data[slot].numpy().copy()
+
+    # add the image for key, replacing the least recently used one when the cache is full
+    def put(self,key,img):
+        if self.num_slots == 0 or img.shape != self.shape:
+            return
+        with self.lock:
+            if self.slot_of_key[key] >= 0:
+                return
+            slot = torch.argmin(self.last_used).item()
+            old_key = self.key_of_slot[slot].item()
+            if old_key >= 0:
+                self.slot_of_key[old_key] = -1
+            self.data[slot] = torch.from_numpy(img)
+            self.key_of_slot[slot] = key
+            self.slot_of_key[key] = slot
+            self.clock += 1
+            self.last_used[slot] = self.clock[0]
+
+
+# load an image as PIL image with three channels
+def load_rgb_image(path):
+    img = Image.open(path)
+
+    # if grayscale jsut add channels
+    tt = torchvision.transforms.ToTensor()
+    tp = torchvision.transforms.ToPILImage()
+    tt_img = tt(img)
+    if(tt_img.size()[0] != 3):
+        img = tp(tt_img.repeat(3, 1, 1))
+    return img
+
+
+# return the fixed-size Resize that starts transform (the part of the transform that can be
+# cached since it is not random), or None
+def get_cacheable_resize(transform):
+    if isinstance(transform, batch_augment.BatchPipeline):
+        transform = transform.sample
+    if isinstance(transform, transforms.Compose) and len(transform.transforms) > 0:
+        transform = transform.transforms[0]
+    if isinstance(transform, transforms.Resize) and isinstance(transform.size, (tuple, list)) \
+            and len(transform.size) == 2:
+        return transform
+    return None
+
+
+# per-sample part of the transforms: resize and convert to a uint8 tensor, everything else is
+# applied to whole batches after collation (see batch_augment.attach())
+def resize_to_uint8(size=(128,128)):
+    return transforms.Compose([transforms.Resize(size),transforms.PILToTensor()])
+
+
+# transform without augmentations, only the conversion of the uint8 batches to the ai8x input
+# range in the main process
+def plain_transform(args):
+    return batch_augment.BatchPipeline(resize_to_uint8(),post=ai8x.normalize(args=args))
+
+
+'''
+Persistent index of the images in a dataset directory tree
+Parameters:
+  img_dir_path - Full path to directory with the images, laid out as for ClassificationDataset.
+
+The index stores the path, label and mtime of every image and the mtime of every directory.
+It is saved in the top folder (which is never scanned for images) and kept in memory, so the
+tree is walked once per root instead of once per dataset construction. On reuse only the
+directories are stat'ed, and directories whose mtime changed (files added or removed) are
+rescanned. Use get_image_index() to share the index between datasets.
+'''
+class ImageIndex:
+    index_file_name = '.image_index.json'
+    version = 2
+
+    def __init__(self,img_dir_path):
+        self.img_dir_path = os.path.abspath(img_dir_path)
+        self.index_path = os.path.join(self.img_dir_path,self.index_file_name)
+        self.class_names = None # class subdirectory names in os.walk() order
+        self.dirs = [] # (dir path, dir mtime, [(file name, file mtime), ...], [subdirs]) in os.walk() order
+        self.imgs = None
+
+        # try the saved index first, refresh() rescans whatever is missing or out of date
+        try:
+            with open(self.index_path,'r') as f:
+                saved = json.load(f)
+            if saved['version'] == self.version:
+                class_names = [str(c) for c in saved['class_names']]
+                dirs = [(str(dir_path), int(mtime),
+                         [(str(file), int(file_mtime)) for file, file_mtime in files],
+                         [str(d) for d in subdirs])
+                        for dir_path, mtime, files, subdirs in saved['dirs']]
+                self.class_names, self.dirs = class_names, dirs
+        except (OSError, KeyError, TypeError, ValueError):
+            pass
+        self.refresh()
+
+    # stat the directories and rescan those that changed since the index was built
+    def refresh(self):
+        # collect img classes from dir names (this lists the top folder only)
+        class_names = next(os.walk(self.img_dir_path))[1]
+        changed = class_names != self.class_names
+        self.class_names = class_names
+
+        # walk the class folders top-down like os.walk(), reusing unchanged directories
+        known = {d[0] : d for d in self.dirs}
+        dirs = []
+        stack = [os.path.join(self.img_dir_path,c) for c in class_names]
+        while stack:
+            dir_path = stack.pop(0)
+            try:
+                mtime = os.stat(dir_path).st_mtime_ns
+            except FileNotFoundError:
+                changed = True
+                continue
+            entry = known.get(dir_path)
+            if entry is None or entry[1] != mtime:
+                entry = (dir_path, mtime) + self._scan(dir_path)
+                changed = True
+            dirs.append(entry)
+            stack = [os.path.join(dir_path,d) for d in entry[3]] + stack
+        changed = changed or len(dirs) != len(self.dirs)
+        self.dirs = dirs
+
+        if changed:
+            self._build_lists()
+            self._save()
+        elif self.imgs is None:
+            self._build_lists()
+
+    # list the files (with their mtimes) and subdirectories of one directory
+    def _scan(self,dir_path):
+        files = []
+        subdirs = []
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                else:
+                    files.append((entry.name, entry.stat().st_mtime_ns))
+        return files, subdirs
+
+    # flat lists used by the datasets
+    def _build_lists(self):
+        self.classes = {self.class_names[i] : i for i in range(0, len(self.class_names))}
+        self.imgs = [] # absolute img paths (all images)
+        self.labels = [] # integer labels (all labels in corresponding order)
+        self.mtimes = [] # modification times of the images in ns
+        self.caches = {} # image caches by resize parameters, keyed by the indices into imgs
+        for dir_path, _, files, _ in self.dirs:
+            label = self.classes[os.path.basename(dir_path)] # get label from directory name
+            for file, mtime in files:
+                self.imgs.append(os.path.join(dir_path,file))
+                self.labels.append(label)
+                self.mtimes.append(mtime)
+
+    # save the index in the top folder as JSON (a data-only format, so a modified index file
+    # cannot execute code), datasets on read-only file systems just skip this
+    def _save(self):
+        tmp_path = self.index_path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp_path,'w') as f:
+                json.dump({'version': self.version, 'class_names': self.class_names,
+                           'dirs': self.dirs}, f)
+            os.replace(tmp_path,self.index_path)
+        except OSError:
+            pass
+
+
+    # return the shared image cache for the images resized by resize (a fixed-size Resize)
+    def get_cache(self,resize,max_bytes):
+        key = (tuple(resize.size), str(resize.interpolation))
+        if key not in self.caches:
+            self.caches[key] = SharedImageCache(len(self.imgs), tuple(resize.size) + (3,), max_bytes)
+        return self.caches[key]
+
+
+# indices already loaded in this process, by absolute root path
+image_indices = {}
+
+# return the up-to-date image index for img_dir_path, shared by all datasets on that root
+def get_image_index(img_dir_path):
+    key = os.path.abspath(img_dir_path)
+    if key in image_indices:
+        image_indices[key].refresh()
+    else:
+        image_indices[key] = ImageIndex(key)
+    return image_indices[key]
+
+
 '''
 Generic Dataset Class
 Parameters:
@@ -64,42 +284,45 @@ Parameters:
                  might be [0, 1, 2, 3, 4, 5, 6, 7, 8, 9] but the validation set might be
                  [2, 5, 6] and the train set might be [0, 1, 3, 4, 7, 8, 9]
   get_path -     returns the image file name in addition to the image and label
+  cache_bytes -  if > 0 and the transform starts with a fixed-size Resize, keep up to this many
+                 bytes of decoded and resized images in a cache that is shared by all datasets on
+                 this folder and by the DataLoader workers (so only the random augmentations run
+                 on each access)
 '''
 class ClassificationDataset(Dataset):
-    def __init__(self,img_dir_path,transform,subset=None,get_path=False):
+    def __init__(self,img_dir_path,transform,subset=None,get_path=False,cache_bytes=0):
         self.img_dir_path = img_dir_path
         self.transform = transform
         self.subset = subset
         self.get_path = get_path
+        self.cache = None
 
         print(self.img_dir_path)
         
-        # collect img classes from dir names
-        img_classes = next(os.walk(img_dir_path))[1]
-        
+        # the class folders and images come from the (cached) index of the directory tree
+        index = get_image_index(img_dir_path)
+
         # generate a dictionary to map class names to integers idxs
-        self.classes = {img_classes[i] : i for i in range(0, len(img_classes))}
+        self.classes = index.classes
         self.label_dict = {v: k for k, v in self.classes.items()}
         print(self.classes) # use this ordering on synthesized model
         
-        # get all training samples/labels by getting absolute paths of the images in each subfolder
-        self.imgs = [] # absolute img paths (all images)
-        self.labels = [] # integer labels (all labels in corresponding order)
-
-        i = 0 # index into dataset lists
-
-        # iterate through the dataset directory tree
-        for idx, path_obj in enumerate(os.walk(img_dir_path)):
-            # each execution of this inner loop is for each subdirectory
-            if idx > 0: # don't include files in the top folder (subfolders are in the next itertion, idx > 0)
-                for file in path_obj[2]: # path_obj[2] is list of files in the object class subdirectories
-                    self.imgs.append(os.path.abspath(os.path.join(path_obj[0],file))) # want absolute path
-                    self.labels.append(self.classes[os.path.basename(os.path.dirname(self.imgs[i]))]) # get label from directory name
-                    i+=1
+        # absolute paths of the images in each subfolder and their integer labels (shared with
+        # all datasets on this folder, do not modify)
+        self.imgs = index.imgs
+        self.labels = index.labels
+
+        # optionally cache the decoded images after the (deterministic) resize
+        self.cache_resize = get_cacheable_resize(transform)
+        if cache_bytes > 0:
+            if self.cache_resize is not None:
+                self.cache = index.get_cache(self.cache_resize,cache_bytes)
+            else:
+                print("Image cache disabled, the transform does not start with a fixed-size Resize")
 
         # if no subset, just use the whole set
-        if subset == None:
-            self.subset = [i for i in range(len(self.imgs))]
+        if subset is None:
+            self.subset = range(len(self.imgs))
 
     # dataset size is determined by the subset size
     def __len__(self):
@@ -113,14 +336,7 @@ class ClassificationDataset(Dataset):
         # attempt to load the image at the specified index
         try:
             # load the image
-            img = Image.open(self.imgs[idx])
-
-            # if grayscale jsut add channels
-            tt = torchvision.transforms.ToTensor()
-            tp = torchvision.transforms.ToPILImage()
-            tt_img = tt(img)
-            if(tt_img.size()[0] != 3):
-                img = tp(tt_img.repeat(3, 1, 1))
+            img = self.load_image(idx)
             
             # apply any transformation
             if self.transform:
@@ -141,12 +357,26 @@ class ClassificationDataset(Dataset):
             print("Bad Image: ", self.imgs[idx])
             exit()
     
+    # load the image at idx (in the whole set) with three channels, when the cache is used the
+    # image is already resized (resizing it again in the transform does not change it)
+    def load_image(self, idx):
+        if self.cache is None:
+            return load_rgb_image(self.imgs[idx])
+
+        img = self.cache.get(idx)
+        if img is not None:
+            return Image.fromarray(img)
+        img = self.cache_resize(load_rgb_image(self.imgs[idx]))
+        if img.mode == "RGB":
+            self.cache.put(idx,np.asarray(img))
+        return img
+
     # Display the results of a forward pass for a random batch of 64 samples
     # if no model passed in, just display a batch with no predictions
     def visualize_batch(self,model=None,device=None):
         # create the dataloader
         batch_size = 64
-        data_loader = DataLoader(self,batch_size,shuffle=True)
+        data_loader = DataLoader(self,batch_size,shuffle=True,collate_fn=batch_augment.get_collate_fn(self))
 
         # get the first batch
         (imgs, labels, paths) = next(iter(data_loader))
@@ -251,9 +481,13 @@ Parameters:
                         names should be identical.
   transform -           Specifies the image format (size, RGB, etc.) and augmentations to use
   normalize -           Specifies whether to make the image zero mean, unit variance
+  cache_bytes -         image cache budget of the source and target datasets created from the
+                        paths (see ClassificationDataset), datasets passed in use their own cache
+  seed -                seed for the pair generation, if None the pairs are drawn using the python random
+                        module state (i.e. they are reproducible after random.seed())
 '''
 class DomainAdaptationPairDataset(Dataset):
-    def __init__(self,source_img_dir_path,target_img_dir_path,transform,shot,pair_factor=1,adv_stage=False,source_dataset=None,target_dataset=None,subset=None):
+    def __init__(self,source_img_dir_path,target_img_dir_path,transform,shot,pair_factor=1,adv_stage=False,source_dataset=None,target_dataset=None,subset=None,cache_bytes=0,seed=None):
         self.shot = shot
         self.adv_stage = adv_stage
         self.transform = transform
@@ -272,13 +506,13 @@ class DomainAdaptationPairDataset(Dataset):
             # print(self.target_img_dir_path)
             
             # collect img classes from source  dir names
-            source_img_classes = next(os.walk(source_img_dir_path))[1]
-            target_img_classes = next(os.walk(target_img_dir_path))[1]
+            source_img_classes = get_image_index(source_img_dir_path).class_names
+            target_img_classes = get_image_index(target_img_dir_path).class_names
             if not source_img_classes == target_img_classes:
                 raise AssertionError("source and target classes not the same")
             
-            self.source_dataset = ClassificationDataset(source_img_dir_path,transform)
-            self.target_dataset = ClassificationDataset(target_img_dir_path,transform)
+            self.source_dataset = ClassificationDataset(source_img_dir_path,transform,cache_bytes=cache_bytes)
+            self.target_dataset = ClassificationDataset(target_img_dir_path,transform,cache_bytes=cache_bytes)
 
         # generate an EvenSampler so we can sample each class with equal probability
         self.s_sampler = EvenSampler(self.source_dataset)
@@ -312,16 +546,6 @@ class DomainAdaptationPairDataset(Dataset):
         self.num_G3_pairs = min(self.num_G3_pairs,self.min_pairs_multiple*self.min_pairs)
         self.num_G4_pairs = min(self.num_G4_pairs,self.min_pairs_multiple*self.min_pairs)
 
-        # now create the sets for these pairs
-        self.G1_img_paths = []
-        self.G1_labels = []
-        self.G2_img_paths = []
-        self.G2_labels = []
-        self.G3_img_paths = []
-        self.G3_labels = []
-        self.G4_img_paths = []
-        self.G4_labels = []
-        
         # these are the indices of the samples in the dataset that we will use to generate the groups
         self.s_sampler_idxs = [i for i in self.s_sampler] # [c0_idx, c1_idx, c2_idx, c0_idx, c2_idx, ...]
         self.t_sampler_idxs = [i for i in self.t_sampler] # [c0_idx, c1_idx, c2_idx, c0_idx, c2_idx, ...]
@@ -330,73 +554,46 @@ class DomainAdaptationPairDataset(Dataset):
         # ensure each sample has equal probability of being selected into a pair we split the above indices into
         # partitions and randomly sample from two partitions where a partition is a sequence of items from each class
         # i.e. [c0_idx, c1_idx, c2_idx] is one partition if there are three classes.
-        self.num_s_partitions = len(self.s_sampler_idxs)/self.s_sampler.num_classes - 1
-        self.num_t_partitions = len(self.t_sampler_idxs)/self.t_sampler.num_classes - 1
-
-        # use the subsets for proper indexing
-        s_sub = self.source_dataset.subset
-        t_sub = self.target_dataset.subset
-
-        # add G1 pairs
-        pair_cnt = 0
-        while pair_cnt < self.num_G1_pairs:
-            try:
-                p1 = random.randint(0,self.num_s_partitions)*self.s_sampler.num_classes # get partition 1 pos
-                p2 = random.randint(0,self.num_s_partitions)*self.s_sampler.num_classes # get partition 2 pos
-                c = random.randint(0, self.s_sampler.num_classes-1) # get the class to use
-                x1_idx,x2_idx = s_sub[self.s_sampler_idxs[p1+c]], s_sub[self.s_sampler_idxs[p2+c]] # using the partition and class, get the sample idxs
-                self.G1_img_paths.append((self.source_dataset.imgs[x1_idx],self.source_dataset.imgs[x2_idx]))
-                self.G1_labels.append((0,(self.source_dataset.labels[x1_idx],self.source_dataset.labels[x2_idx]))) # class 0, original labels
-                pair_cnt += 1
-            except IndexError:
-                print("p1: ", p1, " p2: ", p2, " c: ", c, " len: ", len(self.s_sampler_idxs), " num p: ", self.num_s_partitions)
-
-        # add G2 pairs
-        pair_cnt = 0
-        while pair_cnt < self.num_G2_pairs:
-            p1 = random.randint(0,self.num_s_partitions)*self.s_sampler.num_classes # get partition 1 pos
-            p2 = random.randint(0,self.num_t_partitions)*self.s_sampler.num_classes # get partition 2 pos
-            c = random.randint(0, self.s_sampler.num_classes-1) # get the class to use
-            x1_idx,x2_idx = s_sub[self.s_sampler_idxs[p1+c]], t_sub[self.t_sampler_idxs[p2+c]] # using the partition and class, get the sample idxs
-            self.G2_img_paths.append((self.source_dataset.imgs[x1_idx],self.target_dataset.imgs[x2_idx]))
-            if self.adv_stage:
-                self.G2_labels.append((0,(self.source_dataset.labels[x1_idx],self.target_dataset.labels[x2_idx]))) # class 0, original labels
-            else:
-                self.G2_labels.append((1,(self.source_dataset.labels[x1_idx],self.target_dataset.labels[x2_idx]))) # class 1, original labels
-            pair_cnt += 1
-       
-        # add G3 pairs
-        pair_cnt = 0
-        while pair_cnt < self.num_G3_pairs:
-            p1 = random.randint(0,self.num_s_partitions)*self.s_sampler.num_classes # get partition 1 pos
-            p2 = random.randint(0,self.num_s_partitions)*self.s_sampler.num_classes # get partition 2 pos
-            c1,c2 = random.sample(range(self.s_sampler.num_classes),2) # get the class to use
-            x1_idx,x2_idx = s_sub[self.s_sampler_idxs[p1+c1]], s_sub[self.s_sampler_idxs[p2+c2]] # using the partition and class, get the sample idxs
-            self.G3_img_paths.append((self.source_dataset.imgs[x1_idx],self.source_dataset.imgs[x2_idx]))
-            self.G3_labels.append((2,(self.source_dataset.labels[x1_idx],self.source_dataset.labels[x2_idx]))) # class 0, original labels
-            pair_cnt += 1
-
-        # add G4 pairs
-        pair_cnt = 0
-        while pair_cnt < self.num_G2_pairs:
-            p1 = random.randint(0,self.num_s_partitions)*self.s_sampler.num_classes # get partition 1 pos
-            p2 = random.randint(0,self.num_t_partitions)*self.t_sampler.num_classes # get partition 2 pos
-            c1,c2 = random.sample(range(self.s_sampler.num_classes),2) # get the class to use
-            x1_idx,x2_idx = s_sub[self.s_sampler_idxs[p1+c1]], t_sub[self.t_sampler_idxs[p2+c2]] # using the partition and class, get the sample idxs
-            self.G4_img_paths.append((self.source_dataset.imgs[x1_idx],self.target_dataset.imgs[x2_idx]))
-            if self.adv_stage:
-                self.G4_labels.append((2,(self.source_dataset.labels[x1_idx],self.target_dataset.labels[x2_idx]))) # class 0, original labels
-            else:
-                self.G4_labels.append((3,(self.source_dataset.labels[x1_idx],self.target_dataset.labels[x2_idx]))) # class 1, original labels
-            pair_cnt += 1
+        self.num_s_partitions = len(self.s_sampler_idxs)//self.s_sampler.num_classes - 1
+        self.num_t_partitions = len(self.t_sampler_idxs)//self.t_sampler.num_classes - 1
+
+        # use the subsets for proper indexing, i.e. map the sampler positions to indices into the source/target sets
+        s_idxs = np.asarray(self.source_dataset.subset)[np.asarray(self.s_sampler_idxs, dtype=np.int64)].astype(np.int32)
+        t_idxs = np.asarray(self.target_dataset.subset)[np.asarray(self.t_sampler_idxs, dtype=np.int64)].astype(np.int32)
+
+        # all random draws come from one generator, seeded by seed or (if None) by the python random module
+        rng = np.random.default_rng(seed if seed is not None else random.getrandbits(64))
+        num_classes = self.s_sampler.num_classes
+
+        # draw num_pairs pairs at once: a random partition for each image and a random class (the same class for
+        # both images, or two different classes), the result is an (num_pairs, 2) int32 array of dataset indices
+        def sample_pairs(num_pairs,idxs1,num_partitions1,idxs2,num_partitions2,partition_size2,same_class):
+            p1 = rng.integers(0, num_partitions1 + 1, num_pairs)*num_classes # get partition 1 pos
+            p2 = rng.integers(0, num_partitions2 + 1, num_pairs)*partition_size2 # get partition 2 pos
+            c1 = rng.integers(0, num_classes, num_pairs) # get the class to use
+            c2 = c1 if same_class else (c1 + rng.integers(1, num_classes, num_pairs)) % num_classes
+            return np.stack([idxs1[p1 + c1], idxs2[p2 + c2]], axis=1) # using the partition and class, get the sample idxs
+
+        # now create the sets for these pairs as index pairs into (source, source) or (source, target)
+        # G1: same domain, same class
+        self.G1_pairs = sample_pairs(self.num_G1_pairs,s_idxs,self.num_s_partitions,s_idxs,self.num_s_partitions,num_classes,True)
+        # G2: different domain, same class
+        self.G2_pairs = sample_pairs(self.num_G2_pairs,s_idxs,self.num_s_partitions,t_idxs,self.num_t_partitions,num_classes,True)
+        # G3: same domain, different class
+        self.G3_pairs = sample_pairs(self.num_G3_pairs,s_idxs,self.num_s_partitions,s_idxs,self.num_s_partitions,num_classes,False)
+        # G4: different domain, different class (as many as G2 pairs)
+        self.G4_pairs = sample_pairs(self.num_G2_pairs,s_idxs,self.num_s_partitions,t_idxs,self.num_t_partitions,
+                                     self.t_sampler.num_classes,False)
 
         # during adversarial training, only feed in G2 and G4 and try to trick into G1 and G3
         if self.adv_stage:
-            self.group_imgs = [self.G2_img_paths,self.G4_img_paths]
-            self.group_labels = [self.G2_labels,self.G4_labels]
+            self.group_pairs = [self.G2_pairs,self.G4_pairs]
+            self.group_datasets = [(self.source_dataset,self.target_dataset)]*2
+            self.group_labels = [0,2] # pair class labels
         else:
-            self.group_imgs = [self.G1_img_paths,self.G2_img_paths,self.G3_img_paths,self.G4_img_paths]
-            self.group_labels = [self.G1_labels,self.G2_labels,self.G3_labels,self.G4_labels]
+            self.group_pairs = [self.G1_pairs,self.G2_pairs,self.G3_pairs,self.G4_pairs]
+            self.group_datasets = [(self.source_dataset,self.source_dataset),(self.source_dataset,self.target_dataset)]*2
+            self.group_labels = [0,1,2,3] # pair class labels
 
         # use whole set as subset if no validation split
         if subset == None:
@@ -433,24 +630,14 @@ class DomainAdaptationPairDataset(Dataset):
 
         # attempt to load the images at the specified index
         try:
-            # get paths
-            img1_path,img2_path = self.group_imgs[group][sub_idx]
-            label = self.group_labels[group][sub_idx]
-
-            # open the imgs
-            img1 = Image.open(img1_path)
-            img2 = Image.open(img2_path)
-
-            # extend dimensions if grayscale
-            tt = torchvision.transforms.ToTensor()
-            tp = torchvision.transforms.ToPILImage()
-            tt_img = tt(img1)
-            if(tt_img.size()[0] != 3):
-                img1 = tp(tt_img.repeat(3, 1, 1))
-
-            tt_img = tt(img2)
-            if(tt_img.size()[0] != 3):
-                img2 = tp(tt_img.repeat(3, 1, 1))
+            # get the image indices in the source/target datasets
+            img1_idx,img2_idx = self.group_pairs[group][sub_idx]
+            dataset1,dataset2 = self.group_datasets[group]
+            label = (self.group_labels[group],(dataset1.labels[img1_idx],dataset2.labels[img2_idx])) # pair class, original labels
+
+            # open the imgs (with three channels, from the datasets' caches if enabled)
+            img1 = dataset1.load_image(img1_idx)
+            img2 = dataset2.load_image(img2_idx)
             
             # apply any transformation
             if self.transform:
@@ -674,48 +861,46 @@ class EvenSampler(Sampler):
 
 # =========================== functions to create the dataset ===============================
 
+''' image cache budget: the cache_bytes argument, or else args.image_cache_bytes (--image-cache-bytes in train.py) '''
+def get_cache_bytes(args,cache_bytes=None):
+    if cache_bytes is None:
+        cache_bytes = getattr(args,'image_cache_bytes',0) or 0
+    return cache_bytes
+
+
 ''' cats and dogs'''
-def cats_and_dogs_get_datasets(data, load_train=True, load_test=True,apply_transforms=True):
+def cats_and_dogs_get_datasets(data, load_train=True, load_test=True,apply_transforms=True,cache_bytes=None):
     (data_dir, args) = data
+    cache_bytes = get_cache_bytes(args,cache_bytes)
 
     train_dataset = None
     test_dataset = None
 
     # transforms for training
     if load_train and apply_transforms:
-        train_transform = transforms.Compose([
-            transforms.Resize((128,128)),
-            transforms.ColorJitter(brightness=(0.65,1.35),saturation=(0.65,1.35),contrast=(0.65,1.35)),
-            transforms.RandomAffine(degrees=20,translate=(0.25,0.25)),
-            transforms.RandomHorizontalFlip(),
-            transforms.RandomVerticalFlip(),
-            #transforms.GaussianBlur(kernel_size=(5, 5), sigma=(0.1, 3)),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
-        train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform)
+        train_transform = batch_augment.BatchPipeline(resize_to_uint8(),batch_augment.Compose([
+            batch_augment.ToFloat(),
+            batch_augment.ColorJitter(brightness=(0.65,1.35),saturation=(0.65,1.35),contrast=(0.65,1.35)),
+            batch_augment.RandomAffine(degrees=20,translate=(0.25,0.25)),
+            batch_augment.RandomHorizontalFlip(),
+            batch_augment.RandomVerticalFlip(),
+            #batch_augment.GaussianBlur(kernel_size=(5, 5), sigma=(0.1, 3)),
+            batch_augment.ToUint8()
+        ]),post=ai8x.normalize(args=args))
+        train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform,cache_bytes=cache_bytes)
 
     # no data augmentation
     elif load_train and not apply_transforms:
-        train_transform = transforms.Compose([
-            transforms.Resize((128,128)),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
-        train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform)
+        train_transform = plain_transform(args)
+        train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform,cache_bytes=cache_bytes)
 
     else:
         train_dataset = None
 
     # transforms for test, validation --> convert to a valid tensor
     if load_test:
-        test_transform = transforms.Compose([
-            #transforms.ToPILImage(),
-            transforms.Resize((128,128)),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
-        test_dataset = ClassificationDataset(os.path.join(data_dir,"test"),test_transform)
+        test_transform = plain_transform(args)
+        test_dataset = ClassificationDataset(os.path.join(data_dir,"test"),test_transform,cache_bytes=cache_bytes)
 
     else:
         test_dataset = None
@@ -724,8 +909,9 @@ def cats_and_dogs_get_datasets(data, load_train=True, load_test=True,apply_trans
 
 
 ''' pairs for domain discriminator '''
-def pairs_get_datasets(data,conf,pair_factor):
+def pairs_get_datasets(data,conf,pair_factor,cache_bytes=None):
     (data_dir, args) = data
+    cache_bytes = get_cache_bytes(args,cache_bytes)
 
     train_dataset = None
     val_dataset = None
@@ -743,7 +929,7 @@ def pairs_get_datasets(data,conf,pair_factor):
         transforms.ToTensor(),
         ai8x.normalize(args=args)
     ])
-    train_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor)
+    train_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor,cache_bytes=cache_bytes)
     
 
     if conf.constrained_validation:
@@ -751,30 +937,30 @@ def pairs_get_datasets(data,conf,pair_factor):
         indices = torch.randperm(len(train_dataset))
         val_size = int(len(train_dataset)*conf.validation_split)
 
-        train_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor,subset=indices[val_size:])
-        val_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor,subset=indices[:val_size])
+        train_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor,subset=indices[val_size:],cache_bytes=cache_bytes)
+        val_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor,subset=indices[:val_size],cache_bytes=cache_bytes)
         
     # create independent source and target train-validation sets to sample from
     else:
         assert conf.k >= 3, "k must be >= 3, must have at least one sample per class in the validation set"
         # first create the source training datasets and split into 75-25 train-val
-        source_train_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,get_path=True)
+        source_train_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,get_path=True,cache_bytes=cache_bytes)
 
         # split the source training and val sets randomly
         indices = torch.randperm(len(source_train_dataset))
         val_size = len(source_train_dataset)//3
 
         # now create the source train-val sets from the split
-        source_train_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,indices[val_size:],True)
-        source_val_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,indices[:val_size],True)
+        source_train_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,indices[val_size:],True,cache_bytes=cache_bytes)
+        source_val_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,indices[:val_size],True,cache_bytes=cache_bytes)
 
         # repeat this process for the target but with desired k
 
         # first create the target training datasets
-        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,get_path=True)
+        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,get_path=True,cache_bytes=cache_bytes)
         sampler = EvenSampler(target_train_dataset,conf.k)
         idxs = [i for i in sampler]
-        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,get_path=True,subset=idxs)
+        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,get_path=True,subset=idxs,cache_bytes=cache_bytes)
 
         # split the source training and val sets randomly but giving equal amounts of each class
         # indices = torch.randperm(len(target_train_dataset))
@@ -782,8 +968,8 @@ def pairs_get_datasets(data,conf,pair_factor):
         val_k = conf.k//3
 
         # now create the source train-val sets from the split
-        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,idxs[sampler.num_classes*val_k:],True)
-        target_val_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,idxs[:sampler.num_classes*val_k],True)
+        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,idxs[sampler.num_classes*val_k:],True,cache_bytes=cache_bytes)
+        target_val_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,idxs[:sampler.num_classes*val_k],True,cache_bytes=cache_bytes)
 
         labels = [target_val_dataset.labels[l] for l in idxs[:sampler.num_classes*val_k]]
         # print(f"val_k: {val_k} idxs: {idxs[:sampler.num_classes*val_k]} labels: {labels}")
@@ -798,8 +984,9 @@ def pairs_get_datasets(data,conf,pair_factor):
 
 
 ''' pairs for domain discriminator in the adverserial stage, need to change labels'''
-def pairs_get_datasets_c(data,conf,pair_factor):
+def pairs_get_datasets_c(data,conf,pair_factor,cache_bytes=None):
     (data_dir, args) = data
+    cache_bytes = get_cache_bytes(args,cache_bytes)
 
     train_dataset = None
     val_dataset = None
@@ -816,7 +1003,7 @@ def pairs_get_datasets_c(data,conf,pair_factor):
         transforms.ToTensor(),
         ai8x.normalize(args=args)
     ])
-    train_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor,adv_stage=True)
+    train_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor,adv_stage=True,cache_bytes=cache_bytes)
     
 
     if conf.constrained_validation:
@@ -824,30 +1011,30 @@ def pairs_get_datasets_c(data,conf,pair_factor):
         indices = torch.randperm(len(train_dataset))
         val_size = int(len(train_dataset)*conf.validation_split)
 
-        train_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor,subset=indices[val_size:],adv_stage=True)
-        val_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor,subset=indices[:val_size],adv_stage=True)
+        train_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor,subset=indices[val_size:],adv_stage=True,cache_bytes=cache_bytes)
+        val_dataset = DomainAdaptationPairDataset(os.path.join(data_dir[0],"train"),os.path.join(data_dir[1],"train"),train_transform,shot=conf.k,pair_factor=pair_factor,subset=indices[:val_size],adv_stage=True,cache_bytes=cache_bytes)
         
     # create independent source and target train-validation sets to sample from
     else:
         assert conf.k >= 3, "k must be >= 3, must have at least one sample per class in the validation set"
         # first create the source training datasets and split into 75-25 train-val
-        source_train_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,get_path=True)
+        source_train_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,get_path=True,cache_bytes=cache_bytes)
 
         # split the source training and val sets randomly
         indices = torch.randperm(len(source_train_dataset))
         val_size = len(source_train_dataset)//3
 
         # now create the source train-val sets from the split
-        source_train_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,indices[val_size:],True)
-        source_val_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,indices[:val_size],True)
+        source_train_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,indices[val_size:],True,cache_bytes=cache_bytes)
+        source_val_dataset = ClassificationDataset(os.path.join(data_dir[0],"train"),train_transform,indices[:val_size],True,cache_bytes=cache_bytes)
 
         # repeat this process for the target but with desired k
 
         # first create the target training datasets
-        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,get_path=True)
+        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,get_path=True,cache_bytes=cache_bytes)
         sampler = EvenSampler(target_train_dataset,conf.k)
         idxs = [i for i in sampler]
-        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,get_path=True,subset=idxs)
+        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,get_path=True,subset=idxs,cache_bytes=cache_bytes)
 
         # split the source training and val sets randomly but giving equal amounts of each class
         # indices = torch.randperm(len(target_train_dataset))
@@ -855,15 +1042,15 @@ def pairs_get_datasets_c(data,conf,pair_factor):
         val_k = conf.k//3
 
         # now create the source train-val sets from the split
-        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,idxs[sampler.num_classes*val_k:],True)
-        target_val_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,idxs[:sampler.num_classes*val_k],True)
+        target_train_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,idxs[sampler.num_classes*val_k:],True,cache_bytes=cache_bytes)
+        target_val_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,idxs[:sampler.num_classes*val_k],True,cache_bytes=cache_bytes)
 
         labels = [target_val_dataset.labels[l] for l in idxs[:sampler.num_classes*val_k]]
         # print(f"val_k: {val_k} idxs: {idxs[:sampler.num_classes*val_k]} labels: {labels}")
         # target_val_dataset.visualize_batch()
 
         flat_list = [x for xs in sampler.remain_class_idxs for x in xs]
-        val_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,get_path=True,subset=flat_list)
+        val_dataset = ClassificationDataset(os.path.join(data_dir[1],"train"),train_transform,get_path=True,subset=flat_list,cache_bytes=cache_bytes)
         
 
         # finally create the pairs datasets
@@ -875,8 +1062,9 @@ def pairs_get_datasets_c(data,conf,pair_factor):
 
 
 ''' get the office5 dataset '''
-def office5_get_datasets(data, load_train=True, load_val=True, load_test=True, validation_split=0.1, fix_aug=None, deterministic=None):
+def office5_get_datasets(data, load_train=True, load_val=True, load_test=True, validation_split=0.1, fix_aug=None, deterministic=None,cache_bytes=None):
     (data_dir, args) = data
+    cache_bytes = get_cache_bytes(args,cache_bytes)
 
     train_dataset = None
     val_dataset = None
@@ -884,28 +1072,21 @@ def office5_get_datasets(data, load_train=True, load_val=True, load_test=True, v
     seed = fix_aug
     # transforms for training
     if load_train:
-        train_transform = transforms.Compose([
-            transforms.Resize((128,128)),
-            #transforms.ToPILImage(),
-            transforms.ColorJitter(brightness=(0.85,1.15),saturation=(0.75,1.25),contrast=(0.75,1.25),hue=(-0.4,0.4)),
-            transforms.RandomGrayscale(0.15),
-            transforms.RandomAffine(degrees=10,translate=(0.27,0.27)),
-            transforms.RandomHorizontalFlip(),
-            #transforms.RandomVerticalFlip(),
-            transforms.GaussianBlur(kernel_size=(3, 3), sigma=(0.1, 1.5)),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
-        train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform,get_path=True)
+        train_transform = batch_augment.BatchPipeline(resize_to_uint8(),batch_augment.Compose([
+            batch_augment.ToFloat(),
+            batch_augment.ColorJitter(brightness=(0.85,1.15),saturation=(0.75,1.25),contrast=(0.75,1.25),hue=(-0.4,0.4)),
+            batch_augment.RandomGrayscale(0.15),
+            batch_augment.RandomAffine(degrees=10,translate=(0.27,0.27)),
+            batch_augment.RandomHorizontalFlip(),
+            #batch_augment.RandomVerticalFlip(),
+            batch_augment.GaussianBlur(kernel_size=(3, 3), sigma=(0.1, 1.5)),
+            batch_augment.ToUint8()
+        ]),post=ai8x.normalize(args=args))
+        train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform,get_path=True,cache_bytes=cache_bytes)
 
         # create a validation set with no augmentations
         if load_val:
-            val_transform = transforms.Compose([
-                #transforms.ToPILImage(),
-                transforms.Resize((128,128)),
-                transforms.ToTensor(),
-                ai8x.normalize(args=args)
-            ])
+            val_transform = plain_transform(args)
 
             # split the training and val sets randomly
             indices = torch.randperm(len(train_dataset))
@@ -921,18 +1102,13 @@ def office5_get_datasets(data, load_train=True, load_val=True, load_test=True, v
                     random.seed(seed) 
                     torch.manual_seed(seed)
 
-            train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform,indices[val_size:],True)
-            val_dataset = ClassificationDataset(os.path.join(data_dir,"train"),val_transform,indices[:val_size],True)
+            train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform,indices[val_size:],True,cache_bytes=cache_bytes)
+            val_dataset = ClassificationDataset(os.path.join(data_dir,"train"),val_transform,indices[:val_size],True,cache_bytes=cache_bytes)
 
     # transforms for test --> convert to a valid tensor
     if load_test:
-        test_transform = transforms.Compose([
-            #transforms.ToPILImage(),
-            transforms.Resize((128,128)),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
-        test_dataset = ClassificationDataset(os.path.join(data_dir,"test"),test_transform,None,True)
+        test_transform = plain_transform(args)
+        test_dataset = ClassificationDataset(os.path.join(data_dir,"test"),test_transform,None,True,cache_bytes=cache_bytes)
     
     return train_dataset, val_dataset, test_dataset, seed
 
@@ -986,8 +1162,9 @@ def pass_get_datasets(data, load_train=True, load_test=False,apply_transforms=Tr
 
 
 ''' get the office5 dataset '''
-def asl_get_datasets(data, load_train=True, load_val=True, load_test=True, validation_split=0.1, fix_aug=None, deterministic=None):
+def asl_get_datasets(data, load_train=True, load_val=True, load_test=True, validation_split=0.1, fix_aug=None, deterministic=None,cache_bytes=None):
     (data_dir, args) = data
+    cache_bytes = get_cache_bytes(args,cache_bytes)
 
     train_dataset = None
     val_dataset = None
@@ -995,28 +1172,21 @@ def asl_get_datasets(data, load_train=True, load_val=True, load_test=True, valid
     seed = fix_aug
     # transforms for training
     if load_train:
-        train_transform = transforms.Compose([
-            transforms.Resize((128,128)),
-            #transforms.ToPILImage(),
-            transforms.ColorJitter(brightness=(0.85,1.15),saturation=(0.75,1.25),contrast=(0.75,1.25),hue=(-0.4,0.4)),
-            transforms.RandomGrayscale(0.15),
-            transforms.RandomAffine(degrees=5,translate=(0.1,0.1)),
-            #transforms.RandomHorizontalFlip(),
-            #transforms.RandomVerticalFlip(),
-            transforms.GaussianBlur(kernel_size=(3, 3), sigma=(0.1, 1.5)),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
-        train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform,get_path=True)
+        train_transform = batch_augment.BatchPipeline(resize_to_uint8(),batch_augment.Compose([
+            batch_augment.ToFloat(),
+            batch_augment.ColorJitter(brightness=(0.85,1.15),saturation=(0.75,1.25),contrast=(0.75,1.25),hue=(-0.4,0.4)),
+            batch_augment.RandomGrayscale(0.15),
+            batch_augment.RandomAffine(degrees=5,translate=(0.1,0.1)),
+            #batch_augment.RandomHorizontalFlip(),
+            #batch_augment.RandomVerticalFlip(),
+            batch_augment.GaussianBlur(kernel_size=(3, 3), sigma=(0.1, 1.5)),
+            batch_augment.ToUint8()
+        ]),post=ai8x.normalize(args=args))
+        train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform,get_path=True,cache_bytes=cache_bytes)
 
         # create a validation set with no augmentations
         if load_val:
-            val_transform = transforms.Compose([
-                #transforms.ToPILImage(),
-                transforms.Resize((128,128)),
-                transforms.ToTensor(),
-                ai8x.normalize(args=args)
-            ])
+            val_transform = plain_transform(args)
 
             # split the training and val sets randomly
             indices = torch.randperm(len(train_dataset))
@@ -1032,18 +1202,13 @@ def asl_get_datasets(data, load_train=True, load_val=True, load_test=True, valid
                     random.seed(seed) 
                     torch.manual_seed(seed)
 
-            train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform,indices[val_size:],True)
-            val_dataset = ClassificationDataset(os.path.join(data_dir,"train"),val_transform,indices[:val_size],True)
+            train_dataset = ClassificationDataset(os.path.join(data_dir,"train"),train_transform,indices[val_size:],True,cache_bytes=cache_bytes)
+            val_dataset = ClassificationDataset(os.path.join(data_dir,"train"),val_transform,indices[:val_size],True,cache_bytes=cache_bytes)
 
     # transforms for test --> convert to a valid tensor
     if load_test:
-        test_transform = transforms.Compose([
-            #transforms.ToPILImage(),
-            transforms.Resize((128,128)),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
-        test_dataset = ClassificationDataset(os.path.join(data_dir,"test"),test_transform,None,True)
+        test_transform = plain_transform(args)
+        test_dataset = ClassificationDataset(os.path.join(data_dir,"test"),test_transform,None,True,cache_bytes=cache_bytes)
     
     return train_dataset, val_dataset, test_dataset, seed
 
@@ -31,6 +31,8 @@ from torchvision import transforms
 
 import ai8x
 
+from . import batch_augment
+
 
 def imagenet_get_datasets(data, load_train=True, load_test=True, input_size=112, folder=False):
     """
@@ -48,13 +50,18 @@ def imagenet_get_datasets(data, load_train=True, load_test=True, input_size=112,
     (data_dir, args) = data
 
     if load_train:
-        train_transform = transforms.Compose([
-            transforms.RandomResizedCrop(input_size),
-            transforms.RandomHorizontalFlip(),
-            transforms.ToTensor(),
-            transforms.Normalize((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
-            ai8x.normalize(args=args),
-        ])
+        train_transform = batch_augment.BatchPipeline(
+            sample=transforms.Compose([
+                transforms.RandomResizedCrop(input_size),
+                transforms.PILToTensor(),
+            ]),
+            batch=batch_augment.RandomHorizontalFlip(),
+            post=batch_augment.Compose([
+                batch_augment.ToFloat(),
+                batch_augment.Normalize((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+                ai8x.normalize(args=args),
+            ]),
+        )
 
         if not folder:
             train_dataset = torchvision.datasets.ImageNet(
@@ -71,13 +78,18 @@ def imagenet_get_datasets(data, load_train=True, load_test=True, input_size=112,
         train_dataset = None
 
     if load_test:
-        test_transform = transforms.Compose([
-            transforms.Resize(int(input_size / 0.875)),
-            transforms.CenterCrop(input_size),
-            transforms.ToTensor(),
-            transforms.Normalize((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
-            ai8x.normalize(args=args),
-        ])
+        test_transform = batch_augment.BatchPipeline(
+            sample=transforms.Compose([
+                transforms.Resize(int(input_size / 0.875)),
+                transforms.CenterCrop(input_size),
+                transforms.PILToTensor(),
+            ]),
+            post=batch_augment.Compose([
+                batch_augment.ToFloat(),
+                batch_augment.Normalize((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+                ai8x.normalize(args=args),
+            ]),
+        )
 
         if not folder:
             test_dataset = torchvision.datasets.ImageNet(
@@ -24,6 +24,7 @@
 """
 Classes and functions used to create keyword spotting dataset.
 """
+import concurrent.futures
 import errno
 import hashlib
 import os
@@ -31,9 +32,9 @@ import tarfile
 import time
 import urllib
 import warnings
+import zlib
 
 import numpy as np
-import torch
 from torch.utils.model_zoo import tqdm
 from torchvision import transforms
 
@@ -42,8 +43,12 @@ import pytsmod as tsm
 
 import ai8x
 
+from . import audio_folding, memmap, tensor_loader
 
-class KWS:
+MAX_GEN_WORKERS = 8
+
+
+class KWS(tensor_loader.QuantizedTensorMixin):
     """
     `SpeechCom v0.02 <http://download.tensorflow.org/data/speech_commands_v0.02.tar.gz>`
     Dataset, 1D folded.
@@ -61,6 +66,9 @@ class KWS:
         puts it in root directory. If dataset is already downloaded, it is not
         downloaded again.
     save_unquantized (bool, optional): If true, folded but unquantized data is saved.
+    num_workers (int, optional): Number of processes that generate the dataset when it does
+        not exist yet (default: the number of CPUs, at most `MAX_GEN_WORKERS`). Every process
+        holds the decoded audio of one shard.
 
     """
 
@@ -75,7 +83,7 @@ class KWS:
                   'up': 30, 'visual': 31, 'wow': 32, 'yes': 33, 'zero': 34}
 
     def __init__(self, root, classes, d_type, t_type, transform=None, quantization_scheme=None,
-                 augmentation=None, download=False, save_unquantized=False):
+                 augmentation=None, download=False, save_unquantized=False, num_workers=None):
 
         self.root = root
         self.classes = classes
@@ -83,6 +91,9 @@ class KWS:
         self.t_type = t_type
         self.transform = transform
         self.save_unquantized = save_unquantized
+        if num_workers is None:
+            num_workers = min(os.cpu_count() or 1, MAX_GEN_WORKERS)
+        self.num_workers = max(num_workers, 1)
 
         self.__parse_quantization(quantization_scheme)
         self.__parse_augmentation(augmentation)
@@ -95,8 +106,8 @@ class KWS:
         if download:
             self.__download()
 
-        self.data, self.targets, self.data_type = torch.load(os.path.join(
-            self.processed_folder, self.data_file))
+        self.data, self.targets, self.data_type = memmap.load(self.processed_folder,
+                                                              self.data_file)
 
         print(f'\nProcessing {self.d_type}...')
         self.__filter_dtype()
@@ -166,7 +177,8 @@ class KWS:
         self.__gen_datasets()
 
     def __check_exists(self):
-        return os.path.exists(os.path.join(self.processed_folder, self.data_file))
+        return memmap.exists(self.processed_folder, self.data_file) or \
+            os.path.exists(os.path.join(self.processed_folder, self.data_file))
 
     def __makedir_exist_ok(self, dirpath):  # pylint: disable=no-self-use
         try:
@@ -309,14 +321,6 @@ class KWS:
     def __len__(self):
         return len(self.data)
 
-    def __getitem__(self, index):
-        inp, target = self.data[index].type(torch.FloatTensor), int(self.targets[index])
-        if not self.save_unquantized:
-            inp /= 256
-        if self.transform is not None:
-            inp = self.transform(inp)
-        return inp, target
-
     @staticmethod
     def add_white_noise(audio, noise_var_coeff):
         """Adds zero mean Gaussian noise to image with specified variance.
@@ -374,135 +378,116 @@ class KWS:
     @staticmethod
     def compand(data, mu=255):
         """Compand the signal level to warp from Laplacian distribution to uniform distribution"""
-        data = np.sign(data) * np.log(1 + mu*np.abs(data)) / np.log(1 + mu)
-        return data
+        return audio_folding.compand(data, mu)
 
     @staticmethod
     def expand(data, mu=255):
         """Undo the companding"""
-        data = np.sign(data) * (1 / mu) * (np.power((1 + mu), np.abs(data)) - 1)
-        return data
+        return audio_folding.expand(data, mu)
 
     @staticmethod
     def quantize_audio(data, num_bits=8, compand=False, mu=255):
         """Quantize audio
         """
-        if compand:
-            data = KWS.compand(data, mu)
-
-        step_size = 2.0 / 2**(num_bits)
-        max_val = 2**(num_bits) - 1
-        q_data = np.round((data - (-1.0)) / step_size)
-        q_data = np.clip(q_data, 0, max_val)
-
-        if compand:
-            data_ex = (q_data - 2**(num_bits - 1)) / 2**(num_bits - 1)
-            data_ex = KWS.expand(data_ex)
-            q_data = np.round((data_ex - (-1.0)) / step_size)
-            q_data = np.clip(q_data, 0, max_val)
-        return np.uint8(q_data)
-
-    def __gen_datasets(self, exp_len=16384, row_len=128, overlap_ratio=0):
-        print('Generating dataset from raw data samples for the first time. ')
-        print('This process will take significant time (~60 minutes)...')
-        with warnings.catch_warnings():
-            warnings.simplefilter('error')
+        return audio_folding.quantize(data, num_bits=num_bits, compand_data=compand, mu=mu)
 
-            lst = sorted(os.listdir(self.raw_folder))
-            labels = [d for d in lst if os.path.isdir(os.path.join(self.raw_folder, d))
-                      and d[0].isalpha()]
-
-            # PARAMETERS
-            overlap = int(np.ceil(row_len * overlap_ratio))
-            num_rows = int(np.ceil(exp_len / (row_len - overlap)))
-            data_len = int((num_rows*row_len - (num_rows-1)*overlap))
-            print(f'data_len: {data_len}')
-
-            # show the size of dataset for each keyword
-            print('------------- Label Size ---------------')
-            for i, label in enumerate(labels):
-                record_list = os.listdir(os.path.join(self.raw_folder, label))
-                print(f'{label:8s}:  \t{len(record_list)}')
-            print('------------------------------------------')
-
-            for i, label in enumerate(labels):
-                print(f'Processing the label: {label}. {i + 1} of {len(labels)}')
-                record_list = sorted(os.listdir(os.path.join(self.raw_folder, label)))
-
-                # dimension: row_length x number_of_rows
-                if not self.save_unquantized:
-                    data_in = np.empty(((self.augmentation['aug_num'] + 1) * len(record_list),
-                                        row_len, num_rows), dtype=np.uint8)
-                else:
-                    data_in = np.empty(((self.augmentation['aug_num'] + 1) * len(record_list),
-                                        row_len, num_rows), dtype=np.float32)
-                data_type = np.empty(((self.augmentation['aug_num'] + 1) * len(record_list), 1),
-                                     dtype=np.uint8)
-                # create data classes
-                data_class = np.full(((self.augmentation['aug_num'] + 1) * len(record_list), 1), i,
-                                     dtype=np.uint8)
-
-                time_s = time.time()
-                train_count = 0
-                test_count = 0
-                for r, record_name in enumerate(record_list):
-                    if r % 1000 == 0:
-                        print(f'\t{r + 1} of {len(record_list)}')
-
-                    if hash(record_name) % 10 < 9:
-                        d_typ = np.uint8(0)  # train+val
-                        train_count += 1
-                    else:
-                        d_typ = np.uint8(1)  # test
-                        test_count += 1
-
-                    record_pth = os.path.join(self.raw_folder, label, record_name)
-                    record, fs = librosa.load(record_pth, offset=0, sr=None)
-                    audio_seq_list = self.augment_multiple(record, fs,
-                                                           self.augmentation['aug_num'])
-                    for n_a, audio_seq in enumerate(audio_seq_list):
-                        # store set type: train+validate or test
-                        data_type[(self.augmentation['aug_num'] + 1) * r + n_a, 0] = d_typ
-
-                        # Write audio 128x128=16384 samples without overlap
-                        for n_r in range(num_rows):
-                            start_idx = n_r*(row_len - overlap)
-                            end_idx = start_idx + row_len
-                            audio_chunk = audio_seq[start_idx:end_idx]
-                            # pad zero if the length of the chunk is smaller than row_len
-                            audio_chunk = np.pad(audio_chunk, [0, row_len-audio_chunk.size])
-                            # store input data after quantization
-                            data_idx = (self.augmentation['aug_num'] + 1) * r + n_a
-                            if not self.save_unquantized:
-                                data_in[data_idx, :, n_r] = \
-                                    KWS.quantize_audio(audio_chunk,
-                                                       num_bits=self.quantization['bits'],
-                                                       compand=self.quantization['compand'],
-                                                       mu=self.quantization['mu'])
-                            else:
-                                data_in[data_idx, :, n_r] = audio_chunk
-
-                dur = time.time() - time_s
-                print(f'Finished in {dur:.3f} seconds.')
-                print(data_in.shape)
-                time_s = time.time()
-                if i == 0:
-                    data_in_all = data_in.copy()
-                    data_class_all = data_class.copy()
-                    data_type_all = data_type.copy()
-                else:
-                    data_in_all = np.concatenate((data_in_all, data_in), axis=0)
-                    data_class_all = np.concatenate((data_class_all, data_class), axis=0)
-                    data_type_all = np.concatenate((data_type_all, data_type), axis=0)
-                dur = time.time() - time_s
-                print(f'Data concatenation finished in {dur:.3f} seconds.')
-
-            data_in_all = torch.from_numpy(data_in_all)
-            data_class_all = torch.from_numpy(data_class_all)
-            data_type_all = torch.from_numpy(data_type_all)
+    @staticmethod
+    def is_test_record(record_name):
+        """Assigns about 10% of the records to the test set, independent of the process
+        """
+        return zlib.crc32(record_name.encode()) % 10 >= 9
 
-            mfcc_dataset = (data_in_all, data_class_all, data_type_all)
-            torch.save(mfcc_dataset, os.path.join(self.processed_folder, self.data_file))
+    def _gen_shard(self, data_path, shard, start, label, record_list, row_len, num_rows,
+                   overlap):
+        """Folds (and quantizes) the augmented audio of `record_list` into the rows of the
+        output starting at `start`. The random augmentation is seeded by the shard index only,
+        so the output does not depend on the number of worker processes.
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            np.random.seed([self.augmentation.get('seed', 0), shard])
+
+            data_in = np.load(data_path, mmap_mode='r+')
+            n_aug = self.augmentation['aug_num'] + 1
+            for r, record_name in enumerate(record_list):
+                record_pth = os.path.join(self.raw_folder, label, record_name)
+                record, fs = librosa.load(record_pth, offset=0, sr=None)
+                audio_seq_list = self.augment_multiple(record, fs, self.augmentation['aug_num'])
+                for n_a, audio_seq in enumerate(audio_seq_list):
+                    # Write audio 128x128=16384 samples without overlap
+                    data_in[start + n_aug * r + n_a] = audio_folding.fold_and_quantize(
+                        audio_seq[np.newaxis], row_len, num_rows, overlap,
+                        None if self.save_unquantized else self.quantization)[0]
+            data_in.flush()
+        return shard
+
+    def __gen_datasets(self, exp_len=16384, row_len=128, overlap_ratio=0, shard_size=256):
+        print('Generating dataset from raw data samples for the first time. ')
+        print('This process will take significant time (~60 minutes on a single core)...')
+
+        lst = sorted(os.listdir(self.raw_folder))
+        labels = [d for d in lst if os.path.isdir(os.path.join(self.raw_folder, d))
+                  and d[0].isalpha()]
+
+        # PARAMETERS
+        overlap = int(np.ceil(row_len * overlap_ratio))
+        num_rows = int(np.ceil(exp_len / (row_len - overlap)))
+        data_len = int((num_rows*row_len - (num_rows-1)*overlap))
+        print(f'data_len: {data_len}')
+        n_aug = self.augmentation['aug_num'] + 1
+
+        # Split the records of each label into shards of up to `shard_size` records, and
+        # assign each shard its rows in the (preallocated) output
+        print('------------- Label Size ---------------')
+        shards = []
+        data_class = []
+        data_type = []
+        start = 0
+        for i, label in enumerate(labels):
+            record_list = sorted(os.listdir(os.path.join(self.raw_folder, label)))
+            print(f'{label:8s}:  \t{len(record_list)}')
+            for r in range(0, len(record_list), shard_size):
+                shards.append((start, label, record_list[r:r + shard_size]))
+                start += n_aug * len(shards[-1][2])
+            data_class.append(np.full((n_aug * len(record_list), 1), i, dtype=np.uint8))
+            # store set type: train+validate (0) or test (1)
+            d_typ = np.array([self.is_test_record(r) for r in record_list], dtype=np.uint8)
+            data_type.append(np.repeat(d_typ, n_aug)[:, np.newaxis])
+        print('------------------------------------------')
+        data_class = np.concatenate(data_class)
+        data_type = np.concatenate(data_type)
+        test_count = int(data_type.sum()) // n_aug
+        train_count = len(data_type) // n_aug - test_count
+
+        dtype = np.float32 if self.save_unquantized else np.uint8
+        params = {'shape': [start, row_len, num_rows], 'dtype': np.dtype(dtype).str,
+                  'shard_size': shard_size, 'augmentation': self.augmentation,
+                  'quantization': self.quantization}
+        done = memmap.load_manifest(self.processed_folder, self.data_file, params)
+        if done is None:
+            done = set()
+            memmap.create(self.processed_folder, self.data_file, (start, row_len, num_rows),
+                          dtype).flush()
+            memmap.save_manifest(self.processed_folder, self.data_file, params, done)
+        else:
+            print(f'Resuming, {len(done)} of {len(shards)} shards are complete.')
+
+        data_path, _ = memmap.paths(self.processed_folder, self.data_file)
+        time_s = time.time()
+        print(f'Using {self.num_workers} worker processes.')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(self._gen_shard, data_path, shard, *shards[shard],
+                                       row_len, num_rows, overlap)
+                       for shard in range(len(shards)) if shard not in done]
+            for future in concurrent.futures.as_completed(futures):
+                done.add(future.result())
+                memmap.save_manifest(self.processed_folder, self.data_file, params, done)
+                print(f'\t{len(done)} of {len(shards)} shards')
+        dur = time.time() - time_s
+        print(f'Finished in {dur:.3f} seconds.')
+
+        memmap.save_index(self.processed_folder, self.data_file, data_class, data_type)
+        memmap.remove_manifest(self.processed_folder, self.data_file)
 
         print('Dataset created.')
         print(f'Training+Validation: {train_count},  Test: {test_count}')
@@ -553,7 +538,8 @@ def KWS_get_datasets(data, load_train=True, load_test=True, num_classes=6):
         train_dataset = KWS(root=data_dir, classes=classes, d_type='train',
                             transform=transform, t_type='keyword',
                             quantization_scheme=quantization_scheme,
-                            augmentation=augmentation, download=True)
+                            augmentation=augmentation, download=True,
+                            num_workers=getattr(args, 'workers', None))
     else:
         train_dataset = None
 
@@ -561,7 +547,8 @@ def KWS_get_datasets(data, load_train=True, load_test=True, num_classes=6):
         test_dataset = KWS(root=data_dir, classes=classes, d_type='test',
                            transform=transform, t_type='keyword',
                            quantization_scheme=quantization_scheme,
-                           augmentation=augmentation, download=True)
+                           augmentation=augmentation, download=True,
+                           num_workers=getattr(args, 'workers', None))
 
         if args.truncate_testset:
             test_dataset.data = test_dataset.data[:1]
@@ -614,7 +601,8 @@ def KWS_get_unquantized_datasets(data, load_train=True, load_test=True, num_clas
         train_dataset = KWS(root=data_dir, classes=classes, d_type='train',
                             transform=transform, t_type='keyword',
                             quantization_scheme=quantization_scheme,
-                            augmentation=augmentation, download=True)
+                            augmentation=augmentation, download=True,
+                            num_workers=getattr(args, 'workers', None))
     else:
         train_dataset = None
 
@@ -622,7 +610,8 @@ def KWS_get_unquantized_datasets(data, load_train=True, load_test=True, num_clas
         test_dataset = KWS(root=data_dir, classes=classes, d_type='test',
                            transform=transform, t_type='keyword',
                            quantization_scheme=quantization_scheme,
-                           augmentation=augmentation, download=True)
+                           augmentation=augmentation, download=True,
+                           num_workers=getattr(args, 'workers', None))
 
         if args.truncate_testset:
             test_dataset.data = test_dataset.data[:1]
@@ -0,0 +1,193 @@
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Memory-mapped storage for processed datasets that are held as one large array.
+
+A processed dataset `<name>.pt` is stored as two files in the processed folder:
+* `<name>.npy`: the data of all samples as one array that is memory-mapped on access, and
+* `<name>_index.npz`: the (small) `targets` and `data_type` arrays.
+The index file is written last, so its existence marks a complete dataset. Generators that
+write the data in shards can record the completed shards in `<name>_manifest.json` so that an
+interrupted build resumes where it stopped.
+
+Datasets open the data lazily through `IndexedMemmap`, which filters by index arrays instead
+of copying, so construction is fast and all DataLoader workers share the same page cache.
+"""
+import json
+import os
+
+import numpy as np
+import torch
+
+
+def paths(folder, data_file):
+    """
+    Return the paths of the data and the index file for processed dataset `data_file`.
+    """
+    stem = os.path.splitext(data_file)[0]
+    return os.path.join(folder, stem + '.npy'), os.path.join(folder, stem + '_index.npz')
+
+
+def exists(folder, data_file):
+    """
+    Return True if the memory-mapped version of `data_file` is complete.
+    """
+    return os.path.exists(paths(folder, data_file)[1])
+
+
+def create(folder, data_file, shape, dtype):
+    """
+    Create and return a writable memory-mapped data array for `data_file`. Call
+    `save_index()` when all data has been written.
+    """
+    data_path, _ = paths(folder, data_file)
+    return np.lib.format.open_memmap(data_path, mode='w+', dtype=dtype, shape=shape)
+
+
+def save_index(folder, data_file, targets, data_type):
+    """
+    Save the `targets` and `data_type` arrays of `data_file`, completing the dataset.
+    """
+    _, index_path = paths(folder, data_file)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, targets=np.asarray(targets), data_type=np.asarray(data_type))
+    os.replace(tmp_path, index_path)
+
+
+def save(folder, data_file, data, targets, data_type):
+    """
+    Save `data`, `targets` and `data_type` of `data_file` in the memory-mapped format.
+    """
+    data = np.asarray(data)
+    data_out = create(folder, data_file, data.shape, data.dtype)
+    data_out[:] = data
+    data_out.flush()
+    del data_out
+    save_index(folder, data_file, targets, data_type)
+
+
+def manifest_path(folder, data_file):
+    """
+    Return the path of the shard manifest of `data_file`.
+    """
+    return os.path.join(folder, os.path.splitext(data_file)[0] + '_manifest.json')
+
+
+def load_manifest(folder, data_file, params):
+    """
+    Return the set of completed shards of a partially written `data_file`, or None if
+    there is none or if it was started with parameters other than `params`.
+    """
+    path = manifest_path(folder, data_file)
+    if not os.path.exists(path) or not os.path.exists(paths(folder, data_file)[0]):
+        return None
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest['params'] != json.loads(json.dumps(params)):
+        return None
+    return set(manifest['done'])
+
+
+def save_manifest(folder, data_file, params, done):
+    """
+    Record the completed shards `done` of `data_file` written with `params`.
+    """
+    path = manifest_path(folder, data_file)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'params': params, 'done': sorted(done)}, f)
+    os.replace(tmp_path, path)
+
+
+def remove_manifest(folder, data_file):
+    """
+    Remove the shard manifest of `data_file` once the dataset is complete.
+    """
+    path = manifest_path(folder, data_file)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def load(folder, data_file):
+    """
+    Return the lazily opened data (as `IndexedMemmap`), and the `targets` and `data_type`
+    tensors of processed dataset `data_file`. A dataset that was saved with `torch.save()`
+    is converted to the memory-mapped format once.
+    """
+    if not exists(folder, data_file):
+        legacy_path = os.path.join(folder, data_file)
+        print(f'Converting {legacy_path} to the memory-mapped format...')
+        data, targets, data_type = torch.load(legacy_path)
+        save(folder, data_file, data.numpy(), targets.numpy(), data_type.numpy())
+        del data
+
+    data_path, index_path = paths(folder, data_file)
+    with np.load(index_path) as index:
+        targets = torch.from_numpy(index['targets'])
+        data_type = torch.from_numpy(index['data_type'])
+
+    return IndexedMemmap(data_path), targets, data_type
+
+
+class IndexedMemmap:
+    """
+    Read-only view of the rows `indices` of the array stored in the `.npy` file at `path`.
+    The file is memory-mapped on first access in each process and is never copied as a
+    whole. Indexing with an integer returns the row as a tensor (like indexing a tensor),
+    while indexing with a slice, an index array or a boolean mask returns a new view.
+    """
+    def __init__(self, path, indices=None):
+        self.path = path
+        self.array = None
+        if indices is None:
+            indices = np.arange(len(self.open()))
+        self.indices = indices
+
+    def open(self):
+        """Memory-map the file if necessary and return the array"""
+        if self.array is None:
+            self.array = np.load(self.path, mmap_mode='r')
+        return self.array
+
+    def __getstate__(self):
+        # Do not copy the mapped data when sending the dataset to worker processes
+        state = self.__dict__.copy()
+        state['array'] = None
+        return state
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def shape(self):
+        """Shape of the view"""
+        return (len(self.indices), ) + self.open().shape[1:]
+
+    @property
+    def dtype(self):
+        """Data type of the stored array"""
+        return self.open().dtype
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            if any(i != slice(None) for i in index[1:]):
+                raise IndexError('Only the first dimension can be indexed')
+            index = index[0]
+        if isinstance(index, torch.Tensor):
+            index = index.cpu().numpy()
+            if index.ndim == 0:
+                index = index.item()
+        if isinstance(index, (int, np.integer)):
+            return torch.from_numpy(np.array(self.open()[self.indices[index]]))
+        return IndexedMemmap(self.path, self.indices[index])
+
+    def numpy(self, start=0, stop=None):
+        """Return a copy of the rows [`start`, `stop`) of the view as a NumPy array"""
+        return np.asarray(self.open()[self.indices[start:stop]])
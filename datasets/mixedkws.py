@@ -28,16 +28,16 @@ import errno
 import os
 
 import numpy as np
-import torch
 from torchvision import transforms
 
 import ai8x
 
+from . import audio_folding, memmap, tensor_loader
 from .kws20 import KWS_35_get_unquantized_datasets
 from .msnoise import MSnoise_get_unquantized_datasets
 
 
-class MixedKWS:
+class MixedKWS(tensor_loader.QuantizedTensorMixin):
     """
     Dataset for adding noise to SpeechCom dataset, 1D folded.
 
@@ -85,8 +85,8 @@ class MixedKWS:
         if download:
             self.__download()
 
-        self.data, self.targets, self.data_type = torch.load(os.path.join(
-            self.processed_folder, self.data_file))
+        self.data, self.targets, self.data_type = memmap.load(self.processed_folder,
+                                                              self.data_file)
 
         self.__filter_dtype()
         self.__filter_classes()
@@ -101,7 +101,8 @@ class MixedKWS:
         self.__gen_datasets()
 
     def __check_exists(self):
-        return os.path.exists(os.path.join(self.processed_folder, self.data_file))
+        return memmap.exists(self.processed_folder, self.data_file) or \
+            os.path.exists(os.path.join(self.processed_folder, self.data_file))
 
     def __makedir_exist_ok(self, dirpath):  # pylint: disable=no-self-use
         try:
@@ -151,14 +152,6 @@ class MixedKWS:
     def __len__(self):
         return len(self.data)
 
-    def __getitem__(self, index):
-        inp, target = self.data[index].type(torch.FloatTensor), int(self.targets[index])
-        if not self.save_unquantized:
-            inp /= 256
-        if self.transform is not None:
-            inp = self.transform(inp)
-        return inp, target
-
     @property
     def raw_folder(self):
         """Folder for the raw data.
@@ -190,32 +183,17 @@ class MixedKWS:
     @staticmethod
     def compand(data, mu=255):
         """Compand the signal level to warp from Laplacian distribution to uniform distribution"""
-        data = np.sign(data) * np.log(1 + mu*np.abs(data)) / np.log(1 + mu)
-        return data
+        return audio_folding.compand(data, mu)
 
     @staticmethod
     def expand(data, mu=255):
         """Undo the companding"""
-        data = np.sign(data) * (1 / mu) * (np.power((1 + mu), np.abs(data)) - 1)
-        return data
+        return audio_folding.expand(data, mu)
 
     @staticmethod
     def quantize_audio(data, num_bits=8, compand=False, mu=255):
         """Quantize audio"""
-        if compand:
-            data = MixedKWS.compand(data, mu)
-
-        step_size = 2.0 / 2**(num_bits)
-        max_val = 2**(num_bits) - 1
-        q_data = np.round((data - (-1.0)) / step_size)
-        q_data = np.clip(q_data, 0, max_val)
-
-        if compand:
-            data_ex = (q_data - 2**(num_bits - 1)) / 2**(num_bits - 1)
-            data_ex = MixedKWS.expand(data_ex)
-            q_data = np.round((data_ex - (-1.0)) / step_size)
-            q_data = np.clip(q_data, 0, max_val)
-        return np.uint8(q_data)
+        return audio_folding.quantize(data, num_bits=num_bits, compand_data=compand, mu=mu)
 
     @staticmethod
     def __snr_mixer(clean, noise, snr):
@@ -272,42 +250,36 @@ class MixedKWS:
         new_ind = 0
         for ind_s, speech in enumerate(speeches):
             noise = noises[ind_s]
+            targets = [train_speech.targets, test_speech.targets][ind_s]
             for i in range(speech.shape[0]):
-                for _ in range(self.n_augment):
+                noisy_speech = np.empty((self.n_augment, ) + speech.shape[1:],
+                                        dtype=speech.dtype)
+                for n_a in range(self.n_augment):
                     while True:
                         rand_ind = np.random.randint(noise.shape[0])
                         random_noise = noise[rand_ind]
                         if np.any(random_noise):
                             break
 
-                    noisy_speech = self.__snr_mixer(speech[i, :, :],
-                                                    random_noise, self.snr)
-                    if not self.save_unquantized:
-                        data_in[new_ind, :, :] = (self.quantize_audio(noisy_speech,
-                                                  num_bits=self.quantization['bits'],
-                                                  compand=self.quantization['compand'],
-                                                  mu=self.quantization['mu']))
-                    else:
-                        data_in[new_ind, :, :] = noisy_speech
-
-                    if ind_s == 0:
-                        data_type[new_ind] = np.uint8(0)
-                    elif ind_s == 1:
-                        data_type[new_ind] = np.uint8(1)
-
-                    if ind_s == 0:
-                        data_class[new_ind] = np.uint8(train_speech.targets[i].item())
-                    elif ind_s == 1:
-                        data_class[new_ind] = np.uint8(test_speech.targets[i].item())
-
-                    new_ind += 1
-
-        data_in = torch.from_numpy(data_in)
-        data_class = torch.from_numpy(data_class)
-        data_type = torch.from_numpy(data_type)
-
-        noise_dataset = (data_in, data_class, data_type)
-        torch.save(noise_dataset, os.path.join(self.processed_folder, self.data_file))
+                    noisy_speech[n_a] = self.__snr_mixer(speech[i, :, :], random_noise,
+                                                         self.snr)
+
+                # The speech and noise data are already folded, so quantize all mixes at once
+                end_ind = new_ind + self.n_augment
+                if not self.save_unquantized:
+                    data_in[new_ind:end_ind] = audio_folding.quantize(
+                        noisy_speech, num_bits=self.quantization['bits'],
+                        compand_data=self.quantization['compand'],
+                        mu=self.quantization.get('mu', 255))
+                else:
+                    data_in[new_ind:end_ind] = noisy_speech
+
+                data_type[new_ind:end_ind] = np.uint8(ind_s)
+                data_class[new_ind:end_ind] = np.uint8(targets[i].item())
+
+                new_ind = end_ind
+
+        memmap.save(self.processed_folder, self.data_file, data_in, data_class, data_type)
         print('Dataset for Mixed KWS is generated!')
 
 
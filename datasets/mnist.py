@@ -29,6 +29,8 @@ from torchvision import transforms
 
 import ai8x
 
+from . import batch_augment
+
 
 def mnist_get_datasets(data, load_train=True, load_test=True):
     """
@@ -52,12 +54,14 @@ def mnist_get_datasets(data, load_train=True, load_test=True):
     (data_dir, args) = data
 
     if load_train:
-        train_transform = transforms.Compose([
-            transforms.RandomCrop(28, padding=4),
-            transforms.RandomAffine(degrees=20, translate=(0.1, 0.1), shear=5),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
+        train_transform = batch_augment.BatchPipeline(
+            sample=transforms.Compose([
+                transforms.RandomCrop(28, padding=4),
+                transforms.RandomAffine(degrees=20, translate=(0.1, 0.1), shear=5),
+                transforms.PILToTensor(),
+            ]),
+            post=ai8x.normalize(args=args),
+        )
 
         train_dataset = torchvision.datasets.MNIST(root=data_dir, train=True, download=True,
                                                    transform=train_transform)
@@ -65,10 +69,10 @@ def mnist_get_datasets(data, load_train=True, load_test=True):
         train_dataset = None
 
     if load_test:
-        test_transform = transforms.Compose([
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
+        test_transform = batch_augment.BatchPipeline(
+            sample=transforms.PILToTensor(),
+            post=ai8x.normalize(args=args),
+        )
 
         test_dataset = torchvision.datasets.MNIST(root=data_dir, train=False, download=True,
                                                   transform=test_transform)
@@ -103,12 +107,14 @@ def fashionmnist_get_datasets(data, load_train=True, load_test=True):
     (data_dir, args) = data
 
     if load_train:
-        train_transform = transforms.Compose([
-            transforms.RandomCrop(28, padding=4),
-            transforms.RandomHorizontalFlip(),
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
+        train_transform = batch_augment.BatchPipeline(
+            sample=transforms.Compose([
+                transforms.RandomCrop(28, padding=4),
+                transforms.RandomHorizontalFlip(),
+                transforms.PILToTensor(),
+            ]),
+            post=ai8x.normalize(args=args),
+        )
 
         train_dataset = torchvision.datasets.FashionMNIST(root=data_dir, train=True, download=True,
                                                           transform=train_transform)
@@ -116,10 +122,10 @@ def fashionmnist_get_datasets(data, load_train=True, load_test=True):
         train_dataset = None
 
     if load_test:
-        test_transform = transforms.Compose([
-            transforms.ToTensor(),
-            ai8x.normalize(args=args)
-        ])
+        test_transform = batch_augment.BatchPipeline(
+            sample=transforms.PILToTensor(),
+            post=ai8x.normalize(args=args),
+        )
 
         test_dataset = torchvision.datasets.FashionMNIST(root=data_dir, train=False, download=True,
                                                          transform=test_transform)
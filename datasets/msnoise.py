@@ -32,6 +32,7 @@ import urllib
 import warnings
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import torch
 from torchvision import transforms
 
@@ -39,8 +40,10 @@ import librosa
 
 import ai8x
 
+from . import audio_folding, memmap, tensor_loader
 
-class MSnoise:
+
+class MSnoise(tensor_loader.QuantizedTensorMixin):
     """
     `Microsoft Scalable Noisy Speech <https://github.com/microsoft/MS-SNSD>`
     Dataset, 1D folded.
@@ -95,8 +98,8 @@ class MSnoise:
         if download:
             self.__download()
 
-        self.data, self.targets, self.data_type = torch.load(os.path.join(
-            self.processed_folder, self.data_file))
+        self.data, self.targets, self.data_type = memmap.load(self.processed_folder,
+                                                              self.data_file)
 
         self.__filter_dtype()
         self.__filter_classes()
@@ -152,7 +155,8 @@ class MSnoise:
                     sys.exit()
 
     def __check_exists(self):
-        return os.path.exists(os.path.join(self.processed_folder, self.data_file))
+        return memmap.exists(self.processed_folder, self.data_file) or \
+            os.path.exists(os.path.join(self.processed_folder, self.data_file))
 
     def __makedir_exist_ok(self, dirpath):  # pylint: disable=no-self-use
         try:
@@ -208,24 +212,16 @@ class MSnoise:
     def quantize_audio(data, num_bits=8):
         """Quantize audio
         """
-        step_size = 2.0 / 2**(num_bits)
-        max_val = 2**(num_bits) - 1
-        q_data = np.round((data - (-1.0)) / step_size)
-        q_data = np.clip(q_data, 0, max_val)
+        return audio_folding.quantize(data, num_bits=num_bits)
 
-        return np.uint8(q_data)
+    @property
+    def quantized(self):
+        """True if the data is stored as quantized integers"""
+        return self.quantize
 
     def __len__(self):
         return len(self.data)
 
-    def __getitem__(self, index):
-        inp, target = self.data[index].type(torch.FloatTensor), int(self.targets[index])
-        if self.quantize:
-            inp /= 256
-        if self.transform is not None:
-            inp = self.transform(inp)
-        return inp, target
-
     def __gen_datasets(self, exp_len=16384, row_len=128, overlap_ratio=0,
                        noise_time_step=0.25, train_ratio=0.6):
         print('Generating dataset from raw data samples for the first time. ')
@@ -302,32 +298,23 @@ class MSnoise:
                             rec_len = np.size(record)
                             max_start_time = \
                                 ((rec_len / fs - 1) - (rec_len / fs % noise_time_step))
-                            for start_time in np.arange(0,
-                                                        int((max_start_time+noise_time_step)*fs),
-                                                        int(noise_time_step*fs)):
-                                end_time = start_time + fs
-                                audio_seq = record[start_time:end_time]
-                                data_type[data_idx, 0] = d_type
-                                data_class[data_idx, 0] = i
-                                for n_r in range(num_rows):
-                                    start_idx = n_r*(row_len - overlap)
-                                    end_idx = start_idx + row_len
-                                    audio_chunk = audio_seq[start_idx:end_idx]
-                                    audio_chunk = \
-                                        np.pad(audio_chunk, [0, row_len-audio_chunk.size])
-                                    if self.quantize:
-                                        data_in[data_idx, :, n_r] = \
-                                            self.quantize_audio(audio_chunk)
-                                    else:
-                                        data_in[data_idx, :, n_r] = audio_chunk
-                                data_idx += 1
-
-            data_in = torch.from_numpy(data_in)
-            data_class = torch.from_numpy(data_class)
-            data_type = torch.from_numpy(data_type)
-
-            noise_dataset = (data_in, data_class, data_type)
-            torch.save(noise_dataset, os.path.join(self.processed_folder, self.data_file))
+                            start_times = np.arange(0,
+                                                    int((max_start_time+noise_time_step)*fs),
+                                                    int(noise_time_step*fs))
+                            if len(start_times) == 0:
+                                continue
+                            # Cut all one-second sequences of the record, then fold them at once
+                            record = np.pad(record, [0, max(0, start_times[-1] + fs - rec_len)])
+                            audio_seqs = sliding_window_view(record, fs)[start_times]
+                            end_idx = data_idx + len(start_times)
+                            data_type[data_idx:end_idx, 0] = d_type
+                            data_class[data_idx:end_idx, 0] = i
+                            data_in[data_idx:end_idx] = audio_folding.fold_and_quantize(
+                                audio_seqs, row_len, num_rows, overlap,
+                                {'bits': 8} if self.quantize else None)
+                            data_idx = end_idx
+
+            memmap.save(self.processed_folder, self.data_file, data_in, data_class, data_type)
         print('Dataset created!')
 
 
@@ -0,0 +1,123 @@
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Batch-level loading of datasets that are held in memory as one tensor.
+
+A dataset supports this mode by implementing
+* `tensors()`: return the (unconverted) data of all samples as one tensor and the targets, and
+* `transform_batch(inputs)`: convert and normalize a batch of rows of the data tensor the
+  same way `__getitem__()` converts a single sample.
+
+`TensorLoader` replaces a DataLoader for such a dataset. It draws the indices of each epoch
+from the sampler of the DataLoader, so the validation split and the effective dataset sizes
+set up by `apputils.get_data_loaders()` are unchanged, and produces each batch with a single
+gather and conversion instead of calling `__getitem__()` and collating sample by sample.
+
+`QuantizedTensorMixin` implements both methods, and `__getitem__()`, for the audio datasets
+that store their samples in a memory-mapped `data` array.
+"""
+import math
+
+import torch
+
+
+class QuantizedTensorMixin:
+    """
+    Sample and batch access for datasets with the data of all samples in `data` (a tensor or
+    `memmap.IndexedMemmap`), the targets in `targets` and an optional `transform`. The data is
+    divided by 256 when it is quantized (see `quantized`).
+    """
+    @property
+    def quantized(self):
+        """True if the data is stored as quantized integers"""
+        return not self.save_unquantized
+
+    def __getitem__(self, index):
+        return self.transform_batch(self.data[index]), int(self.targets[index])
+
+    def tensors(self):
+        """
+        Return the data of all samples as one tensor and the targets, for loading whole
+        batches with `TensorLoader` (see `transform_batch()`).
+        """
+        data = self.data if torch.is_tensor(self.data) else torch.from_numpy(self.data.numpy())
+        return data, self.targets[:len(self.data)].reshape(-1).long()
+
+    def transform_batch(self, inp):
+        """
+        Convert a sample, or a batch of rows of the data from `tensors()`.
+        """
+        inp = inp.type(torch.FloatTensor)
+        if self.quantized:
+            inp /= 256
+        if self.transform is not None:
+            inp = self.transform(inp)
+        return inp
+
+
+class TensorLoader:
+    """
+    Replacement for the DataLoader `loader` that produces whole batches from the tensors of
+    its dataset (see the module documentation). `tensors` can pass the result of `tensors()`
+    when it is already loaded.
+    """
+    def __init__(self, loader, tensors=None):
+        self.dataset = loader.dataset
+        self.sampler = loader.sampler
+        self.batch_size = loader.batch_size
+        self.drop_last = loader.drop_last
+        self.pin_memory = loader.pin_memory
+        # For code that builds its own DataLoader over the dataset
+        self.collate_fn = loader.collate_fn
+        self.num_workers = loader.num_workers
+        self.data, self.targets = tensors if tensors is not None else self.dataset.tensors()
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.sampler) // self.batch_size
+        return math.ceil(len(self.sampler) / self.batch_size)
+
+    def __iter__(self):
+        indices = torch.as_tensor(list(self.sampler), dtype=torch.long)
+        for start in range(0, len(indices), self.batch_size):
+            batch = indices[start:start + self.batch_size]
+            if self.drop_last and len(batch) < self.batch_size:
+                break
+
+            inputs = self.dataset.transform_batch(self.data.index_select(0, batch))
+            targets = self.targets.index_select(0, batch)
+            if self.pin_memory:
+                inputs, targets = inputs.pin_memory(), targets.pin_memory()
+            yield inputs, targets
+
+
+def supports(loader):
+    """
+    Return True if the dataset of DataLoader `loader` can be loaded by `TensorLoader`.
+    """
+    return loader is not None and hasattr(loader.dataset, 'tensors') \
+        and hasattr(loader.dataset, 'transform_batch')
+
+
+def wrap(*loaders):
+    """
+    Return the DataLoaders `loaders`, replacing the ones whose dataset supports it with a
+    `TensorLoader`. The data of a dataset that is shared by several loaders (e.g., training
+    and validation) is loaded once.
+    """
+    wrapped = []
+    tensors = {}
+    for loader in loaders:
+        if not supports(loader):
+            wrapped.append(loader)
+            continue
+        tensor_loader = TensorLoader(loader, tensors.get(id(loader.dataset)))
+        tensors[id(loader.dataset)] = (tensor_loader.data, tensor_loader.targets)
+        wrapped.append(tensor_loader)
+    return wrapped
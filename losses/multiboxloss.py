@@ -48,6 +48,96 @@ class MultiBoxLoss(nn.Module):
         self.cross_entropy = nn.CrossEntropyLoss(reduction='none')
 
         self.device = device
+        self.indices = torch.arange(priors_cxcy.size(0), device=device)
+
+    def _indices(self, n):
+        """
+        Return the (cached) tensor [0, 1, ..., `n` - 1].
+        """
+        if self.indices.size(0) < n:
+            self.indices = torch.arange(n, device=self.device)
+        return self.indices[:n]
+
+    def match(self, boxes, labels):
+        """
+        Match the priors to the objects of each image.
+
+        :param boxes: true object bounding boxes in boundary coordinates, a list of N tensors
+        :param labels: true object labels, a list of N tensors
+        :return: the encoded locations of the matched objects, a tensor of dimensions
+        (N, n_priors, 4), and the label of each prior (0 for background), a tensor of dimensions
+        (N, n_priors)
+        """
+        batch_size = len(boxes)
+        n_priors = self.priors_cxcy.size(0)
+
+        # Pad the ground truth of all images to the same number of objects
+        n_objects = torch.tensor([b.size(0) for b in boxes], device=self.device)  # (N)
+        max_objects = int(n_objects.max().item()) if batch_size > 0 else 0
+        if max_objects == 0:
+            true_locs = torch.zeros((batch_size, n_priors, 4), dtype=torch.float).to(self.device)
+            true_classes = torch.zeros((batch_size, n_priors), dtype=torch.long).to(self.device)
+        else:
+            object_indices = self._indices(max_objects)
+            valid_objects = object_indices.unsqueeze(0) < n_objects.unsqueeze(1)  # (N, N_o)
+            # Boolean mask assignment fills the valid objects in row-major order
+            padded_boxes = torch.zeros((batch_size, max_objects, 4),
+                                       dtype=torch.float).to(self.device)
+            padded_boxes[valid_objects] = torch.cat([b.view(-1, 4) for b in boxes]).float()
+            padded_labels = torch.zeros((batch_size, max_objects),
+                                        dtype=torch.long).to(self.device)
+            padded_labels[valid_objects] = torch.cat([lbl.view(-1) for lbl in labels]).long()
+
+            overlap = obj_det_utils.find_jaccard_overlap(padded_boxes.view(-1, 4), self.priors_xy)
+            overlap = overlap.view(batch_size, max_objects, n_priors)  # (N, N_o, n_priors)
+            # Padding objects never overlap
+            overlap.masked_fill_(~valid_objects.unsqueeze(2), -1.)
+
+            # For each prior, find the object that has the maximum overlap
+            overlap_for_each_prior, object_for_each_prior = overlap.max(dim=1)  # (N, n_priors)
+
+            # We don't want a situation where an object is not represented in our positive
+            # (non-background) priors -
+            # 1. An object might not be the best object for all priors, and is therefore not in
+            #    object_for_each_prior.
+            # 2. All priors with the object may be assigned as background based on the
+            #    threshold (0.5).
+
+            # To remedy this -
+            # First, find the prior that has the maximum overlap for each object.
+            _, prior_for_each_object = overlap.max(dim=2)  # (N, N_o)
+
+            # Then, assign each object to the corresponding maximum-overlap-prior. When several
+            # objects share the same prior, the last one is assigned. (This fixes 1.)
+            is_best_prior = (prior_for_each_object.unsqueeze(2) == self._indices(n_priors)) \
+                & valid_objects.unsqueeze(2)  # (N, N_o, n_priors)
+            forced_object = (is_best_prior.long() * (object_indices + 1).view(1, -1, 1)) \
+                .max(dim=1)[0]  # (N, n_priors), object + 1, or 0 if not forced
+            forced_priors = forced_object > 0
+            object_for_each_prior = torch.where(forced_priors, forced_object - 1,
+                                                object_for_each_prior)
+
+            # To ensure these priors qualify, artificially give them an overlap of greater
+            # than 0.5. (This fixes 2.)
+            overlap_for_each_prior.masked_fill_(forced_priors, 1.)
+
+            # Labels for each prior
+            true_classes = padded_labels.gather(1, object_for_each_prior)  # (N, n_priors)
+            # Set priors whose overlaps with objects are less than the threshold to be
+            # background (no object). This includes all priors of images without objects.
+            true_classes[overlap_for_each_prior < self.threshold] = 0
+
+            # Encode center-size object coordinates into the form we regressed predicted boxes to
+            padded_cxcy = obj_det_utils.xy_to_cxcy(padded_boxes.view(-1, 4)) \
+                .view(batch_size, max_objects, 4)
+            true_locs = obj_det_utils.cxcy_to_gcxgcy(
+                padded_cxcy.gather(1, object_for_each_prior.unsqueeze(2).expand(-1, -1, 4))
+                .view(-1, 4), self.priors_cxcy.repeat(batch_size, 1)) \
+                .view(batch_size, n_priors, 4)  # (N, n_priors, 4)
+            # Images without objects have no target locations
+            true_locs.masked_fill_((n_objects == 0).view(-1, 1, 1), 0.)
+
+        return true_locs, true_classes
 
     def forward(self, output, target):
         """
@@ -77,51 +167,7 @@ class MultiBoxLoss(nn.Module):
 
         assert n_priors == predicted_locs.size(1) == predicted_scores.size(1)
 
-        true_locs = torch.zeros((batch_size, n_priors, 4), dtype=torch.float).to(self.device)
-        true_classes = torch.zeros((batch_size, n_priors), dtype=torch.long).to(self.device)
-
-        for i in range(batch_size):
-            n_objects = boxes[i].size(0)
-
-            if n_objects > 0:
-                overlap = obj_det_utils.find_jaccard_overlap(boxes[i], self.priors_xy)
-
-                # For each prior, find the object that has the maximum overlap
-                overlap_for_each_prior, object_for_each_prior = overlap.max(dim=0)
-
-                # We don't want a situation where an object is not represented in our positive
-                # (non-background) priors -
-                # 1. An object might not be the best object for all priors, and is therefore not in
-                #    object_for_each_prior.
-                # 2. All priors with the object may be assigned as background based on the
-                #    threshold (0.5).
-
-                # To remedy this -
-                # First, find the prior that has the maximum overlap for each object.
-                _, prior_for_each_object = overlap.max(dim=1)  # (N_o)
-
-                # Then, assign each object to the corresponding maximum-overlap-prior.
-                # (This fixes 1.)
-                object_for_each_prior[prior_for_each_object] = \
-                    torch.LongTensor(range(n_objects)).to(self.device)
-
-                # To ensure these priors qualify, artificially give them an overlap of greater
-                # than 0.5. (This fixes 2.)
-                overlap_for_each_prior[prior_for_each_object] = 1.
-
-                # Labels for each prior
-                label_for_each_prior = labels[i][object_for_each_prior]
-                # Set priors whose overlaps with objects are less than the threshold to be
-                # background (no object)
-                label_for_each_prior[overlap_for_each_prior < self.threshold] = 0
-
-                # Store
-                true_classes[i] = label_for_each_prior
-
-                # Encode center-size object coordinates into the form we regressed predicted boxes
-                true_locs[i] = obj_det_utils.cxcy_to_gcxgcy(
-                                   obj_det_utils.xy_to_cxcy(boxes[i][object_for_each_prior]),
-                                   self.priors_cxcy)
+        true_locs, true_classes = self.match(boxes, labels)  # (N, n_priors, 4), (N, n_priors)
 
         # Identify priors that are positive (object/non-background)
         positive_priors = true_classes != 0
@@ -166,8 +212,7 @@ class MultiBoxLoss(nn.Module):
         # (never in top n_hard_negatives)
         conf_loss_neg, _ = conf_loss_neg.sort(dim=1, descending=True)  # (N, number_of_priors),
         # sorted by decreasing hardness
-        hardness_ranks = \
-            torch.LongTensor(range(n_priors)).unsqueeze(0).expand_as(conf_loss_neg).to(self.device)
+        hardness_ranks = self._indices(n_priors).unsqueeze(0).expand_as(conf_loss_neg)
         # (N, number_of_priors)
         hard_negatives = hardness_ranks < n_hard_negatives.unsqueeze(1)
         # (N, number_of_priors)
@@ -0,0 +1,183 @@
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Meters for the training and validation loops that accumulate on the device.
+
+The meters have the interface and results of the `torchnet.meter` classes of the same name,
+but `add()` keeps running sums as tensors on the device of its inputs instead of converting
+every batch to Python or NumPy values, which waits for the device. The values are only
+transferred to the host when they are read (e.g., `mean`, `value()`), so reading them at
+`--print-freq` boundaries and at the end of an epoch is the only synchronization.
+"""
+import copy
+import math
+
+import numpy as np
+import torch
+
+
+def _detach(value):
+    """Detaches `value` from the graph if it is a tensor"""
+    return value.detach() if torch.is_tensor(value) else value
+
+
+class Meter:
+    """
+    Base class of the meters
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Clears the meter"""
+        raise NotImplementedError
+
+    def snapshot(self):
+        """Returns a copy of the meter in its current state that can be read later"""
+        snap = copy.copy(self)
+        for name, value in vars(self).items():
+            if torch.is_tensor(value):
+                setattr(snap, name, value.clone())
+        return snap
+
+
+class AverageValueMeter(Meter):
+    """
+    Running mean and standard deviation of values such as the loss of each batch
+    """
+    def reset(self):
+        self.sum = 0.
+        self.var = 0.
+        self.n = 0
+
+    def add(self, value, n=1):
+        """Adds `value` (a number or a single-element tensor)"""
+        value = _detach(value)
+        self.sum = self.sum + value
+        self.var = self.var + value * value
+        self.n += n
+
+    @property
+    def mean(self):
+        """Mean of the values"""
+        if self.n == 0:
+            return math.nan
+        return float(self.sum) / self.n
+
+    def value(self):
+        """Returns the mean and the standard deviation of the values"""
+        if self.n == 0:
+            return math.nan, math.nan
+        if self.n == 1:
+            return float(self.sum), math.inf
+        mean = float(self.sum) / self.n
+        return mean, math.sqrt(max((float(self.var) - self.n * mean * mean) / (self.n - 1), 0.))
+
+
+class ClassErrorMeter(Meter):
+    """
+    Top-k accuracy (or error, if not `accuracy`) in percent of classification outputs
+    """
+    def __init__(self, topk=(1, ), accuracy=False):
+        self.topk = sorted(topk)
+        self.accuracy = accuracy
+        super().__init__()
+
+    def reset(self):
+        self.correct = 0
+        self.n = 0
+
+    def add(self, output, target):
+        """Adds the scores `output` (N x classes) for the class indices `target` (N)"""
+        output = _detach(output).squeeze()
+        if output.dim() == 1:
+            output = output.unsqueeze(0)
+        target = _detach(target).reshape(-1)
+
+        pred = output.topk(self.topk[-1], 1, True, True)[1]
+        correct = pred == target.unsqueeze(1)
+        self.correct = self.correct + torch.stack([correct[:, :k].sum() for k in self.topk])
+        self.n += output.shape[0]
+
+    def value(self, k=-1):
+        """Returns the top-`k` accuracy or error, or a list for all `topk` if `k` is -1"""
+        correct = self.correct.tolist() if torch.is_tensor(self.correct) \
+            else [0] * len(self.topk)
+        values = []
+        for num_correct in correct:
+            error = float(self.n - num_correct) / self.n
+            values.append((1. - error) * 100. if self.accuracy else error * 100.)
+        if k == -1:
+            return values
+        return values[self.topk.index(k)]
+
+
+class MSEMeter(Meter):
+    """
+    Mean squared error (or its root if `root`) of regression outputs
+    """
+    def __init__(self, root=False):
+        self.root = root
+        super().__init__()
+
+    def reset(self):
+        self.sesum = 0.
+        self.n = 0
+
+    def add(self, output, target):
+        """Adds the outputs `output` for the targets `target`"""
+        output = _detach(output)
+        self.sesum = self.sesum + torch.sum((output - _detach(target)) ** 2)
+        self.n += output.numel()
+
+    def value(self):
+        """Returns the mean squared error"""
+        mse = float(self.sesum) / max(1, self.n)
+        return math.sqrt(mse) if self.root else mse
+
+
+class ConfusionMeter(Meter):
+    """
+    Confusion matrix of classification outputs for `k` classes, with the true classes as rows
+    and the predicted classes as columns (normalized per row if `normalized`)
+    """
+    def __init__(self, k, normalized=False):
+        self.k = k
+        self.normalized = normalized
+        super().__init__()
+
+    def reset(self):
+        self.conf = None
+
+    def add(self, predicted, target):
+        """
+        Adds the scores (N x `k`) or class indices (N) `predicted` for the class indices (N)
+        or one-hot targets (N x `k`) `target`
+        """
+        predicted = _detach(predicted)
+        target = _detach(target)
+        if predicted.dim() != 1:
+            predicted = predicted.argmax(1)
+        if target.dim() != 1:
+            target = target.argmax(1)
+
+        conf = torch.bincount(target.long() * self.k + predicted.long(),
+                              minlength=self.k ** 2).reshape(self.k, self.k)
+        self.conf = conf if self.conf is None else self.conf + conf
+
+    def value(self):
+        """Returns the confusion matrix as a NumPy array"""
+        if self.conf is None:
+            conf = np.zeros((self.k, self.k), dtype=np.int32)
+        else:
+            conf = self.conf.cpu().numpy().astype(np.int32)
+        if self.normalized:
+            conf = conf.astype(np.float32)
+            return conf / conf.sum(1).clip(min=1e-12)[:, None]
+        return conf
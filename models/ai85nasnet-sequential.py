@@ -151,6 +151,9 @@ class OnceForAllSequentialModel(nn.Module):
         self.kernel_list = kernel_list
         self.bn = bn
         self.unit = unit
+        # Channel importance is re-evaluated every `sort_interval` width samples
+        self.sort_interval = 1
+        self.num_width_samples = 0
 
         self.units = nn.ModuleList([])
 
@@ -260,7 +263,11 @@ class OnceForAllSequentialModel(nn.Module):
                         layer.set_channels(out_channels=random_width)
                         last_out_ch = layer.out_channels
 
-        self.sort_channels()
+        if self.num_width_samples % self.sort_interval == 0:
+            self.sort_channels()
+        else:
+            self.link_channel_orders()
+        self.num_width_samples += 1
 
     def reset_width_sampling(self):
         """Resets widths to maximum widths"""
@@ -269,30 +276,37 @@ class OnceForAllSequentialModel(nn.Module):
                 for layer in unit.layers:
                     layer.set_channels(in_channels=layer.op.in_channels,
                                        out_channels=layer.op.out_channels)
-        self.sort_channels()
 
     def sort_channels(self):
-        """Sorts channels wrt output channel kernels importance"""
+        """
+        Sorts channels wrt output channel kernels importance. Only the channel orders of the
+        layers change, the weights stay in place (see `OnceForAllModule.forward()`).
+        """
         with torch.no_grad():
-            max_unit_ind = len(self.units) - 1
-            for u_ind, unit in enumerate(self.units):
-                max_layer_ind = unit.depth - 1
-                for l_ind in range(unit.depth):
-                    layer = unit.layers[l_ind]
-                    if (u_ind == max_unit_ind) and (l_ind == max_layer_ind):
-                        layer.reset_out_ch_order()
-                    else:
-                        reduce_dim = (1, 2, 3) if layer.op.weight.dim() == 4 else (1, 2)
-                        importance = torch.sum(torch.abs(layer.op.weight.data), dim=reduce_dim)
-                        _, inds = torch.sort(importance, descending=True)
-                        layer.set_out_ch_order(inds, reset_order=False)
+            for unit in self.units:
+                for layer in unit.layers:
+                    reduce_dim = (1, 2, 3) if layer.op.weight.dim() == 4 else (1, 2)
+                    importance = torch.sum(torch.abs(layer.op.weight), dim=reduce_dim)
+                    _, inds = torch.sort(importance, descending=True)
+                    layer.set_out_ch_order(inds)
 
-                        if l_ind < max_layer_ind:
-                            next_layer = unit.layers[l_ind+1]
-                        else:
-                            next_layer = self.units[u_ind+1].layers[0]
+        self.link_channel_orders()
+
+    def link_channel_orders(self):
+        """Sets the input channel order of each layer to the output order of the layer before"""
+        max_unit_ind = len(self.units) - 1
+        for u_ind, unit in enumerate(self.units):
+            max_layer_ind = unit.depth - 1
+            for l_ind in range(unit.depth):
+                # The output of the last layer always has full width
+                if (u_ind == max_unit_ind) and (l_ind == max_layer_ind):
+                    break
+                if l_ind < max_layer_ind:
+                    next_layer = unit.layers[l_ind+1]
+                else:
+                    next_layer = self.units[u_ind+1].layers[0]
 
-                        next_layer.set_in_ch_order(layer.out_ch_order, reset_order=True)
+                next_layer.set_in_ch_order(unit.layers[l_ind].out_ch_order)
 
     def get_base_arch(self):
         """Returns architecture of the full model"""
@@ -357,6 +371,8 @@ class OnceForAllSequentialModel(nn.Module):
 
         if sort_channels:
             self.sort_channels()
+        else:
+            self.link_channel_orders()
 
     def reset_arch(self, sort_channels=False):
         """Resets architecture to the full model"""
@@ -365,21 +381,36 @@ class OnceForAllSequentialModel(nn.Module):
             for layer in unit.layers:
                 layer.out_channels = layer.op.weight.shape[0]
                 layer.in_channels = layer.op.weight.shape[1]
-                layer.kernel_size = layer.max_kernel_size.detach().cpu().item()
+                layer.kernel_size = layer.max_kernel
 
         if sort_channels:
             self.sort_channels()
 
+    @staticmethod
+    def get_layer_num_weights(model_arch, in_width, width, kernel_size):
+        """Returns number of weights of a layer of the given arch"""
+        num_layer_params = in_width * width * kernel_size
+        if model_arch['unit'] == OnceForAll2DSequentialUnit:
+            num_layer_params *= kernel_size
+
+        return num_layer_params
+
+    @staticmethod
+    def get_linear_num_weights(model_arch):
+        """Returns number of weights of the classifier of the given arch"""
+        dim1 = model_arch['dimensions'][0]
+        dim2 = model_arch['dimensions'][1] if len(model_arch['dimensions']) == 2 else 1
+        for _ in range(1, model_arch['n_units']):
+            dim1 = dim1 // 2
+            dim2 = (dim2 // 2) if len(model_arch['dimensions']) == 2 else 1
+
+        return dim1*dim2*model_arch['width_list'][-1][-1]*model_arch['num_classes']
+
     @staticmethod
     def get_num_weights(model_arch):
         """Returns number of weights in the given arch"""
         num_params = 0
-        dim1 = model_arch['dimensions'][0]
-        dim2 = model_arch['dimensions'][1] if len(model_arch['dimensions']) == 2 else 1
         for u_ind, depth in enumerate(model_arch['depth_list']):
-            if u_ind != 0:
-                dim1 = dim1 // 2
-                dim2 = (dim2 // 2) if len(model_arch['dimensions']) == 2 else 1
             for l_ind in range(depth):
                 if l_ind != 0:
                     prev_layer_width = model_arch['width_list'][u_ind][l_ind-1]
@@ -389,17 +420,28 @@ class OnceForAllSequentialModel(nn.Module):
                     else:
                         prev_layer_width = model_arch['width_list'][u_ind-1][-1]
 
-                num_layer_params = prev_layer_width * model_arch['width_list'][u_ind][l_ind] * \
-                    model_arch['kernel_list'][u_ind][l_ind]
-                if model_arch['unit'] == OnceForAll2DSequentialUnit:
-                    num_layer_params *= model_arch['kernel_list'][u_ind][l_ind]
-
-                num_params += num_layer_params
+                num_params += OnceForAllSequentialModel.get_layer_num_weights(
+                    model_arch, prev_layer_width, model_arch['width_list'][u_ind][l_ind],
+                    model_arch['kernel_list'][u_ind][l_ind])
 
-        num_linear_params = dim1*dim2*model_arch['width_list'][-1][-1]*model_arch['num_classes']
+        num_linear_params = OnceForAllSequentialModel.get_linear_num_weights(model_arch)
 
         return num_params+num_linear_params
 
+    @staticmethod
+    def get_kernel_options(max_kernel):
+        """Returns the kernel sizes a layer with kernel size `max_kernel` can be sampled with"""
+        return list(range(1, max_kernel+1, 2))
+
+    @staticmethod
+    def get_width_options(max_width):
+        """Returns the widths a layer of width `max_width` can be sampled with"""
+        width_opts = []
+        for lev in range(4):
+            width_opts.append(int((1.0 - lev*0.25) * max_width))
+
+        return width_opts
+
     @staticmethod
     def mutate(model_arch, base_arch, prob_mutation, mutate_kernel=True, mutate_depth=True,
                mutate_width=True):
@@ -424,14 +466,14 @@ class OnceForAllSequentialModel(nn.Module):
                     else:
                         for i in range(new_depth - depth):
                             max_kernel = base_arch['kernel_list'][unit_idx][depth + i]
-                            kernel_opts = list(range(1, max_kernel+1, 2))
+                            kernel_opts = OnceForAllSequentialModel.get_kernel_options(
+                                max_kernel)
                             kernel_list[unit_idx].append(random.choice(kernel_opts))
 
                             max_width = base_arch['width_list'][unit_idx][depth + i]
                             if mutate_width:
-                                width_opts = []
-                                for lev in range(4):
-                                    width_opts.append(int((1.0 - lev*0.25) * max_width))
+                                width_opts = OnceForAllSequentialModel.get_width_options(
+                                    max_width)
                                 width_list[unit_idx].append(random.choice(width_opts))
                             else:
                                 width_list[unit_idx].append(max_width)
@@ -443,14 +485,12 @@ class OnceForAllSequentialModel(nn.Module):
                 if random.random() < prob_mutation:
                     if mutate_kernel:
                         max_kernel = base_arch['kernel_list'][unit_idx][layer_idx]
-                        kernel_opts = list(range(1, max_kernel+1, 2))
+                        kernel_opts = OnceForAllSequentialModel.get_kernel_options(max_kernel)
                         kernel_list[unit_idx][layer_idx] = random.choice(kernel_opts)
 
                     if mutate_width:
                         max_width = base_arch['width_list'][unit_idx][layer_idx]
-                        width_opts = []
-                        for lev in range(4):
-                            width_opts.append(int((1.0 - lev*0.25) * max_width))
+                        width_opts = OnceForAllSequentialModel.get_width_options(max_width)
                         width_list[unit_idx][layer_idx] = random.choice(width_opts)
 
         width_list[-1][-1] = base_arch['width_list'][-1][-1]
@@ -335,7 +335,8 @@ class TinierSSD(nn.Module):
         Decipher the locations and class scores to detect objects.
 
         For each class, perform Non-Maximum Suppression (NMS) on boxes that are above a minimum
-        threshold.
+        threshold. All images and classes are processed at once (see
+        `obj_detect_utils.batched_nms()`).
 
         :param predicted_locs: predicted locations/boxes w.r.t the prior boxes, a tensor of
         dimensions
@@ -359,77 +360,37 @@ class TinierSSD(nn.Module):
 
         assert n_priors == predicted_locs.size(1) == predicted_scores.size(1)
 
-        for i in range(batch_size):
-            # Decode object coordinates from the form we regressed predicted boxes to
-            decoded_locs = obj_detect_utils.cxcy_to_xy(
-                obj_detect_utils.gcxgcy_to_cxcy(predicted_locs[i], self.priors_cxcy))
-
-            # Lists to store boxes and scores for this image
-            image_boxes = []
-            image_labels = []
-            image_scores = []
-
-            # Check for each class
-            for c in range(1, self.n_classes):
-                # Keep only predicted boxes and scores where scores for this class are above the
-                # minimum score
-                class_scores = predicted_scores[i][:, c]
-                score_above_min_score = class_scores > min_score
-                n_above_min_score = score_above_min_score.sum().item()
-                if n_above_min_score == 0:
-                    continue
-                class_scores = class_scores[score_above_min_score]
-                class_decoded_locs = decoded_locs[score_above_min_score]  # (n_qualified, 4)
-
-                # Sort predicted boxes and scores by scores
-                class_scores, sort_ind = class_scores.sort(dim=0, descending=True)
-                # (n_qualified), (n_min_score)
-                class_decoded_locs = class_decoded_locs[sort_ind]  # (n_min_score, 4)
-
-                # Find the overlap between predicted boxes
-                overlap = obj_detect_utils.find_jaccard_overlap(class_decoded_locs,
-                                                                class_decoded_locs)
-                # (n_qualified, n_min_score)
-
-                # Non-Maximum Suppression (NMS)
-
-                # A torch.uint8 (byte) tensor to keep track of which predicted boxes to suppress
-                # 1 implies suppress, 0 implies don't suppress
-                suppress = torch.zeros((n_above_min_score), dtype=torch.uint8).to(self.device)
-                # (n_qualified)
-
-                # Consider each box in order of decreasing scores
-                for box in range(class_decoded_locs.size(0)):
-                    # If this box is already marked for suppression
-                    if suppress[box] == 1:
-                        continue
-
-                    # Suppress boxes whose overlaps (with this box) are greater than maximum
-                    # overlap
-                    # Find such boxes and update suppress indices
-                    suppress = torch.max(suppress, overlap[box] > max_overlap)
-                    # The max operation retains previously suppressed boxes, like an 'OR' operation
-
-                    # Don't suppress this box, even though it has an overlap of 1 with itself
-                    suppress[box] = 0
-
-                # Store only unsuppressed boxes for this class
-                image_boxes.append(class_decoded_locs[1 - suppress])
-                image_labels.append(
-                    torch.LongTensor((1 - suppress).sum().item() * [c]).to(self.device))
-                image_scores.append(class_scores[1 - suppress])
+        # Decode object coordinates from the form we regressed predicted boxes to, for all images
+        decoded_locs = obj_detect_utils.cxcy_to_xy(
+            obj_detect_utils.gcxgcy_to_cxcy(predicted_locs.reshape(-1, 4),
+                                            self.priors_cxcy.repeat(batch_size, 1)))
+        decoded_locs = decoded_locs.view(batch_size, n_priors, 4)
+
+        # Keep only predicted boxes and scores where scores for a (non-background) class are
+        # above the minimum score
+        image_idx, prior_idx, class_idx = \
+            (predicted_scores[:, :, 1:] > min_score).nonzero(as_tuple=True)
+        class_idx = class_idx + 1
+        class_scores = predicted_scores[image_idx, prior_idx, class_idx]  # (n_qualified)
+        class_decoded_locs = decoded_locs[image_idx, prior_idx]  # (n_qualified, 4)
+
+        # Non-Maximum Suppression (NMS) for each class of each image. The result is sorted by
+        # image, class, and decreasing score.
+        keep = obj_detect_utils.batched_nms(class_decoded_locs, class_scores,
+                                            image_idx * self.n_classes + class_idx, max_overlap)
+        n_objects_per_image = torch.bincount(image_idx[keep], minlength=batch_size).tolist()
+
+        for image_boxes, image_labels, image_scores in zip(
+                class_decoded_locs[keep].split(n_objects_per_image),
+                class_idx[keep].split(n_objects_per_image),
+                class_scores[keep].split(n_objects_per_image)):
+            n_objects = image_scores.size(0)
 
             # If no object in any class is found, store a placeholder for 'background'
-            if len(image_boxes) == 0:
-                image_boxes.append(torch.FloatTensor([[0., 0., 1., 1.]]).to(self.device))
-                image_labels.append(torch.LongTensor([0]).to(self.device))
-                image_scores.append(torch.FloatTensor([0.]).to(self.device))
-
-            # Concatenate into single tensors
-            image_boxes = torch.cat(image_boxes, dim=0)  # (n_objects, 4)
-            image_labels = torch.cat(image_labels, dim=0)  # (n_objects)
-            image_scores = torch.cat(image_scores, dim=0)  # (n_objects)
-            n_objects = image_scores.size(0)
+            if n_objects == 0:
+                image_boxes = torch.FloatTensor([[0., 0., 1., 1.]]).to(self.device)
+                image_labels = torch.LongTensor([0]).to(self.device)
+                image_scores = torch.FloatTensor([0.]).to(self.device)
 
             # Keep only the top k objects
             if n_objects > top_k:
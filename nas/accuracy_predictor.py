@@ -0,0 +1,80 @@
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Accuracy predictor used to pre-screen NAS candidates
+"""
+
+import numpy as np
+
+from nas import nas_utils
+
+
+class AccuracyPredictor:
+    """
+    Ridge regression that predicts the accuracy of a sub network from a fixed-length encoding
+    of its depths, widths and kernel sizes relative to the base architecture `base_arch` (see
+    `encode()`). It is trained online on the sub networks evaluated so far.
+    """
+    def __init__(self, base_arch, alpha=1e-2):
+        self.base_arch = base_arch
+        self.alpha = alpha
+        self.samples = {}
+        self.weights = None
+        self.bias = 0.
+
+    def encode(self, arch):
+        """
+        Returns the feature vector of `arch`: for every unit its relative depth, and for every
+        layer of the base architecture whether it is used, its relative width and its relative
+        kernel size
+        """
+        features = []
+        for u_ind, max_depth in enumerate(self.base_arch['depth_list']):
+            depth = arch['depth_list'][u_ind]
+            features.append(depth / max_depth)
+            for l_ind in range(max_depth):
+                if l_ind < depth:
+                    features += [1.,
+                                 arch['width_list'][u_ind][l_ind]
+                                 / self.base_arch['width_list'][u_ind][l_ind],
+                                 arch['kernel_list'][u_ind][l_ind]
+                                 / self.base_arch['kernel_list'][u_ind][l_ind]]
+                else:
+                    features += [0., 0., 0.]
+
+        return np.array(features, dtype=np.float64)
+
+    def add(self, arch, accuracy):
+        """Adds the evaluated sub network `arch` to the training data"""
+        self.samples[nas_utils.get_arch_key(arch)] = (self.encode(arch), accuracy)
+
+    @property
+    def is_trained(self):
+        """True if the predictor has been fitted"""
+        return self.weights is not None
+
+    def fit(self):
+        """Fits the predictor to all sub networks added so far"""
+        if len(self.samples) < 2:
+            return
+
+        x = np.stack([features for features, _ in self.samples.values()])
+        y = np.array([accuracy for _, accuracy in self.samples.values()], dtype=np.float64)
+        x_mean = x.mean(axis=0)
+        y_mean = y.mean()
+        x = x - x_mean
+
+        self.weights = np.linalg.solve(x.T @ x + self.alpha * len(y) * np.eye(x.shape[1]),
+                                       x.T @ (y - y_mean))
+        self.bias = y_mean - x_mean @ self.weights
+
+    def predict(self, archs):
+        """Returns the predicted accuracies of the sub networks `archs`"""
+        x = np.stack([self.encode(arch) for arch in archs])
+        return x @ self.weights + self.bias
@@ -10,19 +10,32 @@
 Evolutionary search for NAS
 """
 
+import copy
+import math
+import multiprocessing
+import random
 import time
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
+import ai8x
+import ai8x_cost
 from nas import nas_utils
+from nas.accuracy_predictor import AccuracyPredictor
+from nas.subnet_sampler import SubnetSampler
 
 
 class EvolutionSearch:
     """
     Evolutionary search for NAS
     """
+    HW_CONSTRAINTS = ['max_layers', 'max_kernel_memory', 'max_bias_memory', 'max_data_memory',
+                      'max_macs', 'max_cycles', 'max_latency', 'fit_device']
+
     def __init__(self, population_size=100, prob_mutation=0.1, ratio_mutation=0.5,
-                 ratio_parent=0.25, num_iter=500):
+                 ratio_parent=0.25, num_iter=500, num_workers=0, seed=None,
+                 num_calib_batches=0, oversampling=1, retrain_interval=1):
         self.population_size = population_size
         self.prob_mutation = prob_mutation
         self.ratio_mutation = ratio_mutation
@@ -30,6 +43,18 @@ class EvolutionSearch:
         self.num_iter = num_iter
         self.model = None
         self.arch = None
+        self.num_workers = num_workers
+        self.seed = seed
+        self.num_calib_batches = num_calib_batches
+        self.calibration_batches = None
+        self.oversampling = oversampling
+        self.retrain_interval = max(int(retrain_interval), 1)
+        self.predictor = None
+        self.sampler = None
+        self.cache = None
+        self.num_evaluated = 0
+        self.pool = None
+        self.state_dict = None
 
     def set_model(self, model):
         """Sets the trained base model"""
@@ -40,11 +65,24 @@ class EvolutionSearch:
         """Sets the base model architecture"""
         self.arch = arch
 
+    def get_sampler(self, constraint):
+        """
+        Returns the sampler that creates sub networks within the number of weights and width
+        constraints (see `nas.subnet_sampler.SubnetSampler`)
+        """
+        if self.sampler is None or self.sampler.constraint != constraint \
+           or self.sampler.base_arch != self.arch:
+            self.sampler = SubnetSampler(self.model.__class__, self.arch, constraint)
+        return self.sampler
+
     def get_random_valid_sample(self, constraint):
-        """Randomly selects a valid sub network wrt the given constraint"""
+        """
+        Randomly selects a valid sub network wrt the given constraint. Only the hardware
+        constraints, if any, can reject samples.
+        """
         is_sample_ok = False
         while not is_sample_ok:
-            sample = self.model.__class__.mutate(self.arch, self.arch, prob_mutation=1.0)
+            sample = self.get_sampler(constraint).sample()
             is_sample_ok = self.check_constraint(sample, constraint)
 
         return sample
@@ -53,9 +91,7 @@ class EvolutionSearch:
         """Mutates the sub network"""
         is_sample_ok = False
         while not is_sample_ok:
-            new_sample = self.model.__class__.mutate(sample, self.arch, self.prob_mutation,
-                                                     mutate_kernel=True, mutate_depth=True,
-                                                     mutate_width=True)
+            new_sample = self.get_sampler(constraint).mutate(sample, self.prob_mutation)
             is_sample_ok = self.check_constraint(new_sample, constraint)
 
         return new_sample
@@ -64,7 +100,7 @@ class EvolutionSearch:
         """Crossovers two sub networks"""
         is_sample_ok = False
         while not is_sample_ok:
-            new_sample = self.model.__class__.crossover(sample1, sample2)
+            new_sample = self.get_sampler(constraint).crossover(sample1, sample2)
             is_sample_ok = self.check_constraint(new_sample, constraint)
 
         return new_sample
@@ -85,29 +121,157 @@ class EvolutionSearch:
                 if width not in constraint['width_options']:
                     return False
 
+        if any(key in constraint for key in self.HW_CONSTRAINTS):
+            if not ai8x_cost.check_constraint(nas_utils.calc_hw_cost(sample), constraint):
+                return False
+
         return True
 
-    def run(self, constraint, train_loader, test_loader, device):
+    def mutate_parent(self, parents, constraint):
+        """Mutates a randomly selected parent"""
+        sample = parents[np.random.randint(len(parents))][0]
+        return self.mutate_valid_sample(sample, constraint)
+
+    def crossover_parents(self, parents, constraint):
+        """Crossovers two randomly selected parents"""
+        sample1 = parents[np.random.randint(len(parents))][0]
+        sample2 = parents[np.random.randint(len(parents))][0]
+        return self.crossover_valid_sample(sample1, sample2, constraint)
+
+    def generate_samples(self, num_samples, population_keys, create_sample, *args):
+        """
+        Returns `num_samples` new sub networks created by `create_sample(*args)` that are not in
+        the population, and adds their keys to `population_keys`
+        """
+        samples = []
+        while len(samples) < num_samples:
+            child_net = create_sample(*args)
+            child_net_key = nas_utils.get_arch_key(child_net)
+            if child_net_key not in population_keys:
+                population_keys.add(child_net_key)
+                samples.append(child_net)
+
+        return samples
+
+    def select_samples(self, num_samples, population_keys, create_sample, *args):
+        """
+        Returns `num_samples` new sub networks (see `generate_samples()`). Once the accuracy
+        predictor is trained, `oversampling` times as many candidates are generated, and the
+        ones with the highest predicted (or cached) accuracy are selected for evaluation.
+        """
+        if self.predictor is None or not self.predictor.is_trained:
+            return self.generate_samples(num_samples, population_keys, create_sample, *args)
+
+        candidates = self.generate_samples(int(math.ceil(num_samples * self.oversampling)),
+                                           population_keys, create_sample, *args)
+        predicted = self.predictor.predict(candidates)
+        for i, candidate in enumerate(candidates):
+            cached = self.cache.get(candidate)
+            if cached is not None:
+                predicted[i] = cached[0]
+
+        order = np.argsort(-predicted, kind='stable')
+        return [candidates[i] for i in order[:num_samples]]
+
+    def evaluate(self, child_nets, train_loader, test_loader, device):
+        """
+        Returns the accuracy and efficiency of the sub networks. Sub networks that are not in
+        the cache are evaluated once, by the worker processes, if any.
+        """
+        results = [self.cache.get(child_net) for child_net in child_nets]
+        todo = {}
+        for i, result in enumerate(results):
+            if result is None:
+                todo.setdefault(nas_utils.get_arch_key(child_nets[i]), i)
+        todo = list(todo.values())
+
+        if self.pool is not None:
+            evaluated = self.pool.map(nas_utils.evaluate_in_worker,
+                                      [child_nets[i] for i in todo])
+        else:
+            evaluated = (nas_utils.evaluate_subnet(child_nets[i], self.model, train_loader,
+                                                   test_loader, device, self.seed or 0,
+                                                   self.state_dict, self.calibration_batches)
+                         for i in todo)
+
+        for i, (child_net_acc, child_net_eff) in zip(todo, evaluated):
+            self.cache.put(child_nets[i], child_net_acc, child_net_eff)
+        results = [result if result is not None else self.cache.get(child_net)
+                   for child_net, result in zip(child_nets, results)]
+        self.num_evaluated += len(todo)
+
+        if self.predictor is not None:
+            for child_net, (child_net_acc, _) in zip(child_nets, results):
+                self.predictor.add(child_net, child_net_acc)
+
+        return [(child_net, ) + result for child_net, result in zip(child_nets, results)]
+
+    def run(self, constraint, train_loader, test_loader, device, cache=None):
+        """
+        Executes the search algorithm. Accuracies and efficiencies are looked up in and added
+        to `cache` (a `nas_utils.SubnetCache`), which is saved after every iteration. With
+        `oversampling` > 1, an accuracy predictor that is retrained every `retrain_interval`
+        iterations pre-screens the candidates (see `select_samples()`). If
+        `num_calib_batches` is set, the batchnorm statistics of each sub network are
+        re-estimated on that many batches drawn once from the training set (or the test set
+        if there is no training set) instead of on the full training set.
+        """
+        if self.seed is not None:
+            random.seed(self.seed)
+            np.random.seed(self.seed)
+
+        self.cache = cache if cache is not None else nas_utils.SubnetCache()
+        self.num_evaluated = 0
+        self.predictor = AccuracyPredictor(self.arch) if self.oversampling > 1 else None
+        sampler = self.get_sampler(constraint)
+        print(f'{sampler.num_feasible:.0f} of {sampler.num_total} sub networks meet the number '
+              'of weights and width constraints.')
+        if self.cache.num_loaded:
+            print(f'Loaded {self.cache.num_loaded} evaluated architectures from the cache.')
+
+        # Every evaluation starts from the same model state
+        self.model.reset_arch(sort_channels=True)
+        self.state_dict = copy.deepcopy(self.model.state_dict())
+
+        calibration_batches = None
+        if self.num_calib_batches > 0 and self.model.bn:
+            calibration_batches = nas_utils.get_calibration_batches(
+                train_loader if train_loader else test_loader, self.num_calib_batches,
+                self.seed or 0)
+            self.calibration_batches = [inputs.to(device) for inputs in calibration_batches]
+
+        if self.num_workers > 0:
+            self.pool = ProcessPoolExecutor(
+                self.num_workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=nas_utils.init_worker,
+                initargs=(copy.deepcopy(self.model).cpu(), ai8x.dev,
+                          nas_utils.copy_loader(train_loader)
+                          if train_loader and calibration_batches is None else None,
+                          nas_utils.copy_loader(test_loader), device, self.seed or 0,
+                          calibration_batches))
+        try:
+            return self._run(constraint, train_loader, test_loader, device)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+            self.calibration_batches = None
+
+    def _run(self, constraint, train_loader, test_loader, device):
         """Executes the search algorithm"""
         num_mutations = int(round(self.population_size * self.ratio_mutation))
         num_parents = int(round(self.population_size * self.ratio_parent))
 
-        population = []
         best_acc = -9999
         best_arch = None
 
         print(f'Population Init with {self.population_size} Architecture Samples.')
         t1 = time.time()
-        for _ in range(self.population_size):
-            while True:
-                child_net = self.get_random_valid_sample(constraint)
-                if not nas_utils.check_net_in_population(child_net, population):
-                    child_net_acc = nas_utils.calc_accuracy(child_net, self.model, train_loader,
-                                                            test_loader, device)
-                    child_net_eff = nas_utils.calc_efficiency(child_net)
-                    break
-
-            population.append((child_net, child_net_acc, child_net_eff))
+        population_keys = set()
+        child_nets = self.generate_samples(self.population_size, population_keys,
+                                           self.get_random_valid_sample, constraint)
+        population = self.evaluate(child_nets, train_loader, test_loader, device)
+        self.cache.save()
         t2 = time.time()
         parents = sorted(population, key=lambda x: x[1], reverse=True)[:num_parents]
         best_acc = parents[0][1]
@@ -122,37 +286,28 @@ class EvolutionSearch:
             print(f'Iteration: {n}')
 
             population = parents
+            population_keys = {nas_utils.get_arch_key(p[0]) for p in population}
+
+            if self.predictor is not None and n % self.retrain_interval == 0:
+                self.predictor.fit()
 
             t1 = time.time()
-            for _ in range(num_mutations):
-                while True:
-                    sample = population[np.random.randint(num_parents)][0]
-                    child_net = self.mutate_valid_sample(sample, constraint)
-                    if not nas_utils.check_net_in_population(child_net, population):
-                        child_net_acc = nas_utils.calc_accuracy(child_net, self.model,
-                                                                train_loader, test_loader, device)
-                        child_net_eff = nas_utils.calc_efficiency(child_net)
-                        break
-
-                population.append((child_net, child_net_acc, child_net_eff))
+            child_nets = self.select_samples(num_mutations, population_keys,
+                                             self.mutate_parent, parents, constraint)
+            population = population + self.evaluate(child_nets, train_loader, test_loader,
+                                                    device)
             t2 = time.time()
             print(f'\tMutation done in {(t2-t1):.2f}secs.')
 
             t1 = time.time()
-            for _ in range(self.population_size - num_mutations):
-                while True:
-                    sample1 = population[np.random.randint(num_parents)][0]
-                    sample2 = population[np.random.randint(num_parents)][0]
-                    child_net = self.crossover_valid_sample(sample1, sample2, constraint)
-                    if not nas_utils.check_net_in_population(child_net, population):
-                        child_net_acc = nas_utils.calc_accuracy(child_net, self.model,
-                                                                train_loader, test_loader, device)
-                        child_net_eff = nas_utils.calc_efficiency(child_net)
-                        break
-
-                population.append((child_net, child_net_acc, child_net_eff))
+            child_nets = self.select_samples(self.population_size - num_mutations,
+                                             population_keys, self.crossover_parents, parents,
+                                             constraint)
+            population = population + self.evaluate(child_nets, train_loader, test_loader,
+                                                    device)
             t2 = time.time()
             print(f'\tCrossover done in {(t2-t1):.2f}secs.')
+            self.cache.save()
 
             parents = sorted(population, key=lambda x: x[1], reverse=True)[:num_parents]
             acc = parents[0][1]
@@ -162,6 +317,7 @@ class EvolutionSearch:
             t2_iter = time.time()
             print(f'\tBest Accuracy: {(100*best_acc):.2f}%')
             print(f'\tBest Model: {best_arch}')
+            print(f'\tEvaluated: {self.num_evaluated}, cached: {len(self.cache)}')
             print(f'\tDuration: {(t2_iter-t1_iter):.2f}secs.')
 
         # print('\nBest Models:')
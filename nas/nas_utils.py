@@ -10,11 +10,74 @@
 Utility functions for NAS
 """
 
+import copy
+import hashlib
+import json
+import os
+import zlib
+
 import torch
+from torch import nn
+from torch.utils.data import DataLoader, Subset
+
+import ai8x
+import ai8x_cost
+
+
+def get_calibration_batches(loader, num_batches, seed=0):
+    """
+    Draws `num_batches` batches of inputs from the samples of `loader` once and returns them
+    as a list of collated tensors for `recalibrate_bn()`. Only the indices of the sampler of
+    `loader` are used, so samples that the sampler excludes (e.g., the validation split) never
+    become part of the calibration set. The samples are selected randomly using `seed`, so the
+    same calibration set is drawn in every run.
+    """
+    # Samplers over a subset hold their indices, other samplers are iterated once
+    sampler_indices = getattr(loader.sampler, 'indices', None)
+    if sampler_indices is None:
+        sampler_indices = list(loader.sampler)
+    sampler_indices = torch.tensor(sorted(sampler_indices), dtype=torch.long)
+
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    indices = sampler_indices[torch.randperm(len(sampler_indices), generator=generator)]
+    subset = Subset(loader.dataset, indices[:num_batches * loader.batch_size].tolist())
+
+    subset_loader = DataLoader(subset, batch_size=loader.batch_size, shuffle=False,
+                               num_workers=loader.num_workers, collate_fn=loader.collate_fn)
+    return [inputs for inputs, _ in subset_loader]
+
+
+def recalibrate_bn(model, batches, device):
+    """
+    Re-estimates the batchnorm running statistics of `model` from the input tensors `batches`.
+    The momentum is set to 1/n for the n-th batch, so the running statistics become the
+    cumulative average over all batches, independent of the previous statistics and of the
+    order of the batches.
+    """
+    bn_layers = [m for m in model.modules()
+                 if isinstance(m, (nn.BatchNorm1d, nn.BatchNorm2d, nn.BatchNorm3d))]
+    momentum = [m.momentum for m in bn_layers]
 
+    model.train()
+    try:
+        with torch.no_grad():
+            for n, inputs in enumerate(batches):
+                for m in bn_layers:
+                    m.momentum = 1. / (n + 1)
+                model(inputs.to(device))
+    finally:
+        for m, m_momentum in zip(bn_layers, momentum):
+            m.momentum = m_momentum
 
-def calc_accuracy(child_net_arch, model, train_loader, test_loader, device):
-    """Calculates accuracy for the given subnet of the model"""
+
+def calc_accuracy(child_net_arch, model, train_loader, test_loader, device,
+                  calibration_batches=None):
+    """
+    Calculates accuracy for the given subnet of the model. The batchnorm statistics are
+    re-estimated on `calibration_batches` (see `get_calibration_batches()`) if given, or else
+    on the training set.
+    """
     correct = 0
     total = 0
 
@@ -22,7 +85,9 @@ def calc_accuracy(child_net_arch, model, train_loader, test_loader, device):
         if child_net_arch is not None:
             model.set_subnet_arch(child_net_arch, True)
 
-        if model.bn:
+        if model.bn and calibration_batches:
+            recalibrate_bn(model, calibration_batches, device)
+        elif model.bn:
             model.train()
             if train_loader:
                 for data in train_loader:
@@ -53,15 +118,143 @@ def calc_accuracy(child_net_arch, model, train_loader, test_loader, device):
     return val_accuracy
 
 
-def calc_efficiency(child_net_arch):  # pylint: disable=unused-argument
-    """Calculates efficiency for the given subnet of the model"""
-    return 1.0
+def calc_hw_cost(child_net_arch, device=None):
+    """Estimates the hardware cost totals of the given subnet (see ai8x_cost.py)"""
+    _, totals = ai8x_cost.estimate(ai8x_cost.layers_from_arch(child_net_arch), device)
+    return totals
+
+
+def calc_efficiency(child_net_arch, device=None):
+    """
+    Calculates efficiency for the given subnet of the model as the estimated number of
+    inferences per second on the device
+    """
+    return 1.0 / calc_hw_cost(child_net_arch, device)['latency']
+
+
+def evaluate_subnet(child_net_arch, model, train_loader, test_loader, device, seed=0,
+                    state_dict=None, calibration_batches=None):
+    """
+    Returns the accuracy and efficiency of the given subnet of the model. The result only
+    depends on the subnet, `seed` and the model state: the model is restored to `state_dict`
+    (if given) first, since the batchnorm re-estimation changes the running statistics, and
+    the random shuffling of the data is seeded from `seed` and the subnet.
+    """
+    if state_dict is not None:
+        model.load_state_dict(state_dict)
+    torch.manual_seed((seed + zlib.crc32(get_arch_key(child_net_arch).encode())) & 0xffffffff)
+
+    return (calc_accuracy(child_net_arch, model, train_loader, test_loader, device,
+                          calibration_batches),
+            calc_efficiency(child_net_arch))
+
+
+def copy_loader(loader):
+    """
+    Returns the dataset, batch size, sampler, `drop_last` and collate function of `loader` for
+    `init_worker()`. The collate function of a `batch_augment.PostprocessLoader` includes its
+    transform.
+    """
+    return loader.dataset, loader.batch_size, loader.sampler, loader.drop_last, \
+        loader.collate_fn
+
+
+_worker = {}
+
+
+def init_worker(model, dev, train_loader, test_loader, device, seed,
+                calibration_batches=None):
+    """
+    Initializes a worker process for `evaluate_in_worker()`. The worker holds its own copy of
+    the model and of the batchnorm calibration set, and re-creates the data loaders (see
+    `copy_loader()`) without loader workers.
+    """
+    ai8x.dev = dev
+    torch.set_num_threads(1)
+
+    def _loader(args):
+        if args is None:
+            return None
+        dataset, batch_size, sampler, drop_last, collate_fn = args
+        return DataLoader(dataset, batch_size=batch_size, sampler=sampler, num_workers=0,
+                          collate_fn=collate_fn, drop_last=drop_last)
+
+    # The model arrives in shared memory, so each worker needs a private copy to modify
+    model = copy.deepcopy(model).to(device)
+    if calibration_batches is not None:
+        calibration_batches = [inputs.to(device) for inputs in calibration_batches]
+    _worker.update(model=model, state_dict=copy.deepcopy(model.state_dict()),
+                   train_loader=_loader(train_loader), test_loader=_loader(test_loader),
+                   device=device, seed=seed, calibration_batches=calibration_batches)
+
+
+def evaluate_in_worker(child_net_arch):
+    """Evaluates the given subnet in a worker process (see `evaluate_subnet()`)"""
+    return evaluate_subnet(child_net_arch, _worker['model'], _worker['train_loader'],
+                           _worker['test_loader'], _worker['device'], _worker['seed'],
+                           _worker['state_dict'], _worker['calibration_batches'])
+
+
+def get_arch_key(arch):
+    """
+    Returns a canonical, hashable encoding of the architecture dictionary `arch`. Equal
+    architectures have equal keys.
+    """
+    def _canonical(value):
+        if isinstance(value, type):
+            return value.__name__
+        if isinstance(value, dict):
+            return {k: _canonical(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [_canonical(v) for v in value]
+        return value
+
+    return json.dumps(_canonical(arch), sort_keys=True)
+
+
+def get_file_hash(path):
+    """Returns the SHA-256 hash of the file at `path`"""
+    sha = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class SubnetCache:
+    """
+    Cache of the accuracy and efficiency of evaluated sub networks, keyed by `get_arch_key()`.
+    Results are only valid for one trained model and evaluation setup, identified by
+    `namespace` (e.g., the checkpoint hash). When `path` is given, the cache is loaded from
+    and saved to this JSON file, which can hold the results of several namespaces.
+    """
+    def __init__(self, path=None, namespace=''):
+        self.path = path
+        self.namespace = namespace
+        self.all_entries = {}
+        if path is not None and os.path.exists(path):
+            with open(path, mode='r', encoding='utf-8') as f:
+                self.all_entries = json.load(f)
+        self.entries = self.all_entries.setdefault(namespace, {})
+        self.num_loaded = len(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
 
+    def get(self, arch):
+        """Returns the cached (accuracy, efficiency) of `arch`, or None"""
+        entry = self.entries.get(get_arch_key(arch))
+        return tuple(entry) if entry is not None else None
 
-def check_net_in_population(child_net, population):
-    """Checks if a sub network is in the population"""
-    for p in population:
-        if child_net == p[0]:
-            return True
+    def put(self, arch, accuracy, efficiency):
+        """Stores the accuracy and efficiency of `arch`"""
+        self.entries[get_arch_key(arch)] = [accuracy, efficiency]
 
-    return False
+    def save(self):
+        """Saves the cache to its file (if any)"""
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, mode='w', encoding='utf-8') as f:
+            json.dump(self.all_entries, f)
+        os.replace(tmp_path, self.path)
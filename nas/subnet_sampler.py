@@ -0,0 +1,269 @@
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Constraint-aware sampling of sub networks for NAS
+"""
+
+import math
+import random
+
+import numpy as np
+
+
+class SubnetSampler:
+    """
+    Samples, mutates and crosses over sub networks of the base architecture `base_arch` of a
+    sequential Once For All model (class `model_cls`) within the `min_num_weights`,
+    `max_num_weights` and `width_options` constraints of `constraint`, without rejecting
+    samples.
+
+    The number of weights of a sub network is a sum of per-layer terms that only depend on
+    the width and kernel size of a layer and the width of its input (see
+    `get_layer_num_weights()` of the model). A dynamic program over the units and layers
+    computes the distribution of the number of weights of the rest of the network for every
+    depth, width and kernel choice, and the samplers only make choices that can still be
+    completed within the weight budget.
+    """
+    def __init__(self, model_cls, base_arch, constraint):
+        self.model_cls = model_cls
+        self.base_arch = base_arch
+        self.constraint = constraint
+        self.n_units = base_arch['n_units']
+        self.width_filter = constraint.get('width_options')
+        self.final_width = base_arch['width_list'][-1][-1]
+
+        # The weights are counted in units of the greatest common divisor of all layer terms
+        widths = {base_arch['num_channels']}
+        kernels = set()
+        for u_ind, depth in enumerate(base_arch['depth_list']):
+            for l_ind in range(depth):
+                widths.update(model_cls.get_width_options(base_arch['width_list'][u_ind][l_ind]))
+                kernels.update(model_cls.get_kernel_options(
+                    base_arch['kernel_list'][u_ind][l_ind]))
+        widths.add(self.final_width)
+        self.unit_weights = 0
+        for in_width in widths:
+            for width in widths:
+                for kernel_size in kernels:
+                    self.unit_weights = math.gcd(
+                        self.unit_weights,
+                        model_cls.get_layer_num_weights(base_arch, in_width, width, kernel_size))
+        self.unit_weights = max(self.unit_weights, 1)
+
+        # Budget [low, high] for the sum of the layer terms in units of `unit_weights`. Sums
+        # are tracked up to `high`, or saturate at `low` when there is no upper limit.
+        linear_weights = model_cls.get_linear_num_weights(base_arch)
+        self.low = 0
+        if 'min_num_weights' in constraint:
+            self.low = max(math.ceil((constraint['min_num_weights'] - linear_weights)
+                                     / self.unit_weights), 0)
+        self.saturate = 'max_num_weights' not in constraint
+        if self.saturate:
+            self.high = self.low
+        else:
+            self.high = math.floor((constraint['max_num_weights'] - linear_weights)
+                                   / self.unit_weights)
+        self.memo = {}
+
+        self.num_feasible = 0
+        self.num_total = 1
+        if self.high >= 0 and self.low <= self.high:
+            self.num_feasible = self.mass(self.unit_dist(0, base_arch['num_channels'], False), 0)
+            # Only the probabilities are needed for sampling
+            self.memo = {key: dist for key, dist in self.memo.items() if key[-1]}
+        for u_ind in range(self.n_units):
+            self.num_total *= sum(math.prod(len(self.layer_options(u_ind, l_ind, depth)[1])
+                                            for l_ind in range(depth))
+                                  for depth in range(1, base_arch['depth_list'][u_ind] + 1))
+
+    def layer_options(self, u_ind, l_ind, depth):
+        """
+        Returns the (width, kernel size) options of a layer that meet the width constraint, and
+        all options of the layer
+        """
+        kernels = self.model_cls.get_kernel_options(self.base_arch['kernel_list'][u_ind][l_ind])
+        if u_ind == self.n_units - 1 and l_ind == depth - 1:
+            widths = [self.final_width]
+        else:
+            widths = self.model_cls.get_width_options(self.base_arch['width_list'][u_ind][l_ind])
+
+        all_opts = [(width, kernel_size) for width in widths for kernel_size in kernels]
+        opts = [opt for opt in all_opts
+                if self.width_filter is None or opt[0] in self.width_filter]
+        return opts, all_opts
+
+    def term(self, in_width, width, kernel_size):
+        """Returns the number of weights of a layer in units of `unit_weights`"""
+        return self.model_cls.get_layer_num_weights(self.base_arch, in_width, width,
+                                                    kernel_size) // self.unit_weights
+
+    def shift(self, dist, offset):
+        """Returns the distribution `dist` of weight sums shifted by `offset`"""
+        shifted = np.zeros_like(dist)
+        if offset < len(dist):
+            shifted[offset:] = dist[:len(dist) - offset]
+        if self.saturate:
+            shifted[-1] += dist[max(len(dist) - offset, 0):].sum()
+        return shifted
+
+    def mass(self, dist, prefix):
+        """Returns the mass of `dist` that keeps the total within the budget after `prefix`"""
+        start = max(self.low - prefix, 0)
+        stop = len(dist) if self.saturate else self.high - prefix + 1
+        return float(dist[start:stop].sum()) if start < stop else 0.
+
+    def unit_dist(self, u_ind, in_width, prob):
+        """
+        Returns the distribution of the weight sum of units `u_ind` and later for the input
+        width `in_width`: the number of sub networks per sum, or their probability under
+        random sampling if `prob`
+        """
+        key = ('unit', u_ind, in_width, prob)
+        if key not in self.memo:
+            if u_ind == self.n_units:
+                dist = np.zeros(self.high + 1)
+                dist[0] = 1.
+            else:
+                max_depth = self.base_arch['depth_list'][u_ind]
+                dist = sum(self.layer_dist(u_ind, 0, depth, in_width, prob)
+                           for depth in range(1, max_depth + 1))
+                if prob:
+                    dist = dist / max_depth
+            self.memo[key] = dist
+        return self.memo[key]
+
+    def layer_dist(self, u_ind, l_ind, depth, in_width, prob):
+        """
+        Returns the distribution of the weight sum of the layers `l_ind` and later of a unit
+        with depth `depth`, and of the following units (see `unit_dist()`)
+        """
+        if l_ind == depth:
+            return self.unit_dist(u_ind + 1, in_width, prob)
+
+        key = ('layer', u_ind, l_ind, depth, in_width, prob)
+        if key not in self.memo:
+            opts, all_opts = self.layer_options(u_ind, l_ind, depth)
+            dist = np.zeros(self.high + 1)
+            for width, kernel_size in opts:
+                dist += self.shift(self.layer_dist(u_ind, l_ind + 1, depth, width, prob),
+                                   self.term(in_width, width, kernel_size))
+            if prob:
+                dist = dist / len(all_opts)
+            self.memo[key] = dist
+        return self.memo[key]
+
+    def construct(self, choose_depth, choose_layer):
+        """
+        Builds a sub network choice by choice. `choose_depth(u_ind, depths, masses)` and
+        `choose_layer(u_ind, l_ind, depth, opts, masses)` return the index of the chosen
+        option, where `masses` are the probabilities that a random completion after each
+        option meets the weight budget.
+        """
+        if self.num_feasible == 0:
+            raise ValueError('No sub network meets the constraints '
+                             f'{self.constraint} (see `min_num_weights`, `max_num_weights` '
+                             'and `width_options`).')
+
+        arch = {key: self.base_arch[key] for key in ['num_classes', 'num_channels',
+                                                     'dimensions', 'bias', 'n_units', 'bn',
+                                                     'unit']}
+        arch.update(depth_list=[], width_list=[], kernel_list=[])
+
+        prefix = 0
+        in_width = self.base_arch['num_channels']
+        for u_ind in range(self.n_units):
+            depths = list(range(1, self.base_arch['depth_list'][u_ind] + 1))
+            masses = [self.mass(self.layer_dist(u_ind, 0, depth, in_width, True), prefix)
+                      for depth in depths]
+            depth = depths[choose_depth(u_ind, depths, masses)]
+
+            arch['depth_list'].append(depth)
+            arch['width_list'].append([])
+            arch['kernel_list'].append([])
+            for l_ind in range(depth):
+                opts, _ = self.layer_options(u_ind, l_ind, depth)
+                terms = [self.term(in_width, width, kernel_size) for width, kernel_size in opts]
+                masses = [self.mass(self.layer_dist(u_ind, l_ind + 1, depth, width, True),
+                                    prefix + term)
+                          for (width, _), term in zip(opts, terms)]
+                choice = choose_layer(u_ind, l_ind, depth, opts, masses)
+
+                width, kernel_size = opts[choice]
+                arch['width_list'][u_ind].append(width)
+                arch['kernel_list'][u_ind].append(kernel_size)
+                prefix += terms[choice]
+                in_width = width
+
+        return arch
+
+    @staticmethod
+    def choose(priors, masses):
+        """
+        Returns a random index weighted by `priors` among the options that can be completed
+        (`masses` > 0), or weighted by `masses` if no such option has a prior
+        """
+        weights = [prior if mass > 0 else 0. for prior, mass in zip(priors, masses)]
+        if sum(weights) == 0:
+            weights = masses
+        return random.choices(range(len(weights)), weights=weights)[0]
+
+    def sample(self):
+        """
+        Returns a random sub network, distributed like a random sample of the search space
+        that is kept only if it meets the constraints
+        """
+        return self.construct(lambda u_ind, depths, masses: self.choose(masses, masses),
+                              lambda u_ind, l_ind, depth, opts, masses:
+                              self.choose(masses, masses))
+
+    def mutate(self, arch, prob_mutation):
+        """
+        Returns a mutation of `arch` like `mutate()` of the model: every depth and every layer
+        is re-sampled with probability `prob_mutation`, using only options that can be completed
+        """
+        def _choose_depth(u_ind, depths, masses):
+            priors = [prob_mutation / len(depths)
+                      + (1. - prob_mutation) * (depth == arch['depth_list'][u_ind])
+                      for depth in depths]
+            return self.choose(priors, masses)
+
+        def _choose_layer(u_ind, l_ind, depth, opts, masses):
+            _, all_opts = self.layer_options(u_ind, l_ind, depth)
+            if l_ind >= arch['depth_list'][u_ind]:
+                return self.choose([1.] * len(opts), masses)
+            parent = (opts[0][0] if u_ind == self.n_units - 1 and l_ind == depth - 1
+                      else arch['width_list'][u_ind][l_ind], arch['kernel_list'][u_ind][l_ind])
+            priors = [prob_mutation / len(all_opts) + (1. - prob_mutation) * (opt == parent)
+                      for opt in opts]
+            return self.choose(priors, masses)
+
+        return self.construct(_choose_depth, _choose_layer)
+
+    def crossover(self, arch1, arch2):
+        """
+        Returns a crossover of `arch1` and `arch2` like `crossover()` of the model, using only
+        options that can be completed
+        """
+        def _choose_depth(u_ind, depths, masses):
+            parents = [arch1['depth_list'][u_ind], arch2['depth_list'][u_ind]]
+            return self.choose([parents.count(depth) for depth in depths], masses)
+
+        def _choose_layer(u_ind, l_ind, depth, opts, masses):
+            parents = [arch for arch in [arch1, arch2] if l_ind < arch['depth_list'][u_ind]]
+            if not parents:
+                return self.choose([1.] * len(opts), masses)
+            widths = [arch['width_list'][u_ind][l_ind] for arch in parents]
+            if u_ind == self.n_units - 1 and l_ind == depth - 1:
+                widths = [self.final_width]
+            kernels = [arch['kernel_list'][u_ind][l_ind] for arch in parents]
+            priors = [widths.count(width) * kernels.count(kernel_size)
+                      for width, kernel_size in opts]
+            return self.choose(priors, masses)
+
+        return self.construct(_choose_depth, _choose_layer)
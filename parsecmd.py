@@ -39,7 +39,7 @@ from examples.auto_compression.amc import amc_args as adc
 from devices import device
 
 SUMMARY_CHOICES = ['sparsity', 'compute', 'model', 'modules', 'png', 'png_w_params', 'onnx',
-                   'onnx_simplified']
+                   'onnx_simplified', 'hardware']
 
 
 def get_parser(model_names, dataset_names):
@@ -63,7 +63,8 @@ def get_parser(model_names, dataset_names):
                         help='get only the first image from the test set')
     parser.add_argument('--data', metavar='DIR', default='data', help='path to dataset')
     parser.add_argument('-j', '--workers', default=4, type=int, metavar='N',
-                        help='number of data loading workers (default: 4)')
+                        help='number of data loading workers, and of the processes that '
+                             'generate the KWS datasets (default: 4)')
     parser.add_argument('--epochs', type=int, metavar='N',
                         help='number of total epochs to run (default: 90)')
     parser.add_argument('-b', '--batch-size', default=256, type=int,
@@ -76,6 +77,9 @@ def get_parser(model_names, dataset_names):
     parser.add_argument('--avg-pool-rounding', action='store_true', default=False,
                         help='when simulating, use "round()" in AvgPool operations '
                              '(default: use "floor()")')
+    parser.add_argument('--integer-inference', action='store_true', default=False,
+                        help='when simulating (--8-bit-mode) during evaluation, use the '
+                             'bit-exact integer-only inference engine')
 
     qat_args = parser.add_argument_group('Quantization Arguments')
     qat_args.add_argument('--qat-policy', dest='qat_policy',
@@ -95,6 +99,11 @@ def get_parser(model_names, dataset_names):
                           default=None, help='list of tuples to define epochs to change the '
                                              'stages and levels of NAS sampling policy. '
                                              'Use --nas-policy option instead!')
+    ofa_args.add_argument('--nas-calib-batches', dest='nas_calib_batches', default=0,
+                          type=int, metavar='N',
+                          help='number of training batches, drawn once, on which the batchnorm '
+                               'statistics are re-estimated before each NAS validation '
+                               '(default: 0, use the whole training set)')
 
     optimizer_args = parser.add_argument_group('Optimizer Arguments')
     optimizer_args.add_argument('--optimizer',
@@ -197,6 +206,22 @@ def get_parser(model_names, dataset_names):
     parser.add_argument('--effective-test-size', '--etes', type=float_range(exc_min=True),
                         default=1.,
                         help='Portion of test dataset to be used in each epoch')
+    parser.add_argument('--tensor-loader', action='store_true', default=False,
+                        help='Hold datasets that support it in memory as one tensor and load '
+                             'each batch with a single gather instead of per-sample loading '
+                             'in --workers processes')
+    parser.add_argument('--image-cache-bytes', type=int, default=0, metavar='BYTES',
+                        help='keep up to BYTES of decoded and resized images in memory that is '
+                             'shared with the --workers processes (image folder datasets in '
+                             'datasets/classification.py only, default: 0, disabled)')
+    parser.add_argument('--keep-last', type=int, default=1, metavar='N',
+                        help='keep the checkpoints of the N most recent validated epochs as '
+                             '<name>_checkpoint_<epoch>.pth.tar (default: 1, only the latest '
+                             'checkpoint)')
+    parser.add_argument('--keep-best', type=int, default=1, metavar='K',
+                        help='keep the checkpoints of the K best epochs as '
+                             '<name>_checkpoint_<epoch>.pth.tar (default: 1, only the best '
+                             'checkpoint)')
     parser.add_argument('--confusion', dest='display_confusion', default=False,
                         action='store_true',
                         help='Display the confusion matrix')
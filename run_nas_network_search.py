@@ -22,6 +22,8 @@ import torch
 from torch.utils.data import DataLoader
 
 import ai8x
+from datasets import batch_augment
+from devices import device
 from nas import nas_utils, parse_nas_yaml
 from nas.evo_search import EvolutionSearch
 
@@ -52,6 +54,21 @@ def parse_args(model_names, dataset_names):
                         help='exports found subnets to a json file if set to True')
     parser.add_argument('--arch-file', help='filepath where the json file is stores '
                                             'if `export-archs` is set True')
+    parser.add_argument('--device', type=device, default=85, dest='hw_device',
+                        help='set device for the hardware constraints (default: MAX78000)')
+    parser.add_argument('--workers', '-j', default=0, type=int, metavar='N',
+                        help='number of worker processes that evaluate subnets concurrently '
+                             '(default: 0, evaluate in the main process)')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='seed of the search; results do not depend on the number of '
+                             'workers (default: 0)')
+    parser.add_argument('--cache-file', default=None,
+                        help='JSON file that stores the evaluated subnets so that later '
+                             'searches over the same checkpoint reuse them')
+    parser.add_argument('--calib-batches', default=10, type=int, metavar='N',
+                        help='number of training batches, drawn once, on which the batchnorm '
+                             'statistics of each subnet are re-estimated; 0 uses the whole '
+                             'training set (default: 10)')
 
     return parser.parse_args()
 
@@ -60,11 +77,14 @@ def get_evo_search_params(nas_policy):
     """Get parameters used for evolutionary search from yaml file"""
     evo_search_params = {'population_size': 100, 'prob_mutation': 0.1, 'ratio_mutation': 0.5,
                          'ratio_parent': 0.25, 'num_iter': 500,
-                         'constraints': {'max_num_weights': 4.5e5}}
+                         'constraints': {'max_num_weights': 4.5e5},
+                         'predictor': {'oversampling': 1, 'retrain_interval': 1}}
 
     if 'evolution_search' in nas_policy:
         for key, _ in evo_search_params.items():
-            if key in nas_policy['evolution_search']:
+            if key == 'predictor' and key in nas_policy['evolution_search']:
+                evo_search_params[key].update(nas_policy['evolution_search'][key])
+            elif key in nas_policy['evolution_search']:
                 evo_search_params[key] = nas_policy['evolution_search'][key]
 
     return evo_search_params
@@ -130,7 +150,7 @@ def get_data_loaders(supported_sources, args):
                               num_workers=0)
     val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=True, num_workers=0)
 
-    return train_loader, val_loader
+    return batch_augment.attach(train_loader, val_loader)
 
 
 def create_model(supported_models, args):
@@ -222,12 +242,11 @@ def generate_out_file(arch_list, num_elems, in_shape, model_type, file_path):
 
 def main():
     """Main routine"""
-    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
-
     supported_models, model_names = load_models()
     supported_sources, dataset_names = load_datasets()
 
     args = parse_args(model_names, dataset_names)
+    ai8x.set_device(device=args.hw_device, simulate=False, round_avg=False, verbose=False)
     args.truncate_testset = False
     use_cuda = torch.cuda.is_available()
     args.device = torch.device("cuda:0" if use_cuda else "cpu")
@@ -255,10 +274,22 @@ def main():
                                  prob_mutation=evo_search_params['prob_mutation'],
                                  ratio_mutation=evo_search_params['ratio_mutation'],
                                  ratio_parent=evo_search_params['ratio_parent'],
-                                 num_iter=evo_search_params['num_iter'])
+                                 num_iter=evo_search_params['num_iter'],
+                                 num_workers=args.workers, seed=args.seed,
+                                 num_calib_batches=args.calib_batches,
+                                 oversampling=evo_search_params['predictor']['oversampling'],
+                                 retrain_interval=evo_search_params['predictor'][
+                                     'retrain_interval'])
     evo_search.set_model(model)
+    if args.cache_file:
+        cache = nas_utils.SubnetCache(args.cache_file,
+                                      f'{nas_utils.get_file_hash(args.model_path)}:'
+                                      f'{args.dataset}:{ai8x.dev}:{args.seed}:'
+                                      f'{args.calib_batches}')
+    else:
+        cache = None
     arch_list = evo_search.run(evo_search_params['constraints'], train_loader,
-                               val_loader, args.device)
+                               val_loader, args.device, cache=cache)
 
     if args.export_archs:
         generate_out_file(arch_list, min(args.num_out_archs, len(arch_list)),
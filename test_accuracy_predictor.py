@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for the NAS accuracy predictor and the pre-screening of candidates
+"""
+import random
+
+import numpy as np
+
+from nas import nas_utils
+from nas.accuracy_predictor import AccuracyPredictor
+from nas.evo_search import EvolutionSearch
+
+BASE_ARCH = {'depth_list': [2, 3, 2],
+             'width_list': [[16, 32], [32, 64, 64], [64, 128]],
+             'kernel_list': [[3, 3], [3, 3, 3], [3, 3]]}
+
+
+def random_arch():
+    '''
+    Creates a random sub network of `BASE_ARCH`
+    '''
+    depth_list = [random.randint(1, max_depth) for max_depth in BASE_ARCH['depth_list']]
+    return {'depth_list': depth_list,
+            'width_list': [[random.choice([w // 4, w // 2, w]) for w in widths[:depth]]
+                           for widths, depth in zip(BASE_ARCH['width_list'], depth_list)],
+            'kernel_list': [[random.choice([1, 3]) for _ in range(depth)]
+                            for depth in depth_list]}
+
+
+def test():
+    '''
+    Main test function
+    '''
+    random.seed(0)
+    np.random.seed(0)
+
+    print('Testing linear target ...', end=' ')
+    predictor = AccuracyPredictor(BASE_ARCH, alpha=1e-9)
+    num_features = predictor.encode(BASE_ARCH).shape[0]
+    weights = np.random.rand(num_features)
+
+    def target(arch):
+        return float(predictor.encode(arch) @ weights + 0.25)
+
+    assert not predictor.is_trained, 'FAIL!! Trained without samples'
+    predictor.add(BASE_ARCH, target(BASE_ARCH))
+    predictor.fit()
+    assert not predictor.is_trained, 'FAIL!! Trained with one sample'
+    for _ in range(300):
+        arch = random_arch()
+        predictor.add(arch, target(arch))
+    predictor.fit()
+    assert predictor.is_trained, 'FAIL!! Not trained'
+    archs = [random_arch() for _ in range(50)]
+    assert np.allclose(predictor.predict(archs), [target(arch) for arch in archs],
+                       atol=1e-3), 'FAIL!! Prediction'
+    print('PASS')
+
+    print('Testing pre-screening ...', end=' ')
+    num_samples = 10
+    search = EvolutionSearch(oversampling=3)
+    search.cache = nas_utils.SubnetCache()
+    created = []
+
+    def create_sample():
+        created.append(random_arch())
+        return created[-1]
+
+    # Without a trained predictor, every created sub network is selected
+    for untrained in [None, AccuracyPredictor(BASE_ARCH)]:
+        search.predictor = untrained
+        del created[:]
+        population_keys = set()
+        samples = search.select_samples(num_samples, population_keys, create_sample)
+        assert len(created) == num_samples and samples == created, 'FAIL!! Pre-screened'
+
+    # With a trained predictor, the best of 3x as many candidates are selected
+    search.predictor = predictor
+    population = [random_arch() for _ in range(20)]
+    population_keys = {nas_utils.get_arch_key(arch) for arch in population}
+    del created[:]
+    samples = search.select_samples(num_samples, set(population_keys), create_sample)
+    sample_keys = {nas_utils.get_arch_key(arch) for arch in samples}
+    assert len(samples) == num_samples and len(sample_keys) == num_samples, \
+        'FAIL!! Number of distinct samples'
+    assert not sample_keys & population_keys, 'FAIL!! Samples in population'
+
+    candidates = {nas_utils.get_arch_key(arch): arch for arch in created}
+    candidates = [arch for key, arch in candidates.items() if key not in population_keys]
+    assert len(candidates) >= 3 * num_samples, 'FAIL!! Oversampling'
+    predicted = sorted(predictor.predict(candidates), reverse=True)
+    assert np.allclose(sorted(predictor.predict(samples), reverse=True),
+                       predicted[:num_samples]), 'FAIL!! Selection'
+    print('PASS')
+
+    print('\nSUCCESS!!')
+
+
+if __name__ == "__main__":
+    test()
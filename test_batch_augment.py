@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for the batched data augmentation
+"""
+import torch
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+import ai8x
+from datasets import batch_augment
+
+
+class Args:
+    """Arguments for `ai8x.normalize`"""
+    def __init__(self):
+        self.act_mode_8bit = False
+
+
+class ImageDataset:
+    """
+    Dataset of random uint8 images with a transform
+    """
+    def __init__(self, transform, num_samples=20):
+        self.data = torch.randint(0, 256, (num_samples, 3, 16, 16), dtype=torch.uint8)
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.transform(transforms.ToPILImage()(self.data[index])), index
+
+
+def test():
+    '''
+    Main test function
+    '''
+    torch.manual_seed(0)
+    batch = torch.rand(8, 3, 16, 16)
+
+    print('Testing identities ...', end=' ')
+    for t in [batch_augment.RandomHorizontalFlip(p=0.), batch_augment.RandomGrayscale(p=0.),
+              batch_augment.RandomAffine(degrees=0),
+              batch_augment.RandomResizedCrop(16, scale=(1., 1.), ratio=(1., 1.)),
+              batch_augment.ColorJitter(brightness=(1., 1.), contrast=(1., 1.),
+                                        saturation=(1., 1.), hue=(0., 0.))]:
+        assert torch.allclose(t(batch), batch, atol=1e-5), f'FAIL!! {t.__class__.__name__}'
+    flipped = batch_augment.RandomVerticalFlip(p=1.)(batch)
+    assert torch.equal(flipped, batch.flip(-2)), 'FAIL!! Flip'
+    blurred = batch_augment.GaussianBlur(3)(torch.full((2, 3, 8, 8), 0.5))
+    assert torch.allclose(blurred, torch.full((2, 3, 8, 8), 0.5)), 'FAIL!! Blur'
+    print('PASS')
+
+    print('Testing random parameters ...', end=' ')
+    rotated = batch_augment.RandomAffine(degrees=(90, 90))(batch)
+    assert torch.allclose(rotated[:, :, 1:-1, 1:-1], batch.rot90(1, (2, 3))[:, :, 1:-1, 1:-1],
+                          atol=1e-5) or \
+        torch.allclose(rotated[:, :, 1:-1, 1:-1], batch.rot90(-1, (2, 3))[:, :, 1:-1, 1:-1],
+                       atol=1e-5), 'FAIL!! Rotation'
+    copies = batch[:1].repeat(8, 1, 1, 1)
+    jittered = batch_augment.ColorJitter(brightness=0.5, hue=0.2)(copies)
+    assert jittered.shape == batch.shape and 0. <= jittered.min() and jittered.max() <= 1., \
+        'FAIL!! Jitter range'
+    assert not torch.allclose(jittered[0], jittered[1]), 'FAIL!! Per-sample parameters'
+    print('PASS')
+
+    print('Testing pipeline ...', end=' ')
+    pipeline = batch_augment.BatchPipeline(
+        sample=transforms.PILToTensor(),
+        batch=batch_augment.Compose([batch_augment.ToFloat(), ai8x.normalize(args=Args())]))
+    reference = transforms.Compose([transforms.ToTensor(), ai8x.normalize(args=Args())])
+    dataset = ImageDataset(pipeline)
+    per_sample = torch.stack([dataset[i][0] for i in range(len(dataset))])
+    loader = DataLoader(dataset, batch_size=8)
+    batch_augment.attach(loader)
+    assert pipeline.batched and dataset[0][0].dtype == torch.uint8, 'FAIL!! Attach'
+    batched = torch.cat([inputs for inputs, _ in loader])
+    expected = torch.stack([reference(transforms.ToPILImage()(img)) for img in dataset.data])
+    assert torch.allclose(per_sample, expected) and torch.allclose(batched, expected), \
+        'FAIL!! Normalization'
+    print('PASS')
+
+    print('Testing uint8 input ...', end=' ')
+    values = torch.arange(256, dtype=torch.uint8).view(1, 1, 16, 16)
+    for mode in [False, True]:
+        args = Args()
+        args.act_mode_8bit = mode
+        assert torch.equal(ai8x.normalize(args=args)(values),
+                           ai8x.normalize(args=args)(values.float() / 255.)), 'FAIL!! Fused'
+    pipeline = batch_augment.BatchPipeline(
+        sample=transforms.PILToTensor(),
+        batch=batch_augment.Compose([batch_augment.ToFloat(),
+                                     batch_augment.RandomHorizontalFlip(p=1.),
+                                     batch_augment.ToUint8()]),
+        post=ai8x.normalize(args=Args()))
+    data = dataset.data
+    dataset = ImageDataset(pipeline)
+    dataset.data = data
+    loader, = batch_augment.attach(DataLoader(dataset, batch_size=8))
+    assert isinstance(loader, batch_augment.PostprocessLoader) and len(loader.sampler) == 20, \
+        'FAIL!! Wrapper'
+    assert next(iter(loader.loader))[0].dtype == torch.uint8, 'FAIL!! Worker output'
+    batched = torch.cat([inputs for inputs, _ in loader])
+    assert torch.allclose(batched, expected.flip(-1)), 'FAIL!! Post-processing'
+    own_loader = DataLoader(dataset, batch_size=8, collate_fn=loader.collate_fn)
+    assert torch.allclose(next(iter(own_loader))[0], expected[:8].flip(-1)), 'FAIL!! Collate'
+    print('PASS')
+
+    print('\nSUCCESS!!')
+
+
+if __name__ == "__main__":
+    test()
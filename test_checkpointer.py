@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for the background checkpoint writer
+"""
+import os
+import tempfile
+
+import torch
+from torch import nn
+
+import checkpointer
+
+
+def train_step(model, optimizer):
+    """Changes the parameters and the optimizer state in place"""
+    optimizer.zero_grad()
+    model(torch.rand(4, 8)).sum().backward()
+    optimizer.step()
+
+
+def test():
+    '''
+    Main test function
+    '''
+    torch.manual_seed(0)
+    model = nn.Linear(8, 2)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        print('Testing snapshot ...', end=' ')
+        writer = checkpointer.CheckpointWriter()
+        train_step(model, optimizer)
+        expected = {k: v.clone() for k, v in model.state_dict().items()}
+        writer.save(0, 'linear', model, optimizer=optimizer, extras={'current_top1': 50.},
+                    is_best=True, name='test', dir=out_dir)
+        train_step(model, optimizer)
+        writer.flush()
+        checkpoint = torch.load(os.path.join(out_dir, 'test_checkpoint.pth.tar'))
+        assert checkpoint['epoch'] == 0 and checkpoint['arch'] == 'linear', 'FAIL!! Contents'
+        assert checkpoint['optimizer_type'] is torch.optim.SGD, 'FAIL!! Optimizer'
+        assert checkpoint['extras'] == {'current_top1': 50.}, 'FAIL!! Extras'
+        for key, value in expected.items():
+            assert torch.equal(checkpoint['state_dict'][key], value), 'FAIL!! State'
+        model.load_state_dict(checkpoint['state_dict'])
+        assert os.path.exists(os.path.join(out_dir, 'test_best.pth.tar')), 'FAIL!! Best'
+        assert not any(f.endswith('.tmp') for f in os.listdir(out_dir)), 'FAIL!! Temporary'
+        print('PASS')
+
+        print('Testing errors ...', end=' ')
+        try:
+            writer.save(1, 'linear', model, dir=os.path.join(out_dir, 'missing'))
+            assert False, 'FAIL!! Directory'
+        except IOError:
+            pass
+        writer.save(1, 'linear', model, extras={'unpicklable': lambda: None}, name='test',
+                    dir=out_dir)
+        try:
+            writer.flush()
+            assert False, 'FAIL!! Write error'
+        except RuntimeError:
+            pass
+        checkpoint = torch.load(os.path.join(out_dir, 'test_checkpoint.pth.tar'))
+        assert checkpoint['epoch'] == 0, 'FAIL!! Previous checkpoint'
+        assert not any(f.endswith('.tmp') for f in os.listdir(out_dir)), 'FAIL!! Temporary'
+        writer.close()
+        print('PASS')
+
+        print('Testing retention ...', end=' ')
+        writer = checkpointer.CheckpointWriter(keep_last=2, keep_best=2)
+        scores = {}
+        for epoch, top1 in enumerate([60., 80., 70., 50., 40., 75.]):
+            scores[epoch] = top1
+            ranking = sorted(scores, key=lambda e: (scores[e], e), reverse=True)
+            writer.save(epoch, 'linear', model, is_best=ranking[0] == epoch, dir=out_dir,
+                        ranking=ranking)
+        writer.close()
+        kept = sorted(f for f in os.listdir(out_dir) if f.startswith('checkpoint_'))
+        assert kept == ['checkpoint_1.pth.tar', 'checkpoint_4.pth.tar',
+                        'checkpoint_5.pth.tar'], 'FAIL!! Retention'
+        assert torch.load(os.path.join(out_dir, 'checkpoint.pth.tar'))['epoch'] == 5, \
+            'FAIL!! Latest'
+        assert torch.load(os.path.join(out_dir, 'best.pth.tar'))['epoch'] == 1, 'FAIL!! Best'
+        print('PASS')
+
+    print('\nSUCCESS!!')
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for the hardware cost model
+"""
+import importlib
+
+import ai8x
+import ai8x_cost
+
+nasnet = importlib.import_module('models.ai85nasnet-sequential')
+
+
+def test():
+    '''
+    Main test function
+    '''
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+
+    print('Testing single layer ...', end=' ')
+    costs, totals = ai8x_cost.estimate([
+        ai8x_cost.layer('conv', 128, 64, 9, (32, 32), (16, 16)),
+    ])
+    assert costs[0]['processors'] == 64 and costs[0]['passes'] == 2, 'FAIL!! Processors'
+    assert costs[0]['kernels_per_processor'] == 128, 'FAIL!! Kernels'
+    assert totals['kernel_memory'] == 128 * 64 * 9, 'FAIL!! Kernel memory'
+    assert totals['bias_memory'] == 64, 'FAIL!! Bias memory'
+    assert totals['data_memory'] == 2 * 32 * 32 + 16 * 16, 'FAIL!! Data memory'
+    assert totals['macs'] == 16 * 16 * 64 * 128 * 9, 'FAIL!! MACs'
+    assert totals['cycles'] == 16 * 16 * 128, 'FAIL!! Cycles'
+    assert not ai8x_cost.check_limits(totals), 'FAIL!! Limits'
+    print('PASS')
+
+    print('Testing arch and model ...', end=' ')
+    for device in [85, 87]:
+        ai8x.set_device(device=device, simulate=False, round_avg=False, verbose=False)
+        model = nasnet.ai85nasnet_sequential_cifar100(num_classes=100, num_channels=3,
+                                                      dimensions=(32, 32), bias=True)
+        model.set_subnet_arch(model.__class__.mutate(model.get_base_arch(),
+                                                     model.get_base_arch(), prob_mutation=1.0))
+        arch_costs, arch_totals = \
+            ai8x_cost.estimate(ai8x_cost.layers_from_arch(model.get_subnet_arch()))
+        model_costs, model_totals = \
+            ai8x_cost.estimate(ai8x_cost.layers_from_model(model, (3, 32, 32)))
+        assert arch_costs == model_costs and arch_totals == model_totals, 'FAIL!!'
+    print('PASS')
+
+    print('\nSUCCESS!!')
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine and benchmark for the batched object detection post-processing
+"""
+import importlib
+import time
+
+import torch
+import torch.nn.functional as F
+
+import ai8x
+import utils.object_detection_utils as obj_detect_utils
+
+tinierssd = importlib.import_module('models.ai85net-tinierssd')
+
+
+def detect_objects_loop(model, predicted_locs, predicted_scores, min_score, max_overlap, top_k):
+    """
+    Per-image, per-class detection with sequential greedy NMS (the previous implementation of
+    `TinierSSD.detect_objects()`), used as the reference
+    """
+    batch_size = predicted_locs.size(0)
+    predicted_scores = F.softmax(predicted_scores, dim=2)
+
+    all_images_boxes = []
+    all_images_labels = []
+    all_images_scores = []
+
+    for i in range(batch_size):
+        decoded_locs = obj_detect_utils.cxcy_to_xy(
+            obj_detect_utils.gcxgcy_to_cxcy(predicted_locs[i], model.priors_cxcy))
+
+        image_boxes = []
+        image_labels = []
+        image_scores = []
+
+        for c in range(1, model.n_classes):
+            class_scores = predicted_scores[i][:, c]
+            score_above_min_score = class_scores > min_score
+            n_above_min_score = score_above_min_score.sum().item()
+            if n_above_min_score == 0:
+                continue
+            class_scores = class_scores[score_above_min_score]
+            class_decoded_locs = decoded_locs[score_above_min_score]
+
+            class_scores, sort_ind = class_scores.sort(dim=0, descending=True)
+            class_decoded_locs = class_decoded_locs[sort_ind]
+
+            overlap = obj_detect_utils.find_jaccard_overlap(class_decoded_locs,
+                                                            class_decoded_locs)
+
+            suppress = torch.zeros((n_above_min_score), dtype=torch.bool)
+            for box in range(class_decoded_locs.size(0)):
+                if suppress[box]:
+                    continue
+                suppress = suppress | (overlap[box] > max_overlap)
+                suppress[box] = False
+
+            image_boxes.append(class_decoded_locs[~suppress])
+            image_labels.append(torch.LongTensor((~suppress).sum().item() * [c]))
+            image_scores.append(class_scores[~suppress])
+
+        if len(image_boxes) == 0:
+            image_boxes.append(torch.FloatTensor([[0., 0., 1., 1.]]))
+            image_labels.append(torch.LongTensor([0]))
+            image_scores.append(torch.FloatTensor([0.]))
+
+        image_boxes = torch.cat(image_boxes, dim=0)
+        image_labels = torch.cat(image_labels, dim=0)
+        image_scores = torch.cat(image_scores, dim=0)
+
+        if image_scores.size(0) > top_k:
+            image_scores, sort_ind = image_scores.sort(dim=0, descending=True)
+            image_scores = image_scores[:top_k]
+            image_boxes = image_boxes[sort_ind][:top_k]
+            image_labels = image_labels[sort_ind][:top_k]
+
+        all_images_boxes.append(image_boxes)
+        all_images_labels.append(image_labels)
+        all_images_scores.append(image_scores)
+
+    return all_images_boxes, all_images_labels, all_images_scores
+
+
+def test():
+    '''
+    Main test function
+    '''
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+    model = tinierssd.TinierSSD(num_classes=11)
+    n_priors = model.priors_cxcy.size(0)
+
+    torch.manual_seed(0)
+    for batch_size, min_score, max_overlap, top_k in [(8, 0.2, 0.45, 20), (32, 0.05, 0.3, 200),
+                                                      (4, 0.99, 0.45, 20)]:
+        print(f'Testing batch size {batch_size}, min_score {min_score}, max_overlap '
+              f'{max_overlap}, top_k {top_k} ...', end=' ')
+        locs = torch.randn(batch_size, n_priors, 4)
+        scores = 3. * torch.randn(batch_size, n_priors, model.n_classes)
+
+        time_s = time.time()
+        ref = detect_objects_loop(model, locs, scores, min_score, max_overlap, top_k)
+        time_ref = time.time() - time_s
+        time_s = time.time()
+        out = model.detect_objects(locs, scores, min_score, max_overlap, top_k)
+        time_out = time.time() - time_s
+
+        for ref_list, out_list in zip(ref, out):
+            assert len(ref_list) == len(out_list) == batch_size, 'FAIL!! Batch size'
+            for r, o in zip(ref_list, out_list):
+                assert torch.equal(r, o), 'FAIL!!'
+        print(f'PASS (loop: {time_ref:.3f} s, batched: {time_out:.3f} s)')
+
+    print('\nSUCCESS!!')
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for the integer-only inference engine
+"""
+import copy
+import importlib
+import time
+
+import torch
+from torch import nn
+
+import ai8x
+import ai8x_int
+
+kws20 = importlib.import_module('models.ai85net-kws20')
+simplenet = importlib.import_module('models.ai85net-simplenet')
+
+
+class IntTestNet2d(nn.Module):
+    """
+    Small 2D network that uses pooling, residual addition and a wide output layer
+    """
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.conv1 = ai8x.FusedConv2dReLU(3, 16, 3, padding=1, bias=True, **kwargs)
+        self.conv2 = ai8x.FusedMaxPoolConv2dReLU(16, 16, 3, padding=1, bias=True, **kwargs)
+        self.conv3 = ai8x.FusedAvgPoolConv2dReLU(16, 16, 1, bias=True, **kwargs)
+        self.conv4 = ai8x.FusedConv2dAbs(16, 16, 3, padding=1, bias=True, **kwargs)
+        self.add = ai8x.Add()
+        self.fc = ai8x.Linear(16*4*4, 10, bias=True, wide=True, **kwargs)
+
+    def forward(self, x):  # pylint: disable=arguments-differ
+        """Forward prop"""
+        x = self.conv1(x)
+        x = self.conv2(x)
+        x = self.conv3(x)
+        x = self.add(x, self.conv4(x))
+        x = x.view(x.size(0), -1)
+        return self.fc(x)
+
+
+class IntTestNet1d(nn.Module):
+    """
+    Small 1D network
+    """
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.conv1 = ai8x.FusedConv1dReLU(4, 8, 3, stride=1, padding=1, bias=True, **kwargs)
+        self.conv2 = ai8x.FusedAvgPoolConv1dReLU(8, 8, 3, stride=1, padding=1, bias=True,
+                                                 **kwargs)
+        self.conv3 = ai8x.FusedMaxPoolConv1d(8, 8, 1, stride=1, bias=True, **kwargs)
+
+    def forward(self, x):  # pylint: disable=arguments-differ
+        """Forward prop"""
+        return self.conv3(self.conv2(self.conv1(x)))
+
+
+class IntTestNetLarge(nn.Module):
+    """
+    Network with a layer whose sums of products can exceed the float32 mantissa
+    """
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.conv1 = ai8x.FusedConv2dReLU(512, 16, 3, padding=1, bias=True, **kwargs)
+        self.conv2 = ai8x.Conv2d(16, 8, 1, bias=True, wide=True, **kwargs)
+
+    def forward(self, x):  # pylint: disable=arguments-differ
+        """Forward prop"""
+        return self.conv2(self.conv1(x))
+
+
+def randomize_quantized(model, max_weight=20):
+    """
+    Assign random integer weights, bias values and output shifts to all layers of `model`
+    """
+    with torch.no_grad():
+        for m in model.modules():
+            if isinstance(m, ai8x.QuantizationAwareModule) and m.op is not None:
+                m.op.weight.copy_(torch.randint(-max_weight, max_weight, m.op.weight.shape))
+                m.op.bias.copy_(torch.randint(-1000, 1000, m.op.bias.shape))
+                m.output_shift.fill_(torch.randint(-1, 2, (1, )).item())
+
+
+def check_model(model, inp, max_weight=20):
+    """
+    Compare the integer engine against the float emulation for `model`, and return the
+    converted model
+    """
+    randomize_quantized(model, max_weight)
+    model.eval()
+    int_model = ai8x_int.convert(copy.deepcopy(model))
+    with torch.no_grad():
+        float_out = model(inp)
+        int_out = int_model(inp)
+
+    assert int_out.dtype == float_out.dtype, 'FAIL!! Output type'
+    assert torch.equal(int_out, float_out), 'FAIL!!'
+    return int_model
+
+
+def time_model(model, inp, repeat=3):
+    """
+    Return the shortest time of `repeat` inferences of `model` on `inp`, in seconds
+    """
+    with torch.no_grad():
+        model(inp)  # Warm-up, and the emulation caches its quantized parameters
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model(inp)
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def compare_speed(name, model, inp):
+    """
+    Check the integer engine against the float emulation for the full-size `model`, and
+    print the inference times of both
+    """
+    int_model = check_model(model, inp)
+    float_time = time_model(model, inp)
+    int_time = time_model(int_model, inp)
+    print(f'{name}: emulation {1000 * float_time:.1f} ms, integer {1000 * int_time:.1f} ms '
+          f'per batch of {inp.shape[0]} ({float_time / int_time:.2f}x) ...', end=' ')
+
+
+def test():
+    '''
+    Main test function
+    '''
+    qat_args = {'weight_bits': 8, 'bias_bits': 8, 'quantize_activation': True}
+
+    for round_avg in [False, True]:
+        ai8x.set_device(device=85, simulate=True, round_avg=round_avg, verbose=False)
+
+        print(f'Testing 2D model, round_avg: {round_avg} ...', end=' ')
+        inp = torch.randint(-128, 128, (8, 3, 16, 16)).float()
+        check_model(IntTestNet2d(**qat_args), inp)
+        print('PASS')
+
+        print(f'Testing 1D model, round_avg: {round_avg} ...', end=' ')
+        inp = torch.randint(-128, 128, (8, 4, 32)).float()
+        check_model(IntTestNet1d(**qat_args), inp)
+        print('PASS')
+
+        print(f'Testing large sums, round_avg: {round_avg} ...', end=' ')
+        inp = torch.randint(-128, 128, (4, 512, 8, 8)).float()
+        int_model = check_model(IntTestNetLarge(**qat_args), inp, max_weight=128)
+        assert not int_model.conv1.fused and len(int_model.conv1.channel_ranges) > 1, \
+            'FAIL!! Channel split'
+        assert int_model.conv2.fused, 'FAIL!! Fused wide layer'
+        print('PASS')
+
+    ai8x.set_device(device=85, simulate=True, round_avg=False, verbose=False)
+    torch.manual_seed(0)
+    compare_speed('KWS20', kws20.ai85kws20net(num_classes=21, num_channels=128,
+                                              dimensions=(128, 1), bias=True, **qat_args),
+                  torch.randint(-128, 128, (256, 128, 128)).float())
+    print('PASS')
+    model = simplenet.ai85simplenet(num_classes=100, num_channels=3, dimensions=(32, 32),
+                                    bias=True, **qat_args)
+    ai8x.fuse_bn_layers(model)
+    compare_speed('CIFAR-100 SimpleNet', model,
+                  torch.randint(-128, 128, (256, 3, 32, 32)).float())
+    print('PASS')
+
+    print('\nSUCCESS!!')
+
+
+if __name__ == "__main__":
+    test()
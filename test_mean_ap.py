@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for the vectorized and streaming mAP calculation
+"""
+import numpy as np
+import torch
+
+import utils.object_detection_utils as obj_detect_utils
+
+
+def calculate_map_loop(det_boxes, det_labels, det_scores, true_boxes, true_labels,
+                       true_difficulties):
+    """
+    Per-class, per-detection mAP calculation (the previous implementation of
+    `calculate_mAP()`), used as the reference
+    """
+    true_images = []
+    for i, true_label in enumerate(true_labels):
+        true_images.extend([i] * true_label.size(0))
+    true_images = torch.LongTensor(true_images)
+    true_boxes = torch.cat(true_boxes, dim=0)
+    true_labels = torch.cat(true_labels, dim=0)
+    true_difficulties = torch.cat(true_difficulties, dim=0)
+
+    labels = np.unique(true_labels.cpu().detach().numpy())
+    labels = np.append(labels, 0)
+    n_classes = len(labels)
+
+    det_images = []
+    for i, det_label in enumerate(det_labels):
+        det_images.extend([i] * det_label.size(0))
+    det_images = torch.LongTensor(det_images)
+    det_boxes = torch.cat(det_boxes, dim=0)
+    det_labels = torch.cat(det_labels, dim=0)
+    det_scores = torch.cat(det_scores, dim=0)
+
+    average_precisions = torch.zeros((n_classes - 1), dtype=torch.float)
+    for c in range(1, n_classes):
+        true_class_images = true_images[true_labels == c]
+        true_class_boxes = true_boxes[true_labels == c]
+        true_class_difficulties = true_difficulties[true_labels == c]
+        n_easy_class_objects = (1 - true_class_difficulties).sum().item()
+        true_class_boxes_detected = \
+            torch.zeros((true_class_difficulties.size(0)), dtype=torch.uint8)
+
+        det_class_images = det_images[det_labels == c]
+        det_class_boxes = det_boxes[det_labels == c]
+        det_class_scores = det_scores[det_labels == c]
+        n_class_detections = det_class_boxes.size(0)
+        if n_class_detections == 0:
+            continue
+
+        det_class_scores, sort_ind = torch.sort(det_class_scores, dim=0, descending=True)
+        det_class_images = det_class_images[sort_ind]
+        det_class_boxes = det_class_boxes[sort_ind]
+
+        true_positives = torch.zeros((n_class_detections), dtype=torch.float)
+        false_positives = torch.zeros((n_class_detections), dtype=torch.float)
+        for d in range(n_class_detections):
+            this_detection_box = det_class_boxes[d].unsqueeze(0)
+            this_image = det_class_images[d]
+
+            object_boxes = true_class_boxes[true_class_images == this_image]
+            object_difficulties = true_class_difficulties[true_class_images == this_image]
+            if object_boxes.size(0) == 0:
+                false_positives[d] = 1
+                continue
+
+            overlaps = obj_detect_utils.find_jaccard_overlap(this_detection_box, object_boxes)
+            max_overlap, ind = torch.max(overlaps.squeeze(0), dim=0)
+            original_ind = torch.LongTensor(range(true_class_boxes.size(0)))[
+                true_class_images == this_image][ind]
+
+            if max_overlap.item() > 0.5:
+                if object_difficulties[ind] == 0:
+                    if true_class_boxes_detected[original_ind] == 0:
+                        true_positives[d] = 1
+                        true_class_boxes_detected[original_ind] = 1
+                    else:
+                        false_positives[d] = 1
+            else:
+                false_positives[d] = 1
+
+        cumul_true_positives = torch.cumsum(true_positives, dim=0)
+        cumul_false_positives = torch.cumsum(false_positives, dim=0)
+        cumul_precision = cumul_true_positives / (
+                cumul_true_positives + cumul_false_positives + 1e-10)
+        cumul_recall = cumul_true_positives / n_easy_class_objects
+
+        recall_thresholds = torch.arange(start=0, end=1.1, step=.1).tolist()
+        precisions = torch.zeros((len(recall_thresholds)), dtype=torch.float)
+        for i, t in enumerate(recall_thresholds):
+            recalls_above_t = cumul_recall >= t
+            if recalls_above_t.any():
+                precisions[i] = cumul_precision[recalls_above_t].max()
+            else:
+                precisions[i] = 0.
+        average_precisions[c - 1] = precisions.mean()
+
+    mean_average_precision = average_precisions.mean().item()
+
+    return average_precisions, mean_average_precision
+
+
+def create_image(n_objects, n_false_detections, classes):
+    '''
+    Creates the objects of an image and detections of some of the objects (with jittered boxes,
+    some of them twice) and at random locations
+    '''
+    xy = torch.rand(n_objects, 2) * 0.7
+    true_boxes = torch.cat((xy, xy + 0.1 + torch.rand(n_objects, 2) * 0.2), dim=1)
+    true_labels = torch.tensor(classes)[torch.randint(len(classes), (n_objects,))]
+    true_difficulties = (torch.rand(n_objects) < 0.2).to(torch.uint8)
+
+    detected = torch.randint(n_objects, (n_objects + n_objects // 2,)) if n_objects > 0 \
+        else torch.zeros((0), dtype=torch.long)
+    det_boxes = true_boxes[detected] + (torch.rand(detected.size(0), 4) - 0.5) * 0.08
+    det_labels = true_labels[detected].clone()
+    wrong_label = torch.rand(detected.size(0)) < 0.1
+    det_labels[wrong_label] = torch.tensor(classes)[torch.randint(len(classes),
+                                                                  (int(wrong_label.sum()),))]
+    xy = torch.rand(n_false_detections, 2) * 0.7
+    det_boxes = torch.cat((det_boxes, torch.cat((xy, xy + 0.2), dim=1)))
+    det_labels = torch.cat((det_labels, torch.tensor(classes)[
+        torch.randint(len(classes), (n_false_detections,))]))
+    det_scores = torch.rand(det_labels.size(0))
+
+    return det_boxes, det_labels, det_scores, true_boxes, true_labels, true_difficulties
+
+
+def test():
+    '''
+    Main test function
+    '''
+    torch.manual_seed(0)
+
+    print('Testing mAP ...', end=' ')
+    for _ in range(5):
+        images = [create_image(int(torch.randint(0, 6, ())), int(torch.randint(0, 4, ())),
+                               [1, 2, 3]) for _ in range(12)]
+        # Class 4 has objects but no detections, and class 5 has 'difficult' objects only
+        _, _, _, true_boxes, true_labels, _ = create_image(2, 0, [4])
+        images.append((torch.zeros((0, 4)), torch.zeros((0), dtype=torch.long), torch.zeros((0)),
+                       true_boxes, true_labels, torch.zeros((2), dtype=torch.uint8)))
+        images.append(create_image(2, 0, [5])[:5] + (torch.ones((2), dtype=torch.uint8),))
+        images.append(create_image(0, 0, [1]))  # no objects and no detections
+        args = [list(arg) for arg in zip(*images)]
+
+        ref_aps, ref_map = calculate_map_loop(*args)
+        aps, mean_ap = obj_detect_utils.calculate_mAP(*args)
+        assert aps.shape == ref_aps.shape and torch.allclose(aps, ref_aps), 'FAIL!! APs'
+        assert abs(mean_ap - ref_map) < 1e-6, 'FAIL!! mAP'
+        assert ref_aps[3] == 0. and ref_aps[4] == 0., 'FAIL!! Empty classes'
+
+        accumulator = obj_detect_utils.MeanAPAccumulator()
+        for start in range(0, len(images), 4):
+            accumulator.add(*[arg[start:start + 4] for arg in args])
+        aps, mean_ap = accumulator.compute()
+        assert torch.allclose(aps, ref_aps) and abs(mean_ap - ref_map) < 1e-6, \
+            'FAIL!! Streaming'
+    print('PASS')
+
+    print('\nSUCCESS!!')
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for the device meters against the torchnet meters
+"""
+import math
+
+import numpy as np
+import torch
+import torchnet.meter as tnt
+
+import meters
+
+
+def test():
+    '''
+    Main test function
+    '''
+    torch.manual_seed(0)
+    batches = [(torch.randn(n, 10), torch.randint(0, 10, (n, ))) for n in [16, 16, 7, 1]]
+
+    print('Testing AverageValueMeter ...', end=' ')
+    meter, ref = meters.AverageValueMeter(), tnt.AverageValueMeter()
+    assert math.isnan(meter.mean), 'FAIL!! Empty'
+    for output, _ in batches:
+        meter.add(output.mean())
+        ref.add(output.mean().item())
+    assert math.isclose(meter.mean, ref.mean, rel_tol=1e-6), 'FAIL!! Mean'
+    assert np.allclose(meter.value(), ref.value(), rtol=1e-5), 'FAIL!! Std'
+    print('PASS')
+
+    print('Testing ClassErrorMeter ...', end=' ')
+    for accuracy in [True, False]:
+        meter = meters.ClassErrorMeter(accuracy=accuracy, topk=(1, 5))
+        ref = tnt.ClassErrorMeter(accuracy=accuracy, topk=(1, 5))
+        snaps = []
+        for output, target in batches:
+            meter.add(output, target)
+            ref.add(output, target)
+            snaps.append((meter.snapshot(), ref.value()))
+        assert meter.n == ref.n, 'FAIL!! Count'
+        for snap, value in snaps:
+            assert np.allclose(snap.value(), value), 'FAIL!! Snapshot'
+        assert math.isclose(meter.value(5), ref.value(5)), 'FAIL!! Top5'
+    print('PASS')
+
+    print('Testing MSEMeter ...', end=' ')
+    meter, ref = meters.MSEMeter(), tnt.MSEMeter()
+    for output, target in batches:
+        meter.add(output[:, 0], target.float())
+        ref.add(output[:, 0], target.float())
+    assert math.isclose(meter.value(), float(ref.value()), rel_tol=1e-6), 'FAIL!! MSE'
+    print('PASS')
+
+    print('Testing ConfusionMeter ...', end=' ')
+    for normalized in [False, True]:
+        meter = meters.ConfusionMeter(10, normalized=normalized)
+        ref = tnt.ConfusionMeter(10, normalized=normalized)
+        for output, target in batches:
+            meter.add(output, target)
+            ref.add(output, target)
+        assert np.allclose(meter.value(), ref.value()), 'FAIL!! Confusion'
+    print('PASS')
+
+    print('\nSUCCESS!!')
+
+
+if __name__ == "__main__":
+    test()
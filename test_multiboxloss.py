@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for the vectorized prior matching of the multi-box loss
+"""
+import torch
+
+import utils.object_detection_utils as obj_detect_utils
+from losses.multiboxloss import MultiBoxLoss
+
+
+class LoopMultiBoxLoss(MultiBoxLoss):
+    """
+    Multi-box loss with the per-image matching loop (the previous implementation of
+    `MultiBoxLoss.forward()`), used as the reference
+    """
+    def match(self, boxes, labels):
+        batch_size = len(boxes)
+        n_priors = self.priors_cxcy.size(0)
+
+        true_locs = torch.zeros((batch_size, n_priors, 4), dtype=torch.float).to(self.device)
+        true_classes = torch.zeros((batch_size, n_priors), dtype=torch.long).to(self.device)
+
+        for i in range(batch_size):
+            n_objects = boxes[i].size(0)
+
+            if n_objects > 0:
+                overlap = obj_detect_utils.find_jaccard_overlap(boxes[i], self.priors_xy)
+                overlap_for_each_prior, object_for_each_prior = overlap.max(dim=0)
+                _, prior_for_each_object = overlap.max(dim=1)  # (N_o)
+                object_for_each_prior[prior_for_each_object] = \
+                    torch.LongTensor(range(n_objects)).to(self.device)
+                overlap_for_each_prior[prior_for_each_object] = 1.
+
+                label_for_each_prior = labels[i][object_for_each_prior]
+                label_for_each_prior[overlap_for_each_prior < self.threshold] = 0
+                true_classes[i] = label_for_each_prior
+                true_locs[i] = obj_detect_utils.cxcy_to_gcxgcy(
+                                   obj_detect_utils.xy_to_cxcy(boxes[i][object_for_each_prior]),
+                                   self.priors_cxcy)
+
+        return true_locs, true_classes
+
+
+def create_priors():
+    '''
+    Creates priors of two sizes on an 8x8 grid, in center-size coordinates
+    '''
+    centers = (torch.arange(8, dtype=torch.float) + 0.5) / 8
+    cy, cx = torch.meshgrid(centers, centers)
+    priors = [torch.stack((cx.flatten(), cy.flatten(), torch.full((64,), size),
+                           torch.full((64,), size)), dim=1) for size in (0.15, 0.4)]
+    return torch.cat(priors).clamp_(0, 1)
+
+
+def create_objects(n_objects, n_classes):
+    '''
+    Creates random boxes in boundary coordinates and labels
+    '''
+    xy = torch.rand(n_objects, 2) * 0.7
+    wh = 0.05 + torch.rand(n_objects, 2) * 0.25
+    return torch.cat((xy, xy + wh), dim=1), torch.randint(1, n_classes, (n_objects,))
+
+
+def test():
+    '''
+    Main test function
+    '''
+    torch.manual_seed(0)
+    priors_cxcy = create_priors()
+    n_priors = priors_cxcy.size(0)
+    n_classes = 5
+    loss_fn = MultiBoxLoss(priors_cxcy)
+    loop_loss_fn = LoopMultiBoxLoss(priors_cxcy)
+
+    # Two overlapping objects of different sizes that have the same best prior
+    shared_boxes = torch.tensor([[0.25, 0.25, 0.40, 0.40], [0.26, 0.24, 0.38, 0.39]])
+    _, best_priors = obj_detect_utils.find_jaccard_overlap(shared_boxes,
+                                                           loss_fn.priors_xy).max(dim=1)
+    assert best_priors[0] == best_priors[1], 'FAIL!! Shared prior setup'
+
+    print('Testing matching ...', end=' ')
+    for n_objects in [[3, 1, 0, 5], [2, 2], [0, 0], [7]]:
+        boxes, labels = zip(*[create_objects(n, n_classes) for n in n_objects])
+        boxes, labels = list(boxes), list(labels)
+        boxes[0] = torch.cat((boxes[0], shared_boxes))
+        labels[0] = torch.cat((labels[0], torch.tensor([1, 2])))
+
+        true_locs, true_classes = loss_fn.match(boxes, labels)
+        ref_locs, ref_classes = loop_loss_fn.match(boxes, labels)
+        assert torch.equal(true_classes, ref_classes), 'FAIL!! Classes'
+        assert torch.allclose(true_locs, ref_locs), 'FAIL!! Locations'
+        assert true_classes[0, best_priors[0]] == 2, 'FAIL!! Shared prior'
+
+        predicted_locs = torch.randn(len(n_objects), n_priors, 4)
+        predicted_scores = torch.randn(len(n_objects), n_priors, n_classes)
+        loss = loss_fn((predicted_locs, predicted_scores), (boxes, labels))
+        ref_loss = loop_loss_fn((predicted_locs, predicted_scores), (boxes, labels))
+        assert torch.allclose(loss, ref_loss), 'FAIL!! Loss'
+    print('PASS')
+
+    print('\nSUCCESS!!')
+
+
+if __name__ == "__main__":
+    test()
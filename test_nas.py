@@ -10,8 +10,12 @@
 """
 Test routine for Once For All training
 """
+import copy
 import importlib
+import os
 import sys
+import tempfile
+import zlib
 
 import numpy as np
 import torch
@@ -19,10 +23,12 @@ from torch import nn
 
 import ai8x
 import ai8x_nas
+from nas import nas_utils
+from nas.evo_search import EvolutionSearch
 
 sys.path.insert(0, './models')
 
-ofa_net = importlib.import_module('ai85ofanet-sequential')
+ofa_net = importlib.import_module('ai85nasnet-sequential')
 
 
 def create_input_data_2d(num_channels, val=None, dims=(2, 2)):
@@ -107,6 +113,13 @@ def prep_test_model(dims=(32, 32)):
     return model
 
 
+def prep_search_model():
+    """Prepares a small model with batchnorm for the evolutionary search"""
+    return ofa_net.OnceForAll2DSequentialModel(num_classes=4, num_channels=1, dimensions=(8, 8),
+                                               bias=True, n_units=2, depth_list=[2, 2],
+                                               width_list=[16, 32], kernel_list=[3, 3], bn=True)
+
+
 def update_model_params(model, eps=1e-2):
     """Updates model with random values"""
     with torch.no_grad():
@@ -458,8 +471,11 @@ def test_elastic_width_2d():
         with torch.no_grad():
             res_np_full_init = seq_ofa_model(inp).detach().cpu().numpy()
 
+        weights = [p.detach().clone() for p in seq_ofa_model.parameters()]
         ai8x_nas.sample_subnet_width(seq_ofa_model, level=0, sample_depth=False)
         ai8x_nas.reset_width_sampling(seq_ofa_model)
+        for p, w in zip(seq_ofa_model.parameters(), weights):
+            assert torch.equal(p, w), f'FAIL!! Iteration {n}: Weights changed'
 
         seq_ofa_model.eval()
         with torch.no_grad():
@@ -473,6 +489,206 @@ def test_elastic_width_2d():
     print('PASS!\n')
 
 
+def test_weight_cache_2d():
+    """Test cached subnet weights for 2d model"""
+    print('Test Subnet Weight Cache 2d')
+    num_trials = 10
+
+    inp = create_input_data_2d(1, val=None, dims=(32, 32))
+    seq_ofa_model = prep_test_model()
+    seq_ofa_model.eval()
+
+    print('\t\tTest for output value:', end='\t')
+    for n in range(num_trials):
+        ai8x_nas.sample_subnet_width(seq_ofa_model, level=3)
+        for _ in range(2):
+            res_ref = seq_ofa_model(inp).detach()
+            with torch.no_grad():
+                res = seq_ofa_model(inp)
+                res_cached = seq_ofa_model(inp)
+            assert torch.allclose(res, res_ref, atol=1e-6), f'FAIL!! Iteration {n}: ' \
+                                                            f'Uncached output differs'
+            assert torch.equal(res, res_cached), f'FAIL!! Iteration {n}: Cached output differs'
+
+            # The cache must follow in-place updates of the weights
+            with torch.no_grad():
+                for unit in seq_ofa_model.units:
+                    for layer in unit.layers:
+                        layer.op.weight.add_(torch.randn(layer.op.weight.shape) * 1e-2)
+        ai8x_nas.reset_width_sampling(seq_ofa_model)
+
+    print('PASS!\n')
+
+
+def test_calibration_batches():
+    """Test that the calibration set is drawn from the samples of the loader only"""
+    print('Test Calibration Batches')
+    dataset = torch.utils.data.TensorDataset(torch.arange(100), torch.zeros(100))
+    train_indices = list(range(10, 90, 2))
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=4, sampler=torch.utils.data.SubsetRandomSampler(train_indices))
+
+    print('\t\tTest for sampler indices:', end='\t')
+    batches = nas_utils.get_calibration_batches(loader, 5, seed=3)
+    indices = torch.cat(batches).tolist()
+    assert len(batches) == 5 and len(indices) == 20, 'FAIL!! Number of samples'
+    assert len(set(indices)) == 20, 'FAIL!! Duplicate samples'
+    assert set(indices) <= set(train_indices), 'FAIL!! Samples outside of the sampler'
+    assert torch.cat(nas_utils.get_calibration_batches(loader, 5, seed=3)).tolist() == indices, \
+        'FAIL!! Not reproducible'
+
+    # Samplers without an index list, and more batches than samples
+    loader = torch.utils.data.DataLoader(torch.utils.data.Subset(dataset, range(30)),
+                                         batch_size=8, shuffle=True)
+    indices = torch.cat(nas_utils.get_calibration_batches(loader, 10)).tolist()
+    assert sorted(indices) == list(range(30)), 'FAIL!! Random sampler'
+
+    print('PASS!\n')
+
+
+def test_subnet_cache():
+    """Test the architecture keys and the persistent subnet cache"""
+    print('Test Subnet Cache')
+    arch = prep_search_model().get_base_arch()
+
+    print('\t\tTest for architecture keys:', end='\t')
+    key = nas_utils.get_arch_key(arch)
+    reordered = dict(reversed(list(arch.items())))
+    assert nas_utils.get_arch_key(reordered) == key, 'FAIL!! Key depends on the order'
+    assert '"unit": "OnceForAll2DSequentialUnit"' in key, 'FAIL!! Unit class'
+    other_arch = copy.deepcopy(arch)
+    other_arch['width_list'][1][0] = 16
+    assert nas_utils.get_arch_key(other_arch) != key, 'FAIL!! Different archs share a key'
+    print('PASS!')
+
+    print('\t\tTest for saving and loading:', end='\t')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'cache.json')
+        cache = nas_utils.SubnetCache(path, 'model_a:0')
+        assert cache.num_loaded == 0 and cache.get(arch) is None, 'FAIL!! New cache'
+        cache.put(arch, 0.5, 2.)
+        cache.save()
+        assert os.listdir(tmpdir) == ['cache.json'], 'FAIL!! Temporary file'
+
+        cache = nas_utils.SubnetCache(path, 'model_a:0')
+        assert cache.num_loaded == 1 and len(cache) == 1, 'FAIL!! Number of loaded entries'
+        assert cache.get(reordered) == (0.5, 2.), 'FAIL!! Loaded entry'
+        assert cache.get(other_arch) is None, 'FAIL!! Entry of another arch'
+
+        # Other checkpoints or seeds do not see the entries, and both are kept in the file
+        for namespace in ['model_b:0', 'model_a:1']:
+            other = nas_utils.SubnetCache(path, namespace)
+            assert other.num_loaded == 0 and other.get(arch) is None, 'FAIL!! Namespace'
+            other.put(arch, 0.25, 1.)
+            other.save()
+        assert nas_utils.SubnetCache(path, 'model_a:0').get(arch) == (0.5, 2.), \
+            'FAIL!! Entry overwritten by another namespace'
+        assert nas_utils.SubnetCache(path, 'model_b:0').get(arch) == (0.25, 1.), \
+            'FAIL!! Entry of another namespace'
+    print('PASS!\n')
+
+
+def test_cached_search():
+    """Test that the search only evaluates subnets that are not in the cache"""
+    print('Test Cached Search')
+    torch.manual_seed(0)
+    model = prep_search_model()
+    evaluated = []
+    archs = {}
+
+    def get_accuracy(key):
+        return zlib.crc32(key.encode()) / 2**32
+
+    def evaluate_subnet(child_net_arch, *args):  # pylint: disable=unused-argument
+        key = nas_utils.get_arch_key(child_net_arch)
+        evaluated.append(key)
+        archs[key] = child_net_arch
+        return get_accuracy(key), 1.
+
+    def run_search(cache=None):
+        search = EvolutionSearch(population_size=8, num_iter=4, seed=3)
+        search.set_model(model)
+        result = search.run({}, None, None, 'cpu', cache=cache)
+        return search, [(nas_utils.get_arch_key(arch), acc) for arch, acc, _ in result]
+
+    evaluate_subnet_orig = nas_utils.evaluate_subnet
+    nas_utils.evaluate_subnet = evaluate_subnet
+    try:
+        print('\t\tTest for evaluations:', end='\t')
+        search, ref_result = run_search()
+        all_keys = list(evaluated)
+        assert len(set(all_keys)) == len(all_keys), 'FAIL!! Evaluated twice'
+        assert search.num_evaluated == len(all_keys) == len(search.cache), \
+            'FAIL!! Number of evaluations'
+        print('PASS!')
+
+        print('\t\tTest for pre-filled cache:', end='\t')
+        cache = nas_utils.SubnetCache()
+        cached_keys = set(sorted(all_keys)[::2])
+        for key in cached_keys:
+            cache.put(archs[key], get_accuracy(key), 1.)
+        del evaluated[:]
+        search, result = run_search(cache)
+        assert sorted(evaluated) == sorted(set(all_keys) - cached_keys), \
+            'FAIL!! Evaluated cached subnets'
+        assert search.num_evaluated == len(evaluated), 'FAIL!! Number of evaluations'
+        assert result == ref_result, 'FAIL!! Result changed'
+    finally:
+        nas_utils.evaluate_subnet = evaluate_subnet_orig
+    print('PASS!\n')
+
+
+def test_parallel_search():
+    """Test that the search results do not depend on the number of workers"""
+    print('Test Parallel Search')
+    torch.manual_seed(0)
+    model = prep_search_model()
+    dataset = torch.utils.data.TensorDataset(torch.randn(96, 1, 8, 8),
+                                             torch.randint(0, 4, (96,)))
+    train_loader = torch.utils.data.DataLoader(
+        dataset, batch_size=16, sampler=torch.utils.data.SubsetRandomSampler(range(64)))
+    test_loader = torch.utils.data.DataLoader(torch.utils.data.Subset(dataset, range(64, 96)),
+                                              batch_size=16, shuffle=True)
+
+    for num_calib_batches in [0, 2]:
+        print(f'\t\tTest for {num_calib_batches} calibration batches:', end='\t')
+        results = []
+        for num_workers in [0, 2]:
+            search = EvolutionSearch(population_size=6, num_iter=2, num_workers=num_workers,
+                                     seed=5, num_calib_batches=num_calib_batches)
+            search.set_model(model)
+            result = search.run({}, train_loader, test_loader, 'cpu')
+            results.append([(nas_utils.get_arch_key(arch), acc, eff)
+                            for arch, acc, eff in result])
+        assert results[0] == results[1], 'FAIL!! Results depend on the number of workers'
+        print('PASS!')
+
+    print('\t\tTest for duplicate candidates:', end='\t')
+    evaluated = []
+
+    def evaluate_subnet(child_net_arch, *args):  # pylint: disable=unused-argument
+        evaluated.append(nas_utils.get_arch_key(child_net_arch))
+        return 0.5, 1.
+
+    arch = model.get_base_arch()
+    other_arch = dict(arch, depth_list=[1, 2], width_list=[[16], [32, 32]],
+                      kernel_list=[[3], [3, 3]])
+    search = EvolutionSearch()
+    search.set_model(model)
+    search.cache = nas_utils.SubnetCache()
+    evaluate_subnet_orig = nas_utils.evaluate_subnet
+    nas_utils.evaluate_subnet = evaluate_subnet
+    try:
+        result = search.evaluate([arch, other_arch, copy.deepcopy(arch)], None, None, 'cpu')
+        assert len(evaluated) == 2 and search.num_evaluated == 2, 'FAIL!! Evaluated twice'
+        assert [r[1:] for r in result] == [(0.5, 1.)] * 3, 'FAIL!! Results'
+        search.evaluate([other_arch, arch], None, None, 'cpu')
+        assert len(evaluated) == 2, 'FAIL!! Cached subnet evaluated'
+    finally:
+        nas_utils.evaluate_subnet = evaluate_subnet_orig
+    print('PASS!\n')
+
+
 def test():
     """Test routine for nas implementation"""
     ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
@@ -483,6 +699,11 @@ def test():
     test_elastic_depth_2d()
     test_elastic_depth_1d()
     test_elastic_width_2d()
+    test_weight_cache_2d()
+    test_calibration_batches()
+    test_subnet_cache()
+    test_cached_search()
+    test_parallel_search()
 
 
 if __name__ == "__main__":
@@ -11,6 +11,7 @@
 Test routine for QAT
 """
 import copy
+import math
 
 import torch
 
@@ -136,5 +137,76 @@ def test():
     print('\nSUCCESS!!')
 
 
+def test_frozen_cache():
+    '''
+    Test that the cached quantized parameters used in frozen inference match the
+    uncached computation and that they are rebuilt when the weights change
+    '''
+    inp, _ = create_input_data(64)
+    fp_layer = create_conv2d_layer(64, 16, 3, False, 'ReLU')
+    q_layer = quantize_fp_layer(fp_layer, False, 'ReLU', 8)
+    q_layer.eval()
+
+    ref_out = q_layer(inp).detach()
+    assert q_layer.frozen_cache is None, 'FAIL!! Cache filled outside frozen mode'
+
+    with torch.no_grad():
+        cached_out = q_layer(inp)
+        assert q_layer.frozen_cache is not None, 'FAIL!! Cache not filled in frozen mode'
+        assert (cached_out == q_layer(inp)).all(), 'FAIL!!'
+    assert (ref_out == cached_out).all(), 'FAIL!!'
+
+    with torch.no_grad():
+        q_layer.op.weight.mul_(0.5)
+        ref_out = q_layer(inp)
+        q_layer.frozen_cache = None
+        assert (ref_out == q_layer(inp)).all(), 'FAIL!! Stale cache after weight update'
+
+        q_layer.load_state_dict(quantize_fp_layer(fp_layer, False, 'ReLU', 8).state_dict())
+        ref_out = q_layer(inp)
+        q_layer.frozen_cache = None
+        assert (ref_out == q_layer(inp)).all(), 'FAIL!! Stale cache after load_state_dict'
+
+    print('Frozen cache: PASS')
+
+
+def test_output_shift():
+    '''
+    Test that the output shift matches the quantile of the concatenated weight and bias,
+    computed with `torch.quantile()`
+    '''
+    def reference(weight, bias, quantile):
+        params = torch.cat((weight.flatten(), bias.flatten())).abs()
+        limit = torch.quantile(params, quantile)
+        upper = params.sort()[0][math.ceil(quantile * (params.numel() - 1))]
+        return [-(1./x).log2().floor().clamp(min=-15., max=15.) for x in (limit, upper)]
+
+    torch.manual_seed(0)
+    output_shift = torch.zeros(1)
+    for scale, bias_scale in [(1., 1.), (0.01, 0.5), (3., 0.1), (0.1, 200.)]:
+        weight = scale * (2. * torch.rand(16, 8, 3, 3) - 1.)
+        bias = bias_scale * (2. * torch.rand(16) - 1.)
+        if bias_scale > 1.:
+            bias[3] = 1.5 * bias_scale  # larger than every weight
+        for quantile in [1.0, 0.999, 0.99, 0.9, 0.5]:
+            exact, upper = reference(weight, bias, quantile)
+            shift = ai8x.OutputShift(quantile).eval()(weight, output_shift, bias)
+            if quantile == 1.0:
+                assert shift == exact, 'FAIL!! Maximum'
+            else:
+                # An interpolated quantile may be approximated by the next larger parameter
+                assert exact <= shift <= upper, 'FAIL!! Quantile'
+
+    calc_out_shift = ai8x.OutputShift(1.0, shift_interval=2).train()
+    first = calc_out_shift(weight, output_shift, bias)
+    assert first != output_shift, 'FAIL!! Shift'
+    assert calc_out_shift(weight, output_shift, bias) == output_shift, 'FAIL!! Interval'
+    assert calc_out_shift(weight, output_shift, bias) == first, 'FAIL!! Refresh'
+
+    print('Output shift: PASS')
+
+
 if __name__ == "__main__":
     test()
+    test_frozen_cache()
+    test_output_shift()
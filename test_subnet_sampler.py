@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for the constraint-aware NAS sub network sampler
+"""
+import importlib
+import itertools
+import random
+
+import ai8x
+from nas.subnet_sampler import SubnetSampler
+
+nasnet = importlib.import_module('models.ai85nasnet-sequential')
+
+
+def count_feasible(model_cls, base_arch, constraint):
+    """Counts the sub networks that meet `constraint` by enumerating the search space"""
+    sampler = SubnetSampler(model_cls, base_arch, {})
+    units = []
+    for u_ind, max_depth in enumerate(base_arch['depth_list']):
+        units.append([])
+        for depth in range(1, max_depth + 1):
+            layer_opts = [sampler.layer_options(u_ind, l_ind, depth)[1] for l_ind in range(depth)]
+            units[u_ind] += list(itertools.product(*layer_opts))
+
+    count = 0
+    for layers in itertools.product(*units):
+        arch = dict(base_arch, depth_list=[len(unit) for unit in layers],
+                    width_list=[[w for w, _ in unit] for unit in layers],
+                    kernel_list=[[k for _, k in unit] for unit in layers])
+        if meets_constraint(model_cls, arch, constraint):
+            count += 1
+    return count
+
+
+def meets_constraint(model_cls, arch, constraint):
+    """Checks the number of weights and width constraints"""
+    num_weights = model_cls.get_num_weights(arch)
+    if num_weights > constraint.get('max_num_weights', num_weights) or \
+       num_weights < constraint.get('min_num_weights', num_weights):
+        return False
+    if 'width_options' in constraint:
+        return all(w in constraint['width_options'] for w in model_cls.get_unique_widths(arch))
+    return True
+
+
+def test():
+    '''
+    Main test function
+    '''
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+    random.seed(0)
+
+    model_cls = nasnet.OnceForAll2DSequentialModel
+    small_arch = {'num_classes': 10, 'num_channels': 3, 'dimensions': (16, 16), 'bias': True,
+                  'n_units': 3, 'bn': False, 'unit': nasnet.OnceForAll2DSequentialUnit,
+                  'depth_list': [2, 2, 1], 'width_list': [[32, 32], [64, 64], [64]],
+                  'kernel_list': [[3, 3], [3, 3], [3]]}
+    full_weights = model_cls.get_num_weights(small_arch)
+
+    print('Testing feasible space size ...', end=' ')
+    for constraint in [{}, {'max_num_weights': full_weights // 2},
+                       {'min_num_weights': full_weights // 3},
+                       {'min_num_weights': full_weights // 4,
+                        'max_num_weights': full_weights // 2, 'width_options': [16, 32, 64]},
+                       {'max_num_weights': 1}]:
+        sampler = SubnetSampler(model_cls, small_arch, constraint)
+        assert round(sampler.num_feasible) == count_feasible(model_cls, small_arch, constraint), \
+            f'FAIL!! {constraint}'
+    print('PASS')
+
+    print('Testing samples ...', end=' ')
+    model = nasnet.ai85nasnet_sequential_cifar100(num_classes=100, num_channels=3,
+                                                  dimensions=(32, 32), bias=True)
+    base_arch = model.get_base_arch()
+    constraint = {'min_num_weights': 300000, 'max_num_weights': 320000,
+                  'width_options': [32, 64, 128]}
+    sampler = SubnetSampler(model_cls, base_arch, constraint)
+    assert sampler.num_feasible > 0, 'FAIL!! Feasible space'
+    parents = [sampler.sample() for _ in range(20)]
+    for arch in parents:
+        assert meets_constraint(model_cls, arch, constraint), 'FAIL!! Sample'
+    for _ in range(100):
+        arch1, arch2 = random.sample(parents, 2)
+        assert meets_constraint(model_cls, sampler.mutate(arch1, 0.2), constraint), \
+            'FAIL!! Mutation'
+        assert meets_constraint(model_cls, sampler.crossover(arch1, arch2), constraint), \
+            'FAIL!! Crossover'
+    print('PASS')
+
+    print('\nSUCCESS!!')
+
+
+if __name__ == "__main__":
+    test()
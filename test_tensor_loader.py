@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2022 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for the batch-level tensor loader
+"""
+import tempfile
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, SequentialSampler, SubsetRandomSampler
+
+from datasets import afsk, memmap, tensor_loader
+from datasets.kws20 import KWS
+from datasets.msnoise import MSnoise
+
+
+class ByteDataset:
+    """
+    Dataset of uint8 rows that are converted to [0, 1) like the KWS datasets
+    """
+    def __init__(self, num_samples=50):
+        self.data = torch.randint(0, 256, (num_samples, 4, 8), dtype=torch.uint8)
+        self.targets = torch.randint(0, 10, (num_samples, 1))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.data[index].type(torch.FloatTensor) / 256, int(self.targets[index])
+
+    def tensors(self):
+        """Return the data and the targets"""
+        return self.data, self.targets.reshape(-1).long()
+
+    def transform_batch(self, inp):
+        """Convert a batch like `__getitem__()`"""
+        return inp.type(torch.FloatTensor) / 256
+
+
+def check_batches(dataset, exact=True):
+    '''
+    Checks that `transform_batch()` of rows of `tensors()` matches the stacked samples
+    '''
+    data, targets = dataset.tensors()
+    assert len(data) == len(targets) == len(dataset), 'FAIL!! Length'
+    idx = torch.randperm(len(dataset))[:16]
+    inputs = dataset.transform_batch(data[idx])
+    ref_inputs, ref_targets = zip(*[dataset[int(i)] for i in idx])
+    ref_inputs = torch.stack(ref_inputs)
+    assert inputs.dtype == ref_inputs.dtype and inputs.shape == ref_inputs.shape, \
+        'FAIL!! Shape'
+    if exact:
+        assert torch.equal(inputs, ref_inputs), 'FAIL!! Inputs'
+    else:
+        assert torch.allclose(inputs, ref_inputs), 'FAIL!! Inputs'
+    assert targets[idx].tolist() == list(ref_targets), 'FAIL!! Targets'
+
+
+def create_audio_dataset(cls, folder, quantized, transform=None):
+    '''
+    Creates a memory-mapped audio dataset of class `cls` without downloading or processing
+    '''
+    if quantized:
+        data = np.random.randint(0, 256, (40, 8, 16)).astype(np.uint8)
+    else:
+        data = np.random.randn(40, 8, 16).astype(np.float32)
+    data_file = f'{cls.__name__}_{quantized}.npy'
+    memmap.save(folder, data_file, data, np.random.randint(0, 10, (40, 1)), np.zeros((40, 1)))
+    dataset = cls.__new__(cls)
+    dataset.data, dataset.targets, _ = memmap.load(folder, data_file)
+    # Like the class filter, select a subset of the samples
+    dataset.data = dataset.data[torch.arange(0, 40, 2)]
+    dataset.targets = dataset.targets[torch.arange(0, 40, 2)]
+    dataset.transform = transform
+    if cls is MSnoise:
+        dataset.quantize = quantized
+    else:
+        dataset.save_unquantized = not quantized
+    return dataset
+
+
+def create_afsk_dataset(transform=None):
+    '''
+    Creates an AFSK dataset without reading files, including a sample with a constant value
+    '''
+    dataset = afsk.AFSK.__new__(afsk.AFSK)
+    dataset.avail = 20
+    dataset.data = np.random.randint(0, 256, dataset.avail * afsk.BYTES_PER_SAMPLE) \
+        .astype(np.uint8)
+    dataset.data[:afsk.BYTES_PER_SAMPLE] = 7
+    dataset.transform = transform
+    return dataset
+
+
+def test():
+    '''
+    Main test function
+    '''
+    torch.manual_seed(0)
+    dataset = ByteDataset()
+
+    print('Testing batches ...', end=' ')
+    for drop_last in [False, True]:
+        loader = DataLoader(dataset, batch_size=16, sampler=SequentialSampler(dataset),
+                            drop_last=drop_last)
+        wrapped, = tensor_loader.wrap(loader)
+        assert isinstance(wrapped, tensor_loader.TensorLoader), 'FAIL!! Wrap'
+        assert len(wrapped) == len(loader), 'FAIL!! Length'
+        batches = list(wrapped)
+        assert len(batches) == len(loader), 'FAIL!! Number of batches'
+        for (inputs, targets), (ref_inputs, ref_targets) in zip(batches, loader):
+            assert torch.equal(inputs, ref_inputs), 'FAIL!! Inputs'
+            assert torch.equal(targets, ref_targets), 'FAIL!! Targets'
+    print('PASS')
+
+    print('Testing split ...', end=' ')
+    train_loader = DataLoader(dataset, batch_size=8, sampler=SubsetRandomSampler(range(40)))
+    val_loader = DataLoader(dataset, batch_size=8, sampler=SubsetRandomSampler(range(40, 50)))
+    train_loader, val_loader, none_loader = tensor_loader.wrap(train_loader, val_loader, None)
+    assert train_loader.data is val_loader.data and none_loader is None, 'FAIL!! Shared data'
+    for loader, expected in [(train_loader, 40), (val_loader, 10)]:
+        for _ in range(2):
+            assert sum(len(targets) for _, targets in loader) == expected, 'FAIL!! Epoch size'
+    print('PASS')
+
+    print('Testing datasets ...', end=' ')
+    with tempfile.TemporaryDirectory() as folder:
+        for cls in [KWS, MSnoise]:
+            for quantized in [True, False]:
+                for transform in [None, lambda x: x * 2 - 1]:
+                    check_batches(create_audio_dataset(cls, folder, quantized, transform))
+    for transform in [None, lambda x: x * 2 - 1]:
+        check_batches(create_afsk_dataset(transform), exact=False)
+    print('PASS')
+
+    print('\nSUCCESS!!')
+
+
+if __name__ == "__main__":
+    test()
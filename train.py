@@ -107,13 +107,18 @@ from distiller.quantization.range_linear import PostTrainLinearQuantizer
 
 # pylint: enable=no-name-in-module
 import ai8x
+import ai8x_cost
+import ai8x_int
 import ai8x_nas
+import checkpointer
 import datasets
+import meters
 import nnplot
 import parse_qat_yaml
 import parsecmd
 import sample
-from nas import parse_nas_yaml
+from datasets import batch_augment, tensor_loader
+from nas import nas_utils, parse_nas_yaml
 
 # from range_linear_ai84 import PostTrainLinearQuantizerAI84
 
@@ -219,6 +224,11 @@ def main():
         # https://discuss.pytorch.org/t/what-does-torch-backends-cudnn-benchmark-do/5936/3
         cudnn.benchmark = True
 
+    if args.integer_inference:
+        # The integer engine relies on exact float32 sums, which cuDNN (Winograd, FFT and
+        # TF32 algorithms) does not guarantee
+        args.cpu = True
+
     if args.cpu or not torch.cuda.is_available():
         if not args.cpu:
             # Print warning if no hardware acceleration
@@ -372,7 +382,7 @@ def main():
     # This sample application can be invoked to produce various summary reports.
     if args.summary:
         return summarize_model(model, args.dataset, which_summary=args.summary,
-                               filename=args.summary_filename)
+                               filename=args.summary_filename, dimensions=args.dimensions)
 
     activations_collectors = create_activation_stats_collectors(model, *args.activation_stats)
 
@@ -391,6 +401,11 @@ def main():
         args.datasets_fn, (os.path.expanduser(args.data), args), args.batch_size,
         args.workers, args.validation_split, args.deterministic,
         args.effective_train_size, args.effective_valid_size, args.effective_test_size)
+    train_loader, val_loader, test_loader = \
+        batch_augment.attach(train_loader, val_loader, test_loader)
+    if args.tensor_loader:
+        train_loader, val_loader, test_loader = \
+            tensor_loader.wrap(train_loader, val_loader, test_loader)
     msglogger.info('Dataset sizes:\n\ttraining=%d\n\tvalidation=%d\n\ttest=%d',
                    len(train_loader.sampler), len(val_loader.sampler), len(test_loader.sampler))
 
@@ -399,6 +414,12 @@ def main():
                                   args.sensitivity_range[2])
         return sensitivity_analysis(model, criterion, test_loader, pylogger, args, sensitivities)
 
+    if args.integer_inference:
+        if not args.evaluate or not args.act_mode_8bit:
+            raise ValueError('ERROR: Argument --integer-inference requires --evaluate and '
+                             '--8-bit-mode')
+        model = ai8x_int.convert(model)
+
     if args.evaluate:
         return evaluate_model(model, criterion, test_loader, pylogger, activations_collectors,
                               args, compression_scheduler)
@@ -460,6 +481,8 @@ def main():
         if nas_policy:
             args.nas_stage_transition_list = create_nas_training_stage_list(model, nas_policy)
             # pylint: disable=unsubscriptable-object
+            ai8x_nas.set_sort_interval(model,
+                                       nas_policy['elastic_width'].get('sort_interval', 1))
             args.nas_kd_params = nas_policy['kd_params'] \
                 if nas_policy and 'kd_params' in nas_policy else None
             # pylint: enable=unsubscriptable-object
@@ -474,6 +497,9 @@ def main():
                                                               args.epochs)
                 create_nas_kd_policy(model, compression_scheduler, start_epoch, kd_end_epoch, args)
 
+    checkpoint_writer = checkpointer.CheckpointWriter(keep_last=args.keep_last,
+                                                      keep_best=args.keep_best)
+
     vloss = 10**6
     for epoch in range(start_epoch, ending_epoch):
         # pylint: disable=unsubscriptable-object
@@ -555,18 +581,23 @@ def main():
                 checkpoint_extras = {'current_top1': top1,
                                      'best_top1': perf_scores_history[0].top1,
                                      'best_epoch': perf_scores_history[0].epoch}
+                ranking = [score.epoch for score in perf_scores_history]
             else:
                 is_best = False
                 checkpoint_extras = {'current_top1': top1}
+                ranking = None
 
-            apputils.save_checkpoint(epoch, args.cnn, model, optimizer=optimizer,
-                                     scheduler=compression_scheduler, extras=checkpoint_extras,
-                                     is_best=is_best, name=checkpoint_name,
-                                     dir=msglogger.logdir)
+            checkpoint_writer.save(epoch, args.cnn, model, optimizer=optimizer,
+                                   scheduler=compression_scheduler, extras=checkpoint_extras,
+                                   is_best=is_best, name=checkpoint_name, dir=msglogger.logdir,
+                                   ranking=ranking)
 
         if compression_scheduler:
             compression_scheduler.on_epoch_end(epoch, optimizer)
 
+    # Wait for the last checkpoints (the writer is also flushed at exit after an exception)
+    checkpoint_writer.close()
+
     # Finally run results on the test set
     test(test_loader, model, criterion, [pylogger], activations_collectors, args=args)
     return None
@@ -656,13 +687,13 @@ def create_nas_kd_policy(model, compression_scheduler, epoch, next_state_start_e
 def train(train_loader, model, criterion, optimizer, epoch,
           compression_scheduler, loggers, args):
     """Training loop for one epoch."""
-    losses = OrderedDict([(OVERALL_LOSS_KEY, tnt.AverageValueMeter()),
-                          (OBJECTIVE_LOSS_KEY, tnt.AverageValueMeter())])
+    losses = OrderedDict([(OVERALL_LOSS_KEY, meters.AverageValueMeter()),
+                          (OBJECTIVE_LOSS_KEY, meters.AverageValueMeter())])
 
     if not args.regression:
-        classerr = tnt.ClassErrorMeter(accuracy=True, topk=(1, min(args.num_classes, 5)))
+        classerr = meters.ClassErrorMeter(accuracy=True, topk=(1, min(args.num_classes, 5)))
     else:
-        classerr = tnt.MSEMeter()
+        classerr = meters.MSEMeter()
     batch_time = tnt.AverageValueMeter()
     data_time = tnt.AverageValueMeter()
 
@@ -744,15 +775,13 @@ def train(train_loader, model, criterion, optimizer, epoch,
                 else:
                     classerr.add(output.data.permute(0, 2, 3, 1).flatten(start_dim=0, end_dim=2),
                                  target.flatten())
-                if not args.regression:
-                    acc_stats.append([classerr.value(1), classerr.value(min(args.num_classes, 5))])
-                else:
-                    acc_stats.append([classerr.value()])
+                # The accuracy is read from the snapshots at the end of the epoch
+                acc_stats.append(classerr.snapshot())
         else:
             # Measure accuracy and record loss
             loss = earlyexit_loss(output, target, criterion, args)
         # Record loss
-        losses[OBJECTIVE_LOSS_KEY].add(loss.item())
+        losses[OBJECTIVE_LOSS_KEY].add(loss)
 
         if compression_scheduler:
             # Before running the backward phase, we allow the scheduler to modify the loss
@@ -762,14 +791,14 @@ def train(train_loader, model, criterion, optimizer, epoch,
                                                                   optimizer=optimizer,
                                                                   return_loss_components=True)
             loss = agg_loss.overall_loss
-            losses[OVERALL_LOSS_KEY].add(loss.item())
+            losses[OVERALL_LOSS_KEY].add(loss)
 
             for lc in agg_loss.loss_components:
                 if lc.name not in losses:
-                    losses[lc.name] = tnt.AverageValueMeter()
-                losses[lc.name].add(lc.value.item())
+                    losses[lc.name] = meters.AverageValueMeter()
+                losses[lc.name].add(lc.value)
         else:
-            losses[OVERALL_LOSS_KEY].add(loss.item())
+            losses[OVERALL_LOSS_KEY].add(loss)
 
         # Compute the gradient and do SGD step
         optimizer.zero_grad()
@@ -840,11 +869,25 @@ def train(train_loader, model, criterion, optimizer, epoch,
                                             steps_per_epoch, args.print_freq,
                                             loggers)
         end = time.time()
-    return acc_stats
+
+    if not args.regression:
+        return [[snap.value(1), snap.value(min(args.num_classes, 5))] for snap in acc_stats]
+    return [[snap.value()] for snap in acc_stats]
 
 
 def update_bn_stats(train_loader, model, args):
-    """Routine to update BatchNorm statistics"""
+    """
+    Routine to update BatchNorm statistics. With `--nas-calib-batches`, the statistics are
+    re-estimated on a calibration set that is drawn from the training set once.
+    """
+    if args.nas_calib_batches > 0:
+        if getattr(args, 'nas_calib_set', None) is None:
+            args.nas_calib_set = [inputs.to(args.device) for inputs in
+                                  nas_utils.get_calibration_batches(train_loader,
+                                                                    args.nas_calib_batches)]
+        nas_utils.recalibrate_bn(model, args.nas_calib_set, args.device)
+        return
+
     model.train()
     for (inputs, target) in train_loader:
         inputs, target = inputs.to(args.device), target.to(args.device)
@@ -924,11 +967,11 @@ def test(test_loader, model, criterion, loggers, activations_collectors, args):
 
 def _validate(data_loader, model, criterion, loggers, args, epoch=-1, tflogger=None):
     """Execute the validation/test loop."""
-    losses = {'objective_loss': tnt.AverageValueMeter()}
+    losses = {'objective_loss': meters.AverageValueMeter()}
     if not args.regression:
-        classerr = tnt.ClassErrorMeter(accuracy=True, topk=(1, min(args.num_classes, 5)))
+        classerr = meters.ClassErrorMeter(accuracy=True, topk=(1, min(args.num_classes, 5)))
     else:
-        classerr = tnt.MSEMeter()
+        classerr = meters.MSEMeter()
 
     def save_tensor(t, f, regression=True):
         """ Save tensor `t` to file handle `f` in CSV format """
@@ -971,7 +1014,7 @@ def _validate(data_loader, model, criterion, loggers, args, epoch=-1, tflogger=N
     total_samples = len(data_loader.sampler)
     batch_size = data_loader.batch_size
     if args.display_confusion:
-        confusion = tnt.ConfusionMeter(args.num_classes)
+        confusion = meters.ConfusionMeter(args.num_classes)
     total_steps = (total_samples + batch_size - 1) // batch_size
     msglogger.info('%d samples (%d per mini-batch)', total_samples, batch_size)
 
@@ -1007,7 +1050,7 @@ def _validate(data_loader, model, criterion, loggers, args, epoch=-1, tflogger=N
                 # compute loss
                 loss = criterion(output, target)
                 # measure accuracy and record loss
-                losses['objective_loss'].add(loss.item())
+                losses['objective_loss'].add(loss)
                 if len(output.data.shape) <= 2:
                     classerr.add(output.data, target)
                 else:
@@ -1343,9 +1386,15 @@ def evaluate_model(model, criterion, test_loader, loggers, activations_collector
                                  dir=msglogger.logdir, extras={'quantized_top1': top1})
 
 
-def summarize_model(model, dataset, which_summary, filename='model'):
+def summarize_model(model, dataset, which_summary, filename='model', dimensions=None):
     """summarize_model"""
-    if which_summary.startswith('png'):
+    if which_summary == 'hardware':
+        # 1D models take (channels, length) inputs
+        if len(dimensions) == 3 and dimensions[2] == 1:
+            dimensions = dimensions[:2]
+        costs, totals = ai8x_cost.estimate(ai8x_cost.layers_from_model(model, dimensions))
+        msglogger.info(ai8x_cost.summary(costs, totals))
+    elif which_summary.startswith('png'):
         model_summaries.draw_img_classifier_to_file(model, filename + '.png', dataset,
                                                     which_summary == 'png_w_params')
     elif which_summary in ['onnx', 'onnx_simplified']:
@@ -1388,6 +1437,9 @@ def automated_deep_compression(model, criterion, _optimizer, loggers, args):
         args.datasets_fn, (os.path.expanduser(args.data), args), args.batch_size,
         args.workers, args.validation_split, args.deterministic,
         args.effective_train_size, args.effective_valid_size, args.effective_test_size)
+    train_loader, test_loader = batch_augment.attach(train_loader, test_loader)
+    if args.tensor_loader:
+        train_loader, test_loader = tensor_loader.wrap(train_loader, test_loader)
 
     args.display_confusion = True
     validate_fn = partial(test, test_loader=test_loader, criterion=criterion,
@@ -1407,6 +1459,9 @@ def greedy(model, criterion, _optimizer, loggers, args):
         args.datasets_fn, (os.path.expanduser(args.data), args), args.batch_size,
         args.workers, args.validation_split, args.deterministic,
         args.effective_train_size, args.effective_valid_size, args.effective_test_size)
+    train_loader, test_loader = batch_augment.attach(train_loader, test_loader)
+    if args.tensor_loader:
+        train_loader, test_loader = tensor_loader.wrap(train_loader, test_loader)
 
     test_fn = partial(test, test_loader=test_loader, criterion=criterion,
                       loggers=loggers, args=args, activations_collectors=None)
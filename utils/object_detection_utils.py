@@ -40,146 +40,176 @@ def calculate_mAP(det_boxes, det_labels, det_scores, true_boxes, true_labels, tr
     difficulty (0 or 1)
     :return: list of average precisions for all classes, mean average precision (mAP)
     """
-    # these are all lists of tensors of the same length, i.e. number of images
-    assert len(det_boxes) == len(det_labels) == len(det_scores) == len(true_boxes) == \
-           len(true_labels) == len(true_difficulties)
-
-    # Store all (true) objects in a single continuous tensor while keeping track of the image
-    # it is from
-    true_images = []
-    for i, true_label in enumerate(true_labels):
-        true_images.extend([i] * true_label.size(0))
-    # (n_objects), n_objects is the total no. of objects across all images
-    true_images = torch.LongTensor(true_images)
-    true_boxes = torch.cat(true_boxes, dim=0)  # (n_objects, 4)
-    true_labels = torch.cat(true_labels, dim=0)  # (n_objects)
-    true_difficulties = torch.cat(true_difficulties, dim=0)  # (n_objects)
-
-    assert true_images.size(0) == true_boxes.size(0) == true_labels.size(0)
-
-    labels = np.unique(true_labels.cpu().detach().numpy())
-    # Add background label: 0
-    labels = np.append(labels, 0)
-
-    n_classes = len(labels)
-
-    # Store all detections in a single continuous tensor while keeping track of the image
-    # it is from
-    det_images = []
-    for i, det_label in enumerate(det_labels):
-        det_images.extend([i] * det_label.size(0))
-    det_images = torch.LongTensor(det_images)  # (n_detections)
-    det_boxes = torch.cat(det_boxes, dim=0)  # (n_detections, 4)
-    det_labels = torch.cat(det_labels, dim=0)  # (n_detections)
-    det_scores = torch.cat(det_scores, dim=0)  # (n_detections)
-
-    assert det_images.size(0) == det_boxes.size(0) == det_labels.size(0) == det_scores.size(0)
-
-    # Calculate APs for each class (except background)
-    average_precisions = torch.zeros((n_classes - 1), dtype=torch.float)  # (n_classes - 1)
-    for c in range(1, n_classes):
-        # Extract only objects with this class
-        true_class_images = true_images[true_labels == c]  # (n_class_objects)
-        true_class_boxes = true_boxes[true_labels == c]  # (n_class_objects, 4)
-        true_class_difficulties = true_difficulties[true_labels == c]  # (n_class_objects)
-        n_easy_class_objects = (1 - true_class_difficulties).sum().item()
-        # ignore difficult objects
-
-        # Keep track of which true objects with this class have already been 'detected'
-        # So far, none
-        true_class_boxes_detected =  \
-            torch.zeros((true_class_difficulties.size(0)), dtype=torch.uint8)
-        # (n_class_objects)
-
-        # Extract only detections with this class
-        det_class_images = det_images[det_labels == c]  # (n_class_detections)
-        det_class_boxes = det_boxes[det_labels == c]  # (n_class_detections, 4)
-        det_class_scores = det_scores[det_labels == c]  # (n_class_detections)
-        n_class_detections = det_class_boxes.size(0)
-        if n_class_detections == 0:
-            continue
-
-        # Sort detections in decreasing order of confidence/scores
-        det_class_scores, sort_ind = torch.sort(det_class_scores, dim=0, descending=True)
-        # (n_class_detections)
-        det_class_images = det_class_images[sort_ind]  # (n_class_detections)
-        det_class_boxes = det_class_boxes[sort_ind]  # (n_class_detections, 4)
-
-        # In the order of decreasing scores, check if true or false positive
-        true_positives = torch.zeros((n_class_detections), dtype=torch.float)
-        # (n_class_detections)
-        false_positives = torch.zeros((n_class_detections), dtype=torch.float)
-        # (n_class_detections)
-
-        for d in range(n_class_detections):
-            this_detection_box = det_class_boxes[d].unsqueeze(0)  # (1, 4)
-            this_image = det_class_images[d]  # (), scalar
-
-            # Find objects in the same image with this class, their difficulties, and whether they
-            # have been detected
-            object_boxes = true_class_boxes[true_class_images == this_image]
-            # (n_class_objects_in_img)
-            object_difficulties = true_class_difficulties[true_class_images == this_image]
-            # (n_class_objects_in_img)
-            # If no such object in this image, then the detection is a false positive
-            if object_boxes.size(0) == 0:
-                false_positives[d] = 1
+    accumulator = MeanAPAccumulator()
+    accumulator.add(det_boxes, det_labels, det_scores, true_boxes, true_labels, true_difficulties)
+    return accumulator.compute()
+
+
+class MeanAPAccumulator:
+    """
+    Streaming calculation of the Mean Average Precision (mAP) of detected objects. Feed the
+    detections and the ground truth of each batch of images to `add()`, and call `compute()`
+    at the end.
+
+    Each detection is matched to the object of its class in the same image that it overlaps
+    most. It is a true positive if the overlap is greater than `iou_threshold` and if no
+    detection with a higher score matched the same object first, and it is ignored if the
+    object is 'difficult'. Since matches never cross images, each batch is resolved in `add()`
+    and only the label, score and outcome of each detection is kept.
+    """
+    IGNORED = -1
+    FALSE_POSITIVE = 0
+    TRUE_POSITIVE = 1
+
+    def __init__(self, iou_threshold=0.5):
+        self.iou_threshold = iou_threshold
+        self.labels = []
+        self.scores = []
+        self.outcomes = []
+        self.true_label_set = np.zeros((0), dtype=np.int64)
+        self.n_easy_objects = np.zeros((0), dtype=np.int64)
+
+    def add(self, det_boxes, det_labels, det_scores, true_boxes, true_labels, true_difficulties):
+        """
+        Add the detections and the ground truth of a batch of images. The arguments are lists
+        with one tensor for each image, as in `calculate_mAP()`.
+        """
+        assert len(det_boxes) == len(det_labels) == len(det_scores) == len(true_boxes) == \
+               len(true_labels) == len(true_difficulties)
+        if len(det_boxes) == 0:
+            return
+
+        true_images = np.repeat(np.arange(len(true_labels)), [t.size(0) for t in true_labels])
+        true_boxes = torch.cat(true_boxes, dim=0).cpu().detach().view(-1, 4)  # (n_objects, 4)
+        true_labels = torch.cat(true_labels, dim=0).cpu().detach().numpy().astype(np.int64)
+        true_difficulties = torch.cat(true_difficulties, dim=0).cpu().detach().numpy()
+        assert true_images.shape[0] == true_boxes.size(0) == true_labels.shape[0]
+
+        det_images = np.repeat(np.arange(len(det_labels)), [d.size(0) for d in det_labels])
+        det_boxes = torch.cat(det_boxes, dim=0).cpu().detach().view(-1, 4)  # (n_detections, 4)
+        det_labels = torch.cat(det_labels, dim=0).cpu().detach().numpy().astype(np.int64)
+        det_scores = torch.cat(det_scores, dim=0).cpu().detach().numpy()
+        assert det_images.shape[0] == det_boxes.size(0) == det_labels.shape[0] == \
+               det_scores.shape[0]
+
+        self.true_label_set = np.union1d(self.true_label_set, true_labels)
+        n_easy_objects = np.bincount(true_labels[true_difficulties == 0],
+                                     minlength=self.n_easy_objects.shape[0])
+        n_easy_objects[:self.n_easy_objects.shape[0]] += self.n_easy_objects
+        self.n_easy_objects = n_easy_objects
+
+        self.labels.append(det_labels)
+        self.scores.append(det_scores)
+        self.outcomes.append(self._match(det_images, det_boxes, det_labels, det_scores,
+                                         true_images, true_boxes, true_labels,
+                                         true_difficulties))
+
+    def _match(self, det_images, det_boxes, det_labels, det_scores,
+               true_images, true_boxes, true_labels, true_difficulties):
+        """
+        Return the outcome of each detection of a batch.
+        """
+        n_detections = det_labels.shape[0]
+        outcomes = np.full((n_detections), self.FALSE_POSITIVE, dtype=np.int8)
+        if n_detections == 0 or true_labels.shape[0] == 0:
+            return outcomes
+
+        # Group the objects by image and class, keeping their order within each group
+        n_labels = max(det_labels.max(), true_labels.max()) + 1
+        true_groups = true_images * n_labels + true_labels
+        true_order = np.argsort(true_groups, kind='stable')
+        true_groups = true_groups[true_order]
+
+        # Pair each detection with all objects of its group
+        det_groups = det_images * n_labels + det_labels
+        group_start = np.searchsorted(true_groups, det_groups, side='left')
+        n_candidates = np.searchsorted(true_groups, det_groups, side='right') - group_start
+        n_pairs = n_candidates.sum()
+        if n_pairs == 0:
+            return outcomes
+        pair_start = np.cumsum(n_candidates) - n_candidates
+        pair_det = np.repeat(np.arange(n_detections), n_candidates)
+        pair_obj = true_order[np.arange(n_pairs) - pair_start[pair_det] + group_start[pair_det]]
+
+        overlaps = find_paired_jaccard_overlap(det_boxes[torch.from_numpy(pair_det)],
+                                               true_boxes[torch.from_numpy(pair_obj)]).numpy()
+
+        # Find the object with the maximum overlap (the first one on ties) for each detection
+        has_candidates = n_candidates > 0
+        max_overlap = np.full((n_detections), -1., dtype=overlaps.dtype)
+        max_overlap[has_candidates] = np.maximum.reduceat(overlaps,
+                                                          pair_start[has_candidates])
+        best_pairs = np.flatnonzero(overlaps == max_overlap[pair_det])
+        _, first = np.unique(pair_det[best_pairs], return_index=True)
+        best_obj = np.full((n_detections), -1, dtype=np.int64)
+        best_obj[pair_det[best_pairs[first]]] = pair_obj[best_pairs[first]]
+
+        # Matches of 'difficult' objects are ignored
+        matched = max_overlap > self.iou_threshold
+        outcomes[matched & (true_difficulties[best_obj] != 0)] = self.IGNORED
+
+        # Of the detections that match the same easy object, the one with the highest score is
+        # the true positive, and the others are false positives
+        matched = np.flatnonzero(matched & (true_difficulties[best_obj] == 0))
+        matched = matched[np.lexsort((-det_scores[matched], best_obj[matched]))]
+        first = np.ones((matched.shape[0]), dtype=bool)
+        first[1:] = best_obj[matched[1:]] != best_obj[matched[:-1]]
+        outcomes[matched[first]] = self.TRUE_POSITIVE
+
+        return outcomes
+
+    def compute(self):
+        """
+        Return the average precisions of all classes and the mean average precision (mAP) of
+        all batches added so far.
+        """
+        # Classes are numbered from 1, and the background class 0 is added
+        n_classes = self.true_label_set.shape[0] + 1
+
+        labels = np.concatenate(self.labels) if self.labels else np.zeros((0), dtype=np.int64)
+        scores = np.concatenate(self.scores) if self.scores else np.zeros((0), dtype=np.float32)
+        outcomes = np.concatenate(self.outcomes) if self.outcomes else np.zeros((0), np.int8)
+
+        # Sort detections by class and in decreasing order of confidence/scores
+        order = np.lexsort((-scores, labels))
+        labels = labels[order]
+        true_positives = (outcomes[order] == self.TRUE_POSITIVE).astype(np.float32)
+        false_positives = (outcomes[order] == self.FALSE_POSITIVE).astype(np.float32)
+        class_start = np.searchsorted(labels, np.arange(n_classes + 1), side='left')
+
+        recall_thresholds = np.arange(start=0, stop=1.1, step=.1).astype(np.float32)  # (11)
+        average_precisions = torch.zeros((n_classes - 1), dtype=torch.float)  # (n_classes - 1)
+        for c in range(1, n_classes):
+            start, end = class_start[c], class_start[c + 1]
+            if start == end:
+                continue
+            n_easy_class_objects = self.n_easy_objects[c] \
+                if c < self.n_easy_objects.shape[0] else 0
+
+            # Compute cumulative precision and recall at each detection in the order of
+            # decreasing scores
+            cumul_true_positives = np.cumsum(true_positives[start:end])  # (n_class_detections)
+            cumul_false_positives = np.cumsum(false_positives[start:end])
+            cumul_precision = cumul_true_positives / (
+                cumul_true_positives + cumul_false_positives + np.float32(1e-10))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cumul_recall = cumul_true_positives / np.float32(n_easy_class_objects)
+
+            # Find the mean of the maximum of the precisions corresponding to recalls above the
+            # threshold 't'. Recall does not decrease, so these are suffixes of the detections.
+            if np.isnan(cumul_recall).any():
                 continue
+            max_precision = np.maximum.accumulate(cumul_precision[::-1])[::-1]
+            first_above_t = np.searchsorted(cumul_recall, recall_thresholds, side='left')
+            precisions = np.zeros((recall_thresholds.shape[0]), dtype=np.float32)  # (11)
+            above_t = first_above_t < cumul_recall.shape[0]
+            precisions[above_t] = max_precision[first_above_t[above_t]]
+            average_precisions[c - 1] = torch.from_numpy(precisions).mean()
 
-            # Find maximum overlap of this detection with objects in this image of this class
-            overlaps = find_jaccard_overlap(this_detection_box, object_boxes)
-            # (1, n_class_objects_in_img)
-            max_overlap, ind = torch.max(overlaps.squeeze(0), dim=0)  # (), () - scalars
-
-            # 'ind' is the index of the object in these image-level tensors 'object_boxes',
-            # 'object_difficulties'
-            # In the original class-level tensors 'true_class_boxes', etc., 'ind' corresponds to
-            # object with index
-            original_ind = torch.LongTensor(range(true_class_boxes.size(0)))[
-                true_class_images == this_image][ind]
-            # We need 'original_ind' to update 'true_class_boxes_detected'
-
-            # If the maximum overlap is greater than the threshold of 0.5, it's a match
-            if max_overlap.item() > 0.5:
-                # If the object it matched with is 'difficult', ignore it
-                if object_difficulties[ind] == 0:
-                    # If this object has already not been detected, it's a true positive
-                    if true_class_boxes_detected[original_ind] == 0:
-                        true_positives[d] = 1
-                        # this object has now been detected/accounted for
-                        true_class_boxes_detected[original_ind] = 1
-                    # Otherwise, it's a false positive (since this object is already accounted for)
-                    else:
-                        false_positives[d] = 1
-            # Otherwise, the detection occurs in a different location than the actual object, and
-            # is a false positive
-            else:
-                false_positives[d] = 1
-
-        # Compute cumulative precision and recall at each detection in the order of decreasing
-        # scores
-        cumul_true_positives = torch.cumsum(true_positives, dim=0)  # (n_class_detections)
-        cumul_false_positives = torch.cumsum(false_positives, dim=0)  # (n_class_detections)
-        cumul_precision = cumul_true_positives / (
-                cumul_true_positives + cumul_false_positives + 1e-10)  # (n_class_detections)
-        cumul_recall = cumul_true_positives / n_easy_class_objects  # (n_class_detections)
-
-        # Find the mean of the maximum of the precisions corresponding to recalls above the
-        # threshold 't'
-        recall_thresholds = torch.arange(start=0, end=1.1, step=.1).tolist()  # (11)
-        precisions = torch.zeros((len(recall_thresholds)), dtype=torch.float)  # (11)
-        for i, t in enumerate(recall_thresholds):
-            recalls_above_t = cumul_recall >= t
-            if recalls_above_t.any():
-                precisions[i] = cumul_precision[recalls_above_t].max()
-            else:
-                precisions[i] = 0.
-        average_precisions[c - 1] = precisions.mean()  # c is in [1, n_classes - 1]
-
-    # Calculate Mean Average Precision (mAP)
-    mean_average_precision = average_precisions.mean().item()
-
-    return average_precisions, mean_average_precision
+        # Calculate Mean Average Precision (mAP)
+        mean_average_precision = average_precisions.mean().item()
+
+        return average_precisions, mean_average_precision
 
 
 def xy_to_cxcy(xy):
@@ -291,3 +321,87 @@ def find_jaccard_overlap(set_1, set_2):
     union = areas_set_1.unsqueeze(1) + areas_set_2.unsqueeze(0) - intersection  # (n1, n2)
 
     return intersection / union  # (n1, n2)
+
+
+def find_paired_jaccard_overlap(set_1, set_2):
+    """
+    Find the Jaccard Overlap (IoU) of the corresponding boxes of two sets of boxes that are in
+    boundary coordinates.
+
+    :param set_1: set 1, a tensor of dimensions (n, 4)
+    :param set_2: set 2, a tensor of dimensions (n, 4)
+    :return: Jaccard Overlap of each box in set 1 with the box at the same index in set 2, a
+    tensor of dimensions (n)
+    """
+    lower_bounds = torch.max(set_1[:, :2], set_2[:, :2])  # (n, 2)
+    upper_bounds = torch.min(set_1[:, 2:], set_2[:, 2:])  # (n, 2)
+    intersection_dims = torch.clamp(upper_bounds - lower_bounds, min=0)  # (n, 2)
+    intersection = intersection_dims[:, 0] * intersection_dims[:, 1]  # (n)
+
+    areas_set_1 = (set_1[:, 2] - set_1[:, 0]) * (set_1[:, 3] - set_1[:, 1])  # (n)
+    areas_set_2 = (set_2[:, 2] - set_2[:, 0]) * (set_2[:, 3] - set_2[:, 1])  # (n)
+    union = areas_set_1 + areas_set_2 - intersection  # (n)
+
+    return intersection / union  # (n)
+
+
+def batched_nms(boxes, scores, groups, max_overlap, chunk_size=4096):
+    """
+    Greedy Non-Maximum Suppression (NMS), applied independently to each group of boxes (e.g., to
+    each class of each image) and vectorized over all groups.
+
+    The boxes are sorted by group and by decreasing score, and the IoU matrix of each chunk of
+    whole groups is computed at once. A box is kept when no kept box of the same group with a
+    higher score overlaps it by more than `max_overlap`. This is solved by fixed-point iteration
+    over the whole chunk, which gives exactly the result of the sequential greedy algorithm.
+
+    :param boxes: boxes in boundary coordinates, a tensor of dimensions (n_boxes, 4)
+    :param scores: scores of the boxes, a tensor of dimensions (n_boxes)
+    :param groups: integer group of each box, a tensor of dimensions (n_boxes)
+    :param max_overlap: maximum overlap two boxes of a group can have so that the one with the
+    lower score is not suppressed
+    :param chunk_size: number of boxes (of whole groups) whose overlaps are computed at once
+    :return: indices of the kept boxes, sorted by group and by decreasing score within each group
+    """
+    n_boxes = scores.size(0)
+    if n_boxes == 0:
+        return torch.zeros((0), dtype=torch.long, device=scores.device)
+
+    # Sort by group, then by decreasing score
+    score_order = scores.argsort(descending=True)
+    score_rank = torch.empty_like(score_order)
+    score_rank[score_order] = torch.arange(n_boxes, device=scores.device)
+    order = (groups.long() * n_boxes + score_rank).argsort()
+    groups = groups[order]
+
+    # Split into chunks of whole groups
+    _, group_sizes = torch.unique_consecutive(groups, return_counts=True)
+    chunks = []
+    start = end = 0
+    for size in group_sizes.tolist():
+        if end > start and end + size - start > chunk_size:
+            chunks.append((start, end))
+            start = end
+        end += size
+    chunks.append((start, end))
+
+    keep = []
+    for start, end in chunks:
+        chunk = order[start:end]
+        n = end - start
+
+        # suppresses[i, j]: box i suppresses box j if it is kept
+        overlap = find_jaccard_overlap(boxes[chunk], boxes[chunk])  # (n, n)
+        suppresses = (overlap > max_overlap) \
+            & (groups[start:end].unsqueeze(1) == groups[start:end].unsqueeze(0)) \
+            & torch.ones((n, n), dtype=torch.bool, device=scores.device).triu(1)
+
+        chunk_keep = torch.ones((n), dtype=torch.bool, device=scores.device)
+        while True:
+            new_keep = ~(suppresses & chunk_keep.unsqueeze(1)).any(dim=0)
+            if torch.equal(new_keep, chunk_keep):
+                break
+            chunk_keep = new_keep
+        keep.append(chunk[chunk_keep])
+
+    return torch.cat(keep, dim=0)